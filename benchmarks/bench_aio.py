@@ -0,0 +1,120 @@
+"""
+Event throughput of the asyncio front-end against the Twisted client: the
+same session replayed by the fake gateway, counted by a plain handler on
+the default reactor, a plain handler on the asyncio reactor and a
+coroutine handler. Each run gets its own process, as the reactor can only
+be installed once.
+
+    python -m benchmarks.bench_aio [--messages N] [fake_server options]
+
+Reports MESSAGE_CREATE events handled per second and CPU time per event.
+"""
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_gateway import cpu_time, start_server
+
+modes = ('twisted', 'asyncio', 'asyncio-coroutine')
+
+
+def run_twisted(argv, messages):
+    from twisted.internet import defer, task
+
+    from chord.client import Client
+    from chord.util import HTTPClient
+
+    @defer.inlineCallbacks
+    def main(reactor):
+        process, gateway_url, api_base, frames = start_server(argv)
+        http = HTTPClient(reactor, api_base=api_base)
+        client = Client(reactor, token='fake-token', http=http, cache=True)
+        done = defer.Deferred()
+        times = []
+
+        @client.event
+        def on_message_create(data):
+            times.append(time.time())
+            if len(times) == messages:
+                done.callback(None)
+        try:
+            cpu = cpu_time()
+            gateway = yield client.fetch_gateway()
+            yield client.connect(gateway)
+            yield done
+            report('twisted', messages, times, cpu_time() - cpu)
+        finally:
+            client.disconnect('done')
+            yield http.close()
+            process.terminate()
+            process.wait()
+
+    task.react(main)
+
+
+def run_asyncio(argv, messages, coroutine):
+    import asyncio
+
+    from chord.aio import AsyncClient
+    from chord.util import HTTPClient
+
+    async def main():
+        process, gateway_url, api_base, frames = start_server(argv)
+        client = AsyncClient(token='fake-token', cache=True)
+        client.client.http = HTTPClient(client.reactor, api_base=api_base)
+        done = asyncio.get_running_loop().create_future()
+        times = []
+
+        def count(data):
+            times.append(time.time())
+            if len(times) == messages:
+                done.set_result(None)
+        if coroutine:
+            async def on_message_create(data):
+                count(data)
+        else:
+            def on_message_create(data):
+                count(data)
+        client.event(on_message_create)
+        try:
+            cpu = cpu_time()
+            await client.connect()
+            await done
+            report('asyncio-coroutine' if coroutine else 'asyncio', messages, times, cpu_time() - cpu)
+        finally:
+            await client.close()
+            process.terminate()
+            process.wait()
+
+    asyncio.run(main())
+
+
+def report(mode, messages, times, cpu):
+    print('{0:<18} {1:>8} {2:>12.0f} {3:>12.1f}'.format(
+        mode, messages, messages / (times[-1] - times[0]), cpu / messages * 1e6))
+    sys.stdout.flush()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=modes)
+    parser.add_argument('--messages', type=int, default=10000)
+    args, server_argv = parser.parse_known_args(argv)
+    server_argv += ['--messages', str(args.messages)]
+
+    if args.mode == 'twisted':
+        return run_twisted(server_argv, args.messages)
+    elif args.mode is not None:
+        return run_asyncio(server_argv, args.messages, args.mode == 'asyncio-coroutine')
+
+    print('{0:<18} {1:>8} {2:>12} {3:>12}'.format('mode', 'events', 'events/s', 'cpu us/ev'))
+    sys.stdout.flush()
+    for mode in modes:
+        subprocess.check_call([sys.executable, '-m', 'benchmarks.bench_aio', '--mode', mode] + argv)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,70 @@
+"""
+Memory used by the entity cache per 10k guild members, compared with
+keeping the decoded GUILD_CREATE payloads around, and the cost of a
+member lookup with string and integer ids.
+
+    python -m benchmarks.bench_cache_memory [members ...]
+"""
+from __future__ import print_function
+
+import gc
+import json
+import sys
+import timeit
+
+from benchmarks import payloads
+from chord.snowflake import int_ids
+from chord.state import ConnectionState
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        keep = build()
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del keep
+    return current, peak
+
+
+def main(argv):
+    if tracemalloc is None:
+        print('tracemalloc is not available on this interpreter')
+        return
+    sizes = [int(a) for a in argv] or [1000, 10000, 50000]
+
+    print('{0:>8} {1:>5} {2:>14} {3:>14} {4:>14} {5:>8} {6:>12}'.format(
+        'members', 'ids', 'raw MB/10k', 'cache MB/10k', 'cache peak MB', 'ratio', 'lookup ns'))
+    for members in sizes:
+        frame = payloads.encode(payloads.guild_create(members=members))
+        for ids in ('str', 'int'):
+            hook = int_ids if ids == 'int' else None
+            raw, _ = measure(lambda: json.loads(frame, object_hook=hook))
+
+            def build_cache():
+                state = ConnectionState(int_ids=ids == 'int')
+                state.apply('GUILD_CREATE', json.loads(frame, object_hook=hook)['d'])
+                return state
+            cached, peak = measure(build_cache)
+
+            state = build_cache()
+            guild = next(iter(state.guilds))
+            keys = [(guild, user_id) for user_id in state.get_guild(guild).members]
+            get = state.members.get
+            lookup = min(timeit.repeat(lambda: [get(key) for key in keys], number=1, repeat=5)) / len(keys)
+
+            scale = 10000.0 / members / 1e6
+            print('{0:>8} {1:>5} {2:>14.2f} {3:>14.2f} {4:>14.2f} {5:>8.2f} {6:>12.0f}'.format(
+                members, ids, raw * scale, cached * scale, peak / 1e6, float(raw) / cached, lookup * 1e9))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
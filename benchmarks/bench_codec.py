@@ -0,0 +1,41 @@
+"""
+Compare the gateway codecs on recorded or synthetic payloads.
+
+    python -m benchmarks.bench_codec [recorded.jsonl ...]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from benchmarks import payloads
+from chord.codec import available_codecs, get_codec
+
+
+def bench(codec, frames, repeat=5):
+    objects = [codec.loads(frame) for frame in frames]
+    loads = min(timeit.repeat(lambda: [codec.loads(f) for f in frames], number=1, repeat=repeat))
+    dumps = min(timeit.repeat(lambda: [codec.dumps(o) for o in objects], number=1, repeat=repeat))
+    return loads, dumps
+
+
+def main(argv):
+    samples = {}
+    for path in argv:
+        samples.update(payloads.load(path))
+    if not samples:
+        samples = payloads.synthetic()
+
+    codecs = available_codecs()
+    print('{0:<18} {1:>7} {2:>10} {3:>8} {4:>12} {5:>12}'.format('sample', 'frames', 'bytes', 'codec', 'loads MB/s', 'dumps MB/s'))
+    for name in sorted(samples):
+        frames = samples[name]
+        size = sum(len(f) for f in frames)
+        for codec_name in codecs:
+            loads, dumps = bench(get_codec(codec_name), frames)
+            print('{0:<18} {1:>7} {2:>10} {3:>8} {4:>12.1f} {5:>12.1f}'.format(
+                name, len(frames), size, codec_name, size / loads / 1e6, size / dumps / 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
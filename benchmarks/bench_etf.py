@@ -0,0 +1,63 @@
+"""
+Compare the ETF gateway encoding with the JSON codecs on recorded or
+synthetic large-guild traffic: size on the wire and decode throughput.
+
+    python -m benchmarks.bench_etf [recorded.jsonl ...]
+
+ETF frames are encoded with snowflakes as integers, as the gateway sends
+them. Rates are in frames per second and MB of JSON per second, so the
+codecs are compared on the same amount of data.
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+import zlib
+
+from benchmarks import payloads
+from chord import etf
+from chord.codec import available_codecs, get_codec
+
+
+def snowflakes_as_ints(obj):
+    if isinstance(obj, dict):
+        return dict((key, int(value) if (key == 'id' or key.endswith('_id')) and isinstance(value, str)
+                     and value.isdigit() else snowflakes_as_ints(value)) for key, value in obj.items())
+    if isinstance(obj, list):
+        return [snowflakes_as_ints(value) for value in obj]
+    return obj
+
+
+def decode_time(codec, frames, repeat=3):
+    return min(timeit.repeat(lambda: [codec.loads(f) for f in frames], number=1, repeat=repeat))
+
+
+def main(argv):
+    samples = {}
+    for path in argv:
+        samples.update(payloads.load(path))
+    if not samples:
+        samples = payloads.synthetic()
+
+    codecs = [(name, get_codec(name)) for name in available_codecs()]
+    codecs.append(('etf', etf.ETFCodec(accelerated=False)))
+    if etf.erlpack is not None:
+        codecs.append(('erlpack', etf.ETFCodec()))
+
+    print('{0:<18} {1:>7} {2:>8} {3:>10} {4:>10} {5:>12} {6:>12}'.format(
+        'sample', 'frames', 'codec', 'bytes', 'zlib', 'frames/s', 'JSON MB/s'))
+    for name in sorted(samples):
+        frames = samples[name]
+        json_size = sum(len(f) for f in frames)
+        objects = [get_codec('json').loads(f) for f in frames]
+        etf_frames = [etf.encode(snowflakes_as_ints(o)) for o in objects]
+        for codec_name, codec in codecs:
+            encoded = etf_frames if codec.encoding == 'etf' else frames
+            elapsed = decode_time(codec, encoded)
+            print('{0:<18} {1:>7} {2:>8} {3:>10} {4:>10} {5:>12.0f} {6:>12.1f}'.format(
+                name, len(frames), codec_name, sum(len(f) for f in encoded),
+                sum(len(zlib.compress(f)) for f in encoded), len(frames) / elapsed, json_size / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,107 @@
+"""
+End to end gateway throughput: a real Client receiving a session replayed
+by the fake gateway (running in a separate process, so only the client is
+measured), for every compression and codec mode, and the ETF encoding.
+
+    python -m benchmarks.bench_gateway [fake_server options]
+
+Reports events per second, p99 time spent handling a dispatch, CPU time
+per event and the growth of the peak resident set size.
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+import time
+
+from twisted.internet import defer, task
+
+from chord.client import Client
+from chord.codec import available_codecs
+from chord.incremental import peak_memory
+from chord.reconnect import ReconnectCoordinator
+from chord.util import HTTPClient
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+compressions = (None, 'payload', 'zlib-stream')
+
+
+class BenchClient(Client):
+    def __init__(self, expected, *args, **kwargs):
+        Client.__init__(self, *args, **kwargs)
+        self.expected = expected
+        self.latencies = []
+        self.done = defer.Deferred()
+        self.started = None
+
+    def handle_event(self, event, data, shard_id=None):
+        started = time.time()
+        if self.started is None:
+            self.started = started
+        Client.handle_event(self, event, data, shard_id)
+        self.latencies.append(time.time() - started)
+        if len(self.latencies) == self.expected:
+            self.finished = time.time()
+            self.done.callback(None)
+
+
+def cpu_time():
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def start_server(argv):
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_server'] + argv,
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    gateway_url, api_base, frames = process.stdout.readline().split()
+    return process, gateway_url, api_base, int(frames)
+
+
+@defer.inlineCallbacks
+def run(reactor, argv, compression, codec):
+    # The fake gateway switches to ETF for connections asking for it
+    encoding = 'etf' if codec == 'etf' else 'json'
+    process, gateway_url, api_base, frames = start_server(argv + ['--codec', 'json' if encoding == 'etf' else codec])
+    http = HTTPClient(reactor, api_base=api_base)
+    client = BenchClient(frames, reactor, token='fake-token', http=http, compression=compression,
+                         codec=None if encoding == 'etf' else codec, encoding=encoding, cache=True,
+                         coordinator=ReconnectCoordinator(reactor, identify_interval=0))
+    try:
+        memory = peak_memory()
+        cpu = cpu_time()
+        gateway = yield client.fetch_gateway()
+        yield client.connect(gateway)
+        yield client.done
+        cpu = cpu_time() - cpu
+        memory = peak_memory() - memory
+
+        elapsed = client.finished - client.started
+        latencies = sorted(client.latencies)
+        print('{0:<12} {1:>7} {2:>8} {3:>12.0f} {4:>12.3f} {5:>12.1f} {6:>10.1f}'.format(
+            str(compression), codec, frames, frames / elapsed,
+            latencies[int(len(latencies) * 0.99)] * 1000, cpu / frames * 1e6, memory / 1e6))
+    finally:
+        client.disconnect('done')
+        yield http.close()
+        process.terminate()
+        process.wait()
+
+
+@defer.inlineCallbacks
+def main(reactor, argv):
+    print('{0:<12} {1:>7} {2:>8} {3:>12} {4:>12} {5:>12} {6:>10}'.format(
+        'compression', 'codec', 'events', 'events/s', 'p99 ms', 'cpu us/ev', 'peak +MB'))
+    for codec in available_codecs() + ['etf']:
+        for compression in compressions:
+            yield run(reactor, argv, compression, codec)
+
+
+if __name__ == '__main__':
+    task.react(main, [sys.argv[1:]])
@@ -0,0 +1,71 @@
+"""
+Compare IncrementalParser with a single codec.loads on large READY and
+GUILD_CREATE frames: total parse time, how long the reactor is blocked
+between two yields (median and longest), and peak memory.
+
+    python -m benchmarks.bench_incremental
+"""
+from __future__ import print_function
+
+import sys
+import time
+import tracemalloc
+
+from benchmarks import payloads
+from chord.codec import get_codec
+from chord.incremental import IncrementalParser, depths
+
+
+def loads(codec, frame):
+    start = time.perf_counter()
+    codec.loads(frame)
+    return [time.perf_counter() - start]
+
+
+def incremental(frame, event, slice_size):
+    slices = []
+    last = time.perf_counter()
+    for _ in IncrementalParser(frame, depths[event], slice_size).parse():
+        now = time.perf_counter()
+        slices.append(now - last)
+        last = now
+    slices.append(time.perf_counter() - last)
+    return slices
+
+
+def measure(func, *args):
+    """
+    Total time, median and longest stretch without yielding (untraced), and
+    peak memory (traced run).
+    """
+    slices = sorted(func(*args))
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return sum(slices), slices[len(slices) // 2], slices[-1], peak
+
+
+def main(argv):
+    codec = get_codec('json')
+    samples = [
+        ('READY', payloads.encode(payloads.ready(guilds=100, members=50))),
+        ('GUILD_CREATE', payloads.encode(payloads.guild_create(members=5000))),
+        ('GUILD_CREATE', payloads.encode(payloads.guild_create(members=50000))),
+    ]
+    print('{0:<14} {1:>6} {2:>14} {3:>9} {4:>10} {5:>11} {6:>8}'.format(
+        'event', 'MB', 'parser', 'total ms', 'median ms', 'longest ms', 'peak MB'))
+    for event, frame in samples:
+        size = len(frame) / 1e6
+        rows = [('codec.loads',) + measure(loads, codec, frame)]
+        for slice_size in (200, 1000):
+            rows.append(('slices of {0}'.format(slice_size),) + measure(incremental, frame, event, slice_size))
+        for name, total, median, longest, peak in rows:
+            print('{0:<14} {1:>6.1f} {2:>14} {3:>9.1f} {4:>10.2f} {5:>11.2f} {6:>8.1f}'.format(
+                event, size, name, total * 1000, median * 1000, longest * 1000, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
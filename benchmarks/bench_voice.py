@@ -0,0 +1,58 @@
+"""
+Timing of the voice sender: plays synthetic Opus frames to the fake voice
+server's UDP sink and reports how regularly the packets arrived.
+
+    python -m benchmarks.bench_voice [seconds] [load_ms]
+
+C{load_ms} blocks the reactor for that long every 100 ms, to show how the
+sender catches up after a stall.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+from twisted.internet import defer, task
+
+from chord import voice
+from chord.testing import FakeVoiceServer
+
+
+def frames(count, size=120):
+    return [os.urandom(size) for _ in range(count)]
+
+
+@defer.inlineCallbacks
+def main(reactor, argv):
+    seconds = float(argv[0]) if argv else 10.0
+    load = float(argv[1]) / 1000 if len(argv) > 1 else 0.0
+
+    server = FakeVoiceServer(reactor=reactor).start()
+    connection = voice.VoiceConnection(server.endpoint, '1', '2', 'session', server.token, reactor=reactor)
+    yield connection.connect()
+
+    stall = None
+    if load:
+        stall = task.LoopingCall(time.sleep, load)
+        stall.start(0.1, now=False)
+    stats = yield connection.play(voice.OpusPacketSource(frames(int(seconds / voice.FRAME_DURATION))))
+    if stall is not None:
+        stall.stop()
+    yield task.deferLater(reactor, 0.1, lambda: None)
+
+    jitter = server.sink.jitter()
+    print('mode {0}, {1} frames in {2:.2f}s, {3} late ticks, {4} skipped, {5} underruns'.format(
+        connection.mode, stats['frames'], stats['duration'], stats['late'], stats['skipped'], stats['underruns']))
+    print('{0:>8} {1:>14} {2:>14} {3:>14} {4:>14} {5:>12}'.format(
+        'packets', 'interval ms', 'mean dev ms', 'p99 dev ms', 'max dev ms', 'rfc3550 ms'))
+    print('{0:>8} {1:>14.3f} {2:>14.3f} {3:>14.3f} {4:>14.3f} {5:>12.3f}'.format(
+        jitter['packets'], jitter['mean_interval'] * 1000, jitter['mean_deviation'] * 1000,
+        jitter['p99_deviation'] * 1000, jitter['max_deviation'] * 1000, jitter['rfc3550'] * 1000))
+
+    yield connection.disconnect()
+    yield server.stop()
+
+
+if __name__ == '__main__':
+    task.react(main, [sys.argv[1:]])
@@ -0,0 +1,43 @@
+"""
+Serve a synthetic or recorded session with the fake gateway and REST API.
+
+    python -m benchmarks.fake_server [--recorded session.jsonl] [--messages N] ...
+
+Prints the gateway URL and the API base on the first line of output.
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+
+from twisted.internet import reactor
+
+from benchmarks import payloads
+from chord.testing import FakeDiscord
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--recorded', help='recorded session, one gateway frame per line')
+    parser.add_argument('--guilds', type=int, default=100, help='guilds in READY')
+    parser.add_argument('--members', type=int, default=50, help='members per guild in READY')
+    parser.add_argument('--guild-creates', type=int, default=20, help='GUILD_CREATE dispatches')
+    parser.add_argument('--guild-members', type=int, default=5000, help='members per GUILD_CREATE')
+    parser.add_argument('--messages', type=int, default=10000, help='MESSAGE_CREATE dispatches')
+    parser.add_argument('--codec', default='json')
+    args = parser.parse_args(argv)
+
+    if args.recorded:
+        session = payloads.load_session(args.recorded)
+    else:
+        session = payloads.session(args.guilds, args.members, args.guild_creates, args.guild_members, args.messages)
+
+    discord = FakeDiscord(session, codec=args.codec).start()
+    discord.gateway.encoded()
+    print(discord.gateway_url, discord.api_base, len(session))
+    sys.stdout.flush()
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,178 @@
+"""
+Gateway payloads for the benchmarks.
+
+Recorded sessions can be supplied as files holding one raw gateway frame
+(JSON) per line; otherwise synthetic frames shaped like real READY,
+GUILD_CREATE and MESSAGE_CREATE dispatches are generated.
+"""
+import json
+import random
+
+DISCORD_EPOCH = 1420070400000
+
+
+def snowflake(rng, ms=None):
+    if ms is None:
+        ms = rng.randint(0, 50000000000)
+    return str((ms << 22) | rng.randint(0, (1 << 22) - 1))
+
+
+def user(rng):
+    return {
+        'id': snowflake(rng),
+        'username': 'user{0}'.format(rng.randint(0, 999999)),
+        'discriminator': '{0:04d}'.format(rng.randint(0, 9999)),
+        'avatar': '%032x' % rng.getrandbits(128),
+        'bot': False
+    }
+
+
+def member(rng, roles):
+    return {
+        'user': user(rng),
+        'roles': rng.sample(roles, min(len(roles), rng.randint(0, 3))),
+        'nick': None,
+        'joined_at': '2016-05-{0:02d}T12:00:00.000000+00:00'.format(rng.randint(1, 28)),
+        'deaf': False,
+        'mute': False
+    }
+
+
+def guild(rng, members=100, channels=20, roles=10):
+    guild_id = snowflake(rng)
+    role_list = [{
+        'id': snowflake(rng),
+        'name': 'role{0}'.format(i),
+        'permissions': 104324161,
+        'position': i,
+        'color': rng.randint(0, 0xffffff),
+        'hoist': False,
+        'managed': False,
+        'mentionable': False
+    } for i in range(roles)]
+    role_ids = [r['id'] for r in role_list]
+    member_list = [member(rng, role_ids) for _ in range(members)]
+    return {
+        'id': guild_id,
+        'name': 'guild {0}'.format(guild_id),
+        'owner_id': member_list[0]['user']['id'] if member_list else snowflake(rng),
+        'region': 'us-east',
+        'large': members > 250,
+        'member_count': members,
+        'roles': role_list,
+        'channels': [{
+            'id': snowflake(rng),
+            'name': 'channel{0}'.format(i),
+            'type': 'text',
+            'position': i,
+            'topic': None,
+            'permission_overwrites': [],
+            'last_message_id': snowflake(rng)
+        } for i in range(channels)],
+        'members': member_list,
+        'presences': [{
+            'user': {'id': m['user']['id']},
+            'status': rng.choice(['online', 'idle', 'dnd']),
+            'game': None
+        } for m in member_list[:members // 2]]
+    }
+
+
+def dispatch(event, data, seq):
+    return {'op': 0, 's': seq, 't': event, 'd': data}
+
+
+def ready(guilds=100, members=50, seed=0):
+    rng = random.Random(seed)
+    return dispatch('READY', {
+        'v': 6,
+        'user': user(rng),
+        'session_id': '%032x' % rng.getrandbits(128),
+        'heartbeat_interval': 41250,
+        'private_channels': [],
+        'guilds': [guild(rng, members=members) for _ in range(guilds)]
+    }, 1)
+
+
+def guild_create(members=5000, seed=0):
+    rng = random.Random(seed)
+    return dispatch('GUILD_CREATE', guild(rng, members=members), 2)
+
+
+def message_create(seed=0, seq=3):
+    rng = random.Random(seed)
+    return dispatch('MESSAGE_CREATE', {
+        'id': snowflake(rng),
+        'channel_id': snowflake(rng),
+        'author': user(rng),
+        'content': 'hello world ' * rng.randint(1, 10),
+        'timestamp': '2016-06-01T12:00:00.000000+00:00',
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'attachments': [],
+        'embeds': [],
+        'nonce': snowflake(rng)
+    }, seq)
+
+
+def presence_update(seed=0, seq=4):
+    rng = random.Random(seed)
+    return dispatch('PRESENCE_UPDATE', {
+        'user': {'id': snowflake(rng)},
+        'guild_id': snowflake(rng),
+        'status': 'online',
+        'roles': [snowflake(rng)],
+        'game': {'name': 'chord'}
+    }, seq)
+
+
+def synthetic():
+    """
+    Return a dict of sample name to list of encoded frames.
+    """
+    return {
+        'READY': [encode(ready())],
+        'GUILD_CREATE': [encode(guild_create())],
+        'MESSAGE_CREATE': [encode(message_create(seed=i, seq=i)) for i in range(1000)],
+        'PRESENCE_UPDATE': [encode(presence_update(seed=i, seq=i)) for i in range(1000)]
+    }
+
+
+def session(guilds=100, members=50, guild_creates=20, guild_members=5000, messages=10000, seed=0):
+    """
+    Return the frames of a synthetic session: READY, a GUILD_CREATE storm
+    and a MESSAGE_CREATE flood.
+    """
+    frames = [ready(guilds=guilds, members=members, seed=seed)]
+    frames.extend(guild_create(members=guild_members, seed=seed + i) for i in range(guild_creates))
+    frames.extend(message_create(seed=seed + i) for i in range(messages))
+    return frames
+
+
+def load_session(path):
+    """
+    Load the frames of a recorded session, in order.
+    """
+    with open(path, 'rb') as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def load(path):
+    """
+    Load a recorded session, grouping its frames by event name.
+    """
+    samples = {}
+    with open(path, 'rb') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line).get('t') or 'OP'
+            samples.setdefault(event, []).append(line)
+    return samples
+
+
+def encode(frame):
+    return json.dumps(frame, separators=(',', ':')).encode('utf8')
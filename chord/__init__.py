@@ -11,6 +11,13 @@ import sys
 __user_agent__ = "chord (https://github.com/maxpowa/chord {0}) Python/{1[0]}.{1[1]}".format(__version__, sys.version_info)
 
 from chord.client import Client
+from chord.sharding import ShardManager
 from chord.errors import *
-from chord.util import start_logging, get_token, invalidate_token, get_gateway, check_token, get_user_for_token
-from chord.util import http_patch, http_post
+from chord.executor import HandlerExecutor, inline
+from chord.metrics import Metrics, listen_metrics
+from chord.reconnect import ReconnectCoordinator
+from chord.rest import RESTClient, Route
+from chord.snowflake import snowflake_time, time_snowflake, snowflake_range
+from chord.voice import VoiceConnection, PCMSource, OpusPacketSource, OpusEncoder
+from chord.util import start_logging, get_token, invalidate_token, get_gateway, get_gateway_bot, check_token, get_user_for_token
+from chord.util import http_patch, http_post, HTTPClient, get_http_client
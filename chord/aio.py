@@ -0,0 +1,190 @@
+"""
+An asyncio front-end for L{Client} (Python 3).
+
+Twisted runs on the asyncio event loop through its C{asyncioreactor}, so the
+gateway protocol, caches and rate limits are the same as with the Twisted
+API, and events reach coroutine handlers on the loop that runs them, with
+no thread in between::
+
+    async def main():
+        cli = AsyncClient(token=token, cache=True)
+
+        @cli.event
+        async def on_message_create(data):
+            if data['content'] == '!ping':
+                await cli.rest.send_message(data['channel_id'], 'pong')
+
+        await cli.connect()
+        await cli.wait_for('READY')
+        ...
+        await cli.close()
+
+    asyncio.run(main())
+
+The reactor must be installed before anything imports
+C{twisted.internet.reactor}: create the first L{AsyncClient} (or call
+L{install}) before using other Twisted code.
+"""
+import asyncio
+import inspect
+import sys
+
+from twisted.internet import defer
+from twisted.internet.error import ReactorAlreadyInstalledError
+from twisted.logger import Logger
+from twisted.python.failure import Failure
+
+from chord.client import Client
+
+
+def install(loop=None):
+    """
+    Return the reactor running on C{loop} (the running loop by default),
+    installing it if no reactor is installed yet.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if 'twisted.internet.reactor' not in sys.modules:
+        from twisted.internet import asyncioreactor
+        asyncioreactor.install(loop)
+    from twisted.internet import reactor
+    if getattr(reactor, '_asyncioEventloop', None) is not loop:
+        raise ReactorAlreadyInstalledError(
+            'A reactor not running on this asyncio loop is installed: {0!r}'.format(reactor))
+    return reactor
+
+
+def as_future(d, loop):
+    """
+    Await a Deferred (or return a plain value) on C{loop}.
+    """
+    if isinstance(d, defer.Deferred):
+        return d.asFuture(loop)
+    future = loop.create_future()
+    future.set_result(d)
+    return future
+
+
+class AsyncioClient(Client):
+    """
+    L{Client} calling coroutine handlers as tasks on the reactor's loop.
+    """
+    def __init__(self, loop, **kwargs):
+        self.loop = loop
+        Client.__init__(self, **kwargs)
+
+    def call_handler(self, event, func, args, kwargs):
+        if inspect.iscoroutinefunction(func):
+            task = self.loop.create_task(func(*args, **kwargs))
+            task.add_done_callback(self._handler_done)
+        else:
+            Client.call_handler(self, event, func, args, kwargs)
+
+    def _handler_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            self.log.failure('Event handler failed', failure=Failure(error, type(error), error.__traceback__))
+
+
+class AsyncREST(object):
+    """
+    The L{RESTClient} methods, as coroutines.
+    """
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        method = getattr(self._client.client.rest, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await as_future(method(*args, **kwargs), self._client.loop)
+        call.__name__ = name
+        return call
+
+
+class AsyncClient(object):
+    """
+    Coroutine API over an L{AsyncioClient}; keyword arguments are those of
+    L{Client}.
+    """
+    log = Logger()
+
+    def __init__(self, loop=None, **kwargs):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.reactor = install(loop)
+        self.client = AsyncioClient(loop, reactor=self.reactor, **kwargs)
+        self.rest = AsyncREST(self)
+
+    def _start(self):
+        # Fire the reactor startup triggers (starting its thread pool, used
+        # to resolve names) without running a loop of its own
+        if not self.reactor.running:
+            self.reactor.startRunning(installSignalHandlers=False)
+
+    def _await(self, d):
+        return as_future(d, self.loop)
+
+    @property
+    def state(self):
+        return self.client.state
+
+    @property
+    def token(self):
+        return self.client.token
+
+    def event(self, func):
+        """
+        Register C{func}, a coroutine function or a plain function, as the
+        handler of the event named after it.
+        """
+        return self.client.event(func)
+
+    def add_listener(self, func, event=None, guild_id=None):
+        return self.client.add_listener(func, event, guild_id)
+
+    def remove_listener(self, func, event=None, guild_id=None):
+        return self.client.remove_listener(func, event, guild_id)
+
+    async def login(self, email, password):
+        self._start()
+        return await self._await(self.client.login(email, password))
+
+    async def fetch_gateway(self):
+        self._start()
+        return await self._await(self.client.fetch_gateway())
+
+    async def connect(self, gateway=None):
+        """
+        Connect to C{gateway}, fetched first if neither given nor known.
+        Returns once the websocket is open.
+        """
+        self._start()
+        if gateway is None and self.client._gateway is None:
+            gateway = await self.fetch_gateway()
+        return await self._await(self.client.connect(gateway))
+
+    async def wait_for(self, event, predicate=None, timeout=None):
+        return await self._await(self.client.wait_for(event, predicate, timeout))
+
+    async def request_members(self, guild_id):
+        return await self._await(self.client.request_members(guild_id))
+
+    async def join_voice(self, guild_id, channel_id, **kwargs):
+        return await self._await(self.client.join_voice(guild_id, channel_id, **kwargs))
+
+    def latency_stats(self):
+        return self.client.latency_stats()
+
+    async def close(self):
+        """
+        Disconnect and release the reactor's threads; the loop keeps
+        running.
+        """
+        await self._await(self.client.disconnect())
+        await self._await(self.client.http.close())
+        if self.reactor.threadpool is not None:
+            self.reactor.threadpool.stop()
@@ -0,0 +1,249 @@
+"""
+Storage policies for the entity cache.
+
+Each cached entity type (members, users, messages) is kept in one of these
+stores, chosen when constructing the L{Client}::
+
+    Client(cache_policies={
+        'members': LRUCache(200000),
+        'messages': TTLCache(600),
+    })
+
+Every store counts hits, misses and evictions.
+"""
+import time
+from collections import OrderedDict
+
+
+_missing = object()
+
+
+class Cache(object):
+    """
+    Keeps everything until it is removed explicitly.
+    """
+    enabled = True
+
+    def __init__(self):
+        self._data = self._new_storage()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Called with (key, value) when a value is evicted by the policy
+        self.on_evict = None
+
+    def _new_storage(self):
+        return {}
+
+    def get(self, key, default=None):
+        value = self._data.get(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Store C{value}, returning whether the policy accepted it.
+        """
+        self._data[key] = value
+        return True
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def values(self):
+        return list(self._data.values())
+
+    def items(self):
+        return list(self._data.items())
+
+    def _evicted(self, key, value):
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class NoCache(Cache):
+    """
+    Never stores anything.
+    """
+    enabled = False
+
+    def set(self, key, value):
+        return False
+
+
+class LRUCache(Cache):
+    """
+    Keeps at most C{max_size} entries, evicting the least recently used.
+    """
+    def __init__(self, max_size):
+        Cache.__init__(self)
+        self.max_size = max_size
+
+    def _new_storage(self):
+        return OrderedDict()
+
+    def get(self, key, default=None):
+        value = self._data.pop(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.max_size:
+            self._evicted(*self._data.popitem(last=False))
+        return True
+
+
+class TTLCache(Cache):
+    """
+    Evicts entries C{ttl} seconds after they were last stored.
+    """
+    def __init__(self, ttl, clock=time.time):
+        Cache.__init__(self)
+        self.ttl = ttl
+        self.clock = clock
+
+    def _new_storage(self):
+        return OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] <= self.clock():
+            self._expire()
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (self.clock() + self.ttl, value)
+        self._expire()
+        return True
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def values(self):
+        self._expire()
+        return [value for _, value in self._data.values()]
+
+    def items(self):
+        self._expire()
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def _expire(self):
+        now = self.clock()
+        # Entries are ordered by expiry, as every set() moves to the end.
+        while self._data:
+            key = next(iter(self._data))
+            expires, value = self._data[key]
+            if expires > now:
+                break
+            del self._data[key]
+            self._evicted(key, value)
+
+
+class ActiveGuildsCache(Cache):
+    """
+    Only keeps entities of the active guilds, in the C{inner} store
+    (unbounded by default). Entities are matched on their C{guild_id}.
+
+    A guild is active while the L{Client} has listeners scoped to it (see
+    C{Client.add_listener}), or while it is pinned: listed in C{guild_ids}
+    or passed to L{activate}, until L{deactivate}. Both are tracked apart,
+    so removing the last listener of a pinned guild keeps it, and
+    deactivating a guild that still has listeners keeps it too. Entities of
+    a guild that becomes active are cached from its next events; a guild
+    that stops being active has its entities evicted.
+    """
+    def __init__(self, guild_ids=(), inner=None):
+        self.inner = Cache() if inner is None else inner
+        self.pinned = set(guild_ids)
+        self.listened = set()
+        self.active = set(self.pinned)
+        Cache.__init__(self)
+        self.inner.on_evict = self._evicted
+
+    def activate(self, guild_id):
+        self.pinned.add(guild_id)
+        self.active.add(guild_id)
+
+    def deactivate(self, guild_id):
+        self.pinned.discard(guild_id)
+        if guild_id not in self.listened:
+            self._drop(guild_id)
+
+    def listen(self, guild_id):
+        """
+        Activate C{guild_id} for a listener scoped to it, see
+        L{chord.state.ConnectionState.set_guild_active}.
+        """
+        self.listened.add(guild_id)
+        self.active.add(guild_id)
+
+    def unlisten(self, guild_id):
+        self.listened.discard(guild_id)
+        if guild_id not in self.pinned:
+            self._drop(guild_id)
+
+    def _drop(self, guild_id):
+        self.active.discard(guild_id)
+        for key, value in list(self.items()):
+            if getattr(value, 'guild_id', None) == guild_id:
+                self.inner.pop(key)
+                self._evicted(key, value)
+
+    def items(self):
+        return self.inner.items()
+
+    def get(self, key, default=None):
+        value = self.inner.get(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if getattr(value, 'guild_id', None) not in self.active:
+            return False
+        return self.inner.set(key, value)
+
+    def pop(self, key, default=None):
+        return self.inner.pop(key, default)
+
+    def values(self):
+        return self.inner.values()
+
+    def __contains__(self, key):
+        return key in self.inner
+
+    def __len__(self):
+        return len(self.inner)
@@ -1,32 +1,134 @@
+import inspect
+
 from twisted.internet import defer, ssl
 from autobahn.twisted import websocket
 
 from twisted.logger import Logger
+from twisted.python.failure import Failure
 
+from chord.codec import get_codec
+from chord.incremental import cooperator
 from chord.protocol import DiscordClientFactory, EventHandler
-from chord.util import get_token, get_gateway
-from chord.errors import LoginError, WSReconnect
+from chord.rest import RESTClient
+from chord.snapshot import Snapshot, write_snapshot
+from chord.state import ConnectionState
+from chord.util import HTTPClient, get_token, get_gateway
+from chord.voice import VoiceConnection
+from chord.errors import LoginError, WSError, WSReconnect
+
+
+def accepts_shard_id(func):
+    """
+    Whether C{func} takes the C{shard_id} keyword argument passed to
+    handlers under a L{chord.sharding.ShardManager}.
+    """
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == 'shard_id' or p.kind == p.VAR_KEYWORD for p in parameters)
 
 
 class BaseClient(EventHandler):
     log = Logger()
 
+    # Entity cache, see chord.state
+    state = None
+    # Set to ingest READY and GUILD_CREATE into the cache in slices, see
+    # chord.incremental
+    cooperator = None
+    slice_size = 500
+
     def dispatch(self, event, *args, **kwargs):
         raise NotImplementedError('dispatch not implemented')
 
-    def handle_event(self, event, data):
+    def wants_event(self, event):
+        return self.state is not None and event in self.state.events
+
+    def handle_event(self, event, data, shard_id=None):
         data = data.get('d', {})
-        self.dispatch(event, data)
+        if self.state is not None:
+            if self.cooperator is not None and event in ('READY', 'GUILD_CREATE'):
+                d = self.cooperator.cooperate(self.state.apply_iter(event, data, self.slice_size)).whenDone()
+                d.addCallback(lambda _: self._dispatch_event(event, data, shard_id))
+                return d
+            self.state.apply(event, data)
+        self._dispatch_event(event, data, shard_id)
+
+    def _dispatch_event(self, event, data, shard_id):
+        if shard_id is None:
+            self.dispatch(event, data)
+        else:
+            self.dispatch(event, data, shard_id=shard_id)
 
 
 class Client(BaseClient):
     _protocol = None
-
-    def __init__(self, reactor=None, token=None):
+    _rest = None
+    _gateway = None
+    # (session_id, sequence) to resume on the next connection
+    _resume_session = None
+    # The bot's user id of a restored snapshot, until READY
+    _user_id = None
+    factory = None
+
+    def __init__(self, reactor=None, token=None, http=None, compression='payload', codec=None, lazy=False,
+                 cache=False, cache_policies=None, large_threshold=250, fetch_members=False, executor=None,
+                 incremental=False, metrics=None, encoding='json', int_ids=False, coordinator=None):
         if reactor is None:
             from twisted.internet import reactor
         self.reactor = reactor
         self.token = token
+        self.compression = compression
+        self.codec = get_codec(codec)
+        # Gateway encoding, 'json' or 'etf' (see chord.etf); REST stays JSON
+        self.encoding = encoding
+        # Integer ids in payloads and the cache, see chord.snowflake
+        self.int_ids = int_ids
+        self.lazy = lazy
+        self.large_threshold = large_threshold
+        self.fetch_members = fetch_members
+        # Runs handlers off the reactor thread, see chord.executor
+        self.executor = executor
+        if cache or cache_policies:
+            self.state = ConnectionState(cache_policies, int_ids)
+        # Parse huge READY/GUILD_CREATE frames and fill the cache from them
+        # without blocking the reactor
+        self.incremental = incremental
+        if incremental:
+            self.cooperator = cooperator(reactor)
+        # Counters and histograms, see chord.metrics
+        self.metrics = metrics
+        # Paces reconnects and IDENTIFYs, shared by the process's clients
+        # unless given, see chord.reconnect
+        self.coordinator = coordinator
+        self.http = HTTPClient(reactor, codec=self.codec, metrics=metrics) if http is None else http
+
+        # guild id -> VoiceConnection, see join_voice
+        self.voice_connections = {}
+
+        # Dispatch table: event name -> listeners, built at registration
+        self._listeners = {}
+        self._wildcard = []
+        # event -> guild id -> listeners scoped to that guild
+        self._guild_listeners = {}
+        # Listener -> whether it takes shard_id, checked at registration
+        self._shard_aware = {}
+        self._waiters = {}
+        for name in dir(type(self)):
+            if name.startswith('on_') and callable(getattr(type(self), name)):
+                self.add_listener(getattr(self, name))
+
+    @property
+    def rest(self):
+        """
+        L{RESTClient} authenticated with the client's token.
+        """
+        if self._rest is None:
+            self._rest = RESTClient(self.token, http=self.http)
+        elif self._rest.token != self.token:
+            self._rest.token = self.token
+        return self._rest
 
     def get_reactor(self):
         return self.reactor
@@ -37,7 +139,7 @@ class Client(BaseClient):
     def fetch_token(self, email=None, password=None):
         if email is None or password is None:
             raise LoginError('Email and password must be specified to fetch token.')
-        d = get_token(email, password, reactor=self.reactor)
+        d = get_token(email, password, reactor=self.reactor, http=self.http)
         d.addCallback(self.set_token)
         return d
 
@@ -47,7 +149,7 @@ class Client(BaseClient):
 
     def fetch_gateway(self, token=None):
         self.token = self.token if token is None else token
-        d = get_gateway(self.token, reactor=self.reactor)
+        d = get_gateway(self.token, reactor=self.reactor, http=self.http)
         d.addCallback(self.set_gateway)
         return d
 
@@ -85,36 +187,340 @@ class Client(BaseClient):
             return defer.succeed(self._protocol)
 
         d = defer.Deferred()
-        self.factory = DiscordClientFactory(self._gateway, token=self.token, deferred=d, reactor=self.reactor)
+        self.factory = self.build_factory(self._gateway, deferred=d)
+        self.factory.add_event_handler(self)
+        if self._resume_session is not None:
+            self.factory.session_id, self.factory.sequence = self._resume_session
+            self._resume_session = None
 
         websocket.connectWS(self.factory)
         d.addCallback(self.set_protocol)
         return d
 
-    def disconnect(self, reason):
-        if self._protocol:
-            self._protocol.factory.stopTrying()
-            self._protocol.dropConnection(abort=True)
+    def build_factory(self, gateway, **kwargs):
+        return DiscordClientFactory(gateway, token=self.token, reactor=self.reactor,
+                                    compression=self.compression, codec=self.codec,
+                                    lazy=self.lazy, large_threshold=self.large_threshold,
+                                    fetch_members=self.fetch_members, incremental=self.incremental,
+                                    metrics=self.metrics, encoding=self.encoding, int_ids=self.int_ids,
+                                    coordinator=self.coordinator, **kwargs)
+
+    def disconnect(self, reason=None):
+        """
+        Close the gateway connection and stop reconnecting. Returns a
+        Deferred firing once the connection is closed.
+        """
+        self._protocol = None
+        if self.factory is None:
+            return defer.succeed(None)
+        self.factory.stopTrying()
+        protocol = self.factory.current_protocol
+        if protocol is None:
+            return defer.succeed(None)
+        d = protocol.when_closed()
+        protocol.dropConnection(abort=True)
+        return d
 
     def set_protocol(self, protocol):
         self._protocol = protocol
         self._protocol.add_event_handler(self)
+        if self.executor is not None:
+            self.executor.bind(protocol)
         return defer.succeed(self._protocol)
 
+    def protocol_opened(self, protocol):
+        # Follow the factory to the protocols it builds when reconnecting
+        if protocol is not self._protocol and protocol.factory is self.factory:
+            self.set_protocol(protocol)
+
+    def request_members(self, guild_id):
+        if self._protocol is None:
+            return defer.fail(WSError('Not connected'))
+        return self._protocol.request_members(guild_id)
+
+    @property
+    def user_id(self):
+        """
+        The bot's user id, from READY or a restored snapshot; known with or
+        without the cache.
+        """
+        if self.factory is not None and self.factory.user_id is not None:
+            return self.factory.user_id
+        if self._user_id is not None:
+            return self._user_id
+        if self.state is not None and self.state.user is not None:
+            return self.state.user.id
+        return None
+
+    def join_voice(self, guild_id, channel_id, self_mute=False, self_deaf=False, timeout=30):
+        """
+        Join the voice channel C{channel_id} of C{guild_id}. Returns a
+        Deferred firing with a L{VoiceConnection} ready to play audio.
+        """
+        if self._protocol is None:
+            return defer.fail(WSError('Not connected'))
+        user_id = self.user_id
+        if user_id is None:
+            return defer.fail(WSError('Not ready, the bot user is unknown'))
+
+        def guild(data):
+            return str(data.get('guild_id')) == str(guild_id)
+
+        def ours(data):
+            return guild(data) and str(data.get('user_id')) == str(user_id)
+
+        voice_state = self.wait_for('VOICE_STATE_UPDATE', ours, timeout)
+        voice_server = self.wait_for('VOICE_SERVER_UPDATE', guild, timeout)
+        self._protocol.send_op(self._protocol.VOICE_STATE, {
+            'guild_id': guild_id, 'channel_id': channel_id, 'self_mute': self_mute, 'self_deaf': self_deaf
+        })
+
+        def cbServer(result):
+            state, server = result
+            connection = VoiceConnection(server['endpoint'], server['guild_id'], state['user_id'],
+                                         state['session_id'], server['token'], reactor=self.reactor)
+            self.voice_connections[guild_id] = connection
+            connection.closed.addBoth(self._voice_closed, guild_id, connection)
+            return connection.connect()
+
+        d = defer.gatherResults([voice_state, voice_server], consumeErrors=True)
+        d.addCallback(cbServer)
+        return d
+
+    def _voice_closed(self, result, guild_id, connection):
+        if self.voice_connections.get(guild_id) is connection:
+            del self.voice_connections[guild_id]
+        return result
+
+    def leave_voice(self, guild_id):
+        """
+        Leave the voice channel joined in C{guild_id}.
+        """
+        connection = self.voice_connections.get(guild_id)
+        if self._protocol is not None:
+            self._protocol.send_op(self._protocol.VOICE_STATE, {
+                'guild_id': guild_id, 'channel_id': None, 'self_mute': False, 'self_deaf': False
+            })
+        if connection is None:
+            return defer.succeed(None)
+        return connection.disconnect()
+
+    def save_snapshot(self, path, include_token=False):
+        """
+        Write the gateway URL, the session and the entity cache to C{path},
+        see L{chord.snapshot}. The token is left out unless
+        C{include_token} is set.
+        """
+        meta = {
+            'gateway': self._gateway,
+            'session_id': self.factory.session_id if self.factory is not None else None,
+            'sequence': self.factory.sequence if self.factory is not None else None,
+            'user_id': self.user_id,
+            'time': self.reactor.seconds()
+        }
+        if include_token:
+            meta['token'] = self.token
+        write_snapshot(path, meta, self.state, codec=self.codec)
+
+    def restore_snapshot(self, path):
+        """
+        Load a snapshot written by L{save_snapshot}: the cache is filled
+        from it and the next L{connect} resumes its session. Returns a
+        Deferred firing with the snapshot metadata once the cache is
+        restored (cooperatively with C{incremental}).
+        """
+        snapshot = Snapshot(path, codec=self.codec)
+        meta = snapshot.meta
+        self._gateway = meta.get('gateway') or self._gateway
+        if meta.get('session_id') is not None:
+            self._resume_session = (meta['session_id'], meta.get('sequence') or 0)
+        self._user_id = meta.get('user_id')
+        if not self.token and meta.get('token'):
+            self.token = meta['token']
+
+        if self.state is None:
+            snapshot.close()
+            return defer.succeed(meta)
+        if self.cooperator is not None:
+            d = self.cooperator.cooperate(snapshot.restore_iter(self.state)).whenDone()
+            d.addCallback(lambda ignored: meta)
+            return d
+        snapshot.restore(self.state)
+        return defer.succeed(meta)
+
+    def latency_stats(self):
+        """
+        Rolling heartbeat latency of the gateway connection, see
+        L{DiscordClientFactory.latency_stats}.
+        """
+        if self.factory is None:
+            return None
+        return self.factory.latency_stats()
+
+    def reconnect_stats(self):
+        """
+        Reconnects per reason and rate, and IDENTIFYs waiting, see
+        L{ReconnectCoordinator.stats}.
+        """
+        if self.factory is None:
+            return None
+        return self.factory.coordinator.stats()
+
     def handle_error(self, failure):
         self.log.error(str(failure.value))
         failure.raiseException()
 
     def event(self, func):
+        """
+        Register C{func} as the C{on_*} handler named after it, replacing
+        the one registered or defined under that name before.
+        """
+        previous = getattr(self, func.__name__, None)
+        if previous is not None:
+            self.remove_listener(previous, func.__name__[3:])
         setattr(self, func.__name__, func)
+        self.add_listener(func)
         self.log.debug('{func.__name__} has successfully been registered as an event', func=func)
         return func
 
-    def dispatch(self, event, *args, **kwargs):
-        self.log.debug('Dispatching event {}'.format(event))
-        handler = 'on_' + event.lower()
+    def add_listener(self, func, event=None, guild_id=None):
+        """
+        Call C{func} for every C{event} dispatch. C{event} defaults to the
+        function name without its C{on_} prefix; C{'*'} listens to every
+        event, the function then receives the event name first.
+
+        With C{guild_id}, C{func} only receives the events of that guild,
+        which is then active for L{ActiveGuildsCache} stores.
+        """
+        if event is None:
+            if not func.__name__.startswith('on_'):
+                raise ValueError('Cannot derive an event name from {0}'.format(func.__name__))
+            event = func.__name__[3:]
+        self._shard_aware[func] = accepts_shard_id(func)
+        if guild_id is not None:
+            if event == '*':
+                raise ValueError('Guild listeners need an event name')
+            scoped = self._guild_listeners.setdefault(event.upper(), {})
+            scoped.setdefault(str(guild_id), []).append(func)
+            if self.state is not None:
+                self.state.set_guild_active(guild_id, True)
+        elif event == '*':
+            self._wildcard.append(func)
+        else:
+            self._listeners.setdefault(event.upper(), []).append(func)
+        return func
+
+    def remove_listener(self, func, event=None, guild_id=None):
+        if event is None:
+            event = func.__name__[3:]
+        if guild_id is not None:
+            self._remove_guild_listener(func, event.upper(), str(guild_id))
+        else:
+            listeners = self._wildcard if event == '*' else self._listeners.get(event.upper(), [])
+            if func in listeners:
+                listeners.remove(func)
+            if event != '*' and not listeners:
+                self._listeners.pop(event.upper(), None)
+        if not self._registered(func):
+            self._shard_aware.pop(func, None)
+
+    def _registered(self, func):
+        if func in self._wildcard or any(func in listeners for listeners in self._listeners.values()):
+            return True
+        return any(func in listeners for scoped in self._guild_listeners.values() for listeners in scoped.values())
+
+    def _remove_guild_listener(self, func, event, guild_id):
+        scoped = self._guild_listeners.get(event, {})
+        listeners = scoped.get(guild_id, [])
+        if func in listeners:
+            listeners.remove(func)
+        if not listeners:
+            scoped.pop(guild_id, None)
+        if not scoped:
+            self._guild_listeners.pop(event, None)
+        if self.state is not None and not any(guild_id in scoped for scoped in self._guild_listeners.values()):
+            self.state.set_guild_active(guild_id, False)
+
+    def wait_for(self, event, predicate=None, timeout=None):
+        """
+        Return a Deferred firing with the data of the next C{event} dispatch
+        matching C{predicate}, or failing with L{defer.TimeoutError} after
+        C{timeout} seconds.
+        """
+        event = event.upper()
+        d = defer.Deferred()
+        waiter = [predicate, d, None, predicate is not None and accepts_shard_id(predicate)]
+        self._waiters.setdefault(event, []).append(waiter)
+
+        if timeout is not None:
+            def expire():
+                waiter[2] = None
+                self._remove_waiter(event, waiter)
+                d.errback(defer.TimeoutError('Timed out waiting for {0}'.format(event)))
+            waiter[2] = self.reactor.callLater(timeout, expire)
+        return d
 
-        if hasattr(self, handler):
-            defer.maybeDeferred(getattr(self, handler), *args, **kwargs)
+    def _remove_waiter(self, event, waiter):
+        waiters = self._waiters.get(event)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[event]
+
+    def _wake_waiters(self, event, waiters, args, kwargs, plain):
+        for waiter in list(waiters):
+            predicate, d, call, shard_aware = waiter
+            try:
+                if predicate is not None and not predicate(*args, **(kwargs if shard_aware else plain)):
+                    continue
+            except Exception:
+                failure = Failure()
+            else:
+                failure = None
+            self._remove_waiter(event, waiter)
+            if call is not None and call.active():
+                call.cancel()
+            if failure is not None:
+                d.errback(failure)
+            else:
+                d.callback(args[0] if len(args) == 1 else args)
+
+    def call_handler(self, event, func, args, kwargs):
+        if self.executor is not None and not getattr(func, 'inline', False):
+            self.executor.submit(event, func, args, kwargs)
         else:
-            self.log.error('Unhandled event {event} ({gateway}, {protocol})', event=event, gateway=repr(self._gateway), protocol=repr(self._protocol))
+            defer.maybeDeferred(func, *args, **kwargs)
+
+    def wants_event(self, event):
+        return (event in self._listeners or event in self._waiters or bool(self._wildcard)
+                or event in self._guild_listeners or BaseClient.wants_event(self, event))
+
+    def dispatch(self, event, *args, **kwargs):
+        listeners = self._listeners.get(event)
+        waiters = self._waiters.get(event)
+        scoped = self._guild_listeners.get(event)
+        if listeners is None and waiters is None and scoped is None and not self._wildcard:
+            return
+
+        plain = kwargs
+        if 'shard_id' in kwargs:
+            # Only the listeners taking shard_id receive it
+            plain = dict(kwargs)
+            del plain['shard_id']
+        aware = self._shard_aware
+
+        # Handlers run inline may add or remove listeners: iterate copies
+        if listeners is not None:
+            for func in tuple(listeners):
+                self.call_handler(event, func, args, kwargs if aware.get(func) else plain)
+        if scoped is not None and args and isinstance(args[0], dict):
+            data = args[0]
+            guild_id = data.get('guild_id')
+            if guild_id is None and event.startswith('GUILD_'):
+                guild_id = data.get('id')
+            for func in tuple(scoped.get(str(guild_id), ())):
+                self.call_handler(event, func, args, kwargs if aware.get(func) else plain)
+        for func in tuple(self._wildcard):
+            self.call_handler(event, func, (event,) + args, kwargs if aware.get(func) else plain)
+        if waiters is not None:
+            self._wake_waiters(event, waiters, args, kwargs, plain)
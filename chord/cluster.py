@@ -0,0 +1,433 @@
+"""
+Multi-process shard clustering.
+
+A L{ClusterSupervisor} spawns one worker process per CPU core, each running
+a L{ShardManager} for a subset of the shards, and restarts workers that
+exit. Workers talk to the supervisor over a Unix socket: selected dispatch
+events are forwarded to every other worker, and queries are answered by
+all workers. IDENTIFYs are granted by the supervisor (see
+L{ClusterCoordinator}), so the bot-wide IDENTIFY limit holds across the
+workers.
+
+Workers build their client by calling an entry point given as
+C{'package.module:function'}; the function receives the worker's
+L{ClusterBus} and returns a configured L{Client}.
+
+    python -m chord.cluster <entrypoint> <socket> <worker_id> <shard_count> <shard_ids>
+"""
+import importlib
+import itertools
+import multiprocessing
+import os
+import sys
+
+from twisted.internet import defer, protocol
+from twisted.internet.endpoints import UNIXClientEndpoint, UNIXServerEndpoint
+from twisted.logger import Logger
+from twisted.protocols.basic import Int32StringReceiver
+
+from chord.codec import get_codec
+from chord.errors import CordError
+from chord.reconnect import ReconnectCoordinator
+from chord.sharding import ShardManager
+from chord.util import get_gateway_bot
+
+
+TOKEN_ENV = 'CHORD_TOKEN'
+
+
+class ClusterError(CordError):
+    pass
+
+
+class IPCProtocol(Int32StringReceiver):
+    """
+    Length-prefixed messages, each one a serialised dict with a C{type}.
+    """
+    MAX_LENGTH = 64 * 1024 * 1024
+
+    def connectionMade(self):
+        self.factory.connected(self)
+
+    def connectionLost(self, reason):
+        self.factory.disconnected(self)
+
+    def stringReceived(self, data):
+        self.factory.received(self, self.factory.codec.loads(data))
+
+    def send(self, message):
+        self.sendString(self.factory.codec.dumps(message))
+
+
+class SupervisorFactory(protocol.Factory):
+    protocol = IPCProtocol
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+        self.codec = supervisor.codec
+
+    def connected(self, connection):
+        pass
+
+    def disconnected(self, connection):
+        self.supervisor.worker_disconnected(connection)
+
+    def received(self, connection, message):
+        self.supervisor.received(connection, message)
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    def __init__(self, supervisor, worker_id):
+        self.supervisor = supervisor
+        self.worker_id = worker_id
+
+    def processEnded(self, reason):
+        self.supervisor.worker_ended(self.worker_id, reason)
+
+
+class ClusterSupervisor(object):
+    """
+    Spawns and supervises the worker processes of a cluster and relays IPC
+    messages between them.
+    """
+    log = Logger()
+
+    restart_delay = 1.0
+    max_restart_delay = 60.0
+
+    def __init__(self, entrypoint, token, socket_path, shard_count=None, workers=None,
+                 reactor=None, http=None, codec='json', python=sys.executable, max_concurrency=1):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.entrypoint = entrypoint
+        self.token = token
+        self.socket_path = socket_path
+        self.shard_count = shard_count
+        self.workers = workers or multiprocessing.cpu_count()
+        self.http = http
+        self.codec = get_codec(codec)
+        self.python = python
+        # Paces the IDENTIFYs of every worker
+        self.coordinator = ReconnectCoordinator(reactor, max_concurrency=max_concurrency)
+
+        self.processes = {}
+        self.connections = {}
+        self.restarts = {}
+        self.running = False
+        self._pending = {}
+        self._query_ids = itertools.count()
+        # connection -> {request id: Deferred waiting for an IDENTIFY slot}
+        self._identifies = {}
+
+    def start(self):
+        self.running = True
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        endpoint = UNIXServerEndpoint(self.reactor, self.socket_path)
+        d = endpoint.listen(SupervisorFactory(self))
+        d.addCallback(self._cbListening)
+        return d
+
+    def _cbListening(self, port):
+        self.port = port
+        if self.shard_count is not None:
+            return self._spawn_all()
+        d = get_gateway_bot(self.token, reactor=self.reactor, http=self.http)
+        d.addCallback(self._cbShardCount)
+        return d
+
+    def _cbShardCount(self, result):
+        self.shard_count = result[1]
+        return self._spawn_all()
+
+    def _spawn_all(self):
+        self.workers = min(self.workers, self.shard_count)
+        self.log.info('Starting {workers} worker(s) for {shards} shard(s)', workers=self.workers, shards=self.shard_count)
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+
+    def shards_for(self, worker_id):
+        return list(range(worker_id, self.shard_count, self.workers))
+
+    def spawn(self, worker_id):
+        env = dict(os.environ)
+        env[TOKEN_ENV] = self.token
+        args = [self.python, '-m', 'chord.cluster', self.entrypoint, self.socket_path,
+                str(worker_id), str(self.shard_count),
+                ','.join(str(s) for s in self.shards_for(worker_id))]
+        self.processes[worker_id] = self.reactor.spawnProcess(
+            WorkerProcess(self, worker_id), self.python, args, env=env,
+            childFDs={0: 'w', 1: 1, 2: 2})
+
+    def worker_ended(self, worker_id, reason):
+        self.processes.pop(worker_id, None)
+        self.connections.pop(worker_id, None)
+        if not self.running:
+            return
+        delay = self.restarts.get(worker_id, self.restart_delay / 2) * 2
+        self.restarts[worker_id] = delay = min(delay, self.max_restart_delay)
+        self.log.warn('Worker {worker} exited ({reason}), restarting in {delay}s',
+                      worker=worker_id, reason=reason.value, delay=delay)
+        self.reactor.callLater(delay, self._respawn, worker_id)
+
+    def _respawn(self, worker_id):
+        if self.running and worker_id not in self.processes:
+            self.spawn(worker_id)
+
+    def worker_disconnected(self, connection):
+        for worker_id, conn in list(self.connections.items()):
+            if conn is connection:
+                del self.connections[worker_id]
+        for d in list(self._identifies.pop(connection, {}).values()):
+            d.cancel()
+        for query_id, query in list(self._pending.items()):
+            if connection is query['origin']:
+                del self._pending[query_id]
+            else:
+                query['waiting'].discard(connection)
+                self._maybe_answer(query_id)
+
+    def received(self, connection, message):
+        kind = message.get('type')
+        if kind == 'hello':
+            worker_id = message['worker']
+            self.connections[worker_id] = connection
+            self.restarts.pop(worker_id, None)
+        elif kind == 'event':
+            for conn in list(self.connections.values()):
+                if conn is not connection:
+                    conn.send(message)
+        elif kind == 'query':
+            query_id = next(self._query_ids)
+            self._pending[query_id] = {
+                'origin': connection,
+                'origin_id': message['id'],
+                'waiting': set(self.connections.values()),
+                'results': []
+            }
+            for conn in list(self.connections.values()):
+                conn.send({'type': 'query', 'id': query_id, 'name': message['name'], 'args': message.get('args', [])})
+            self._maybe_answer(query_id)
+        elif kind == 'identify':
+            self._grant_identify(connection, message['id'])
+        elif kind == 'identify_cancel':
+            d = self._identifies.get(connection, {}).pop(message['id'], None)
+            if d is not None:
+                d.cancel()
+        elif kind == 'reply':
+            query = self._pending.get(message['id'])
+            if query is None:
+                return
+            query['waiting'].discard(connection)
+            query['results'].append(message.get('result'))
+            self._maybe_answer(message['id'])
+
+    def _grant_identify(self, connection, request_id):
+        waiting = self._identifies.setdefault(connection, {})
+
+        def granted(ignored):
+            waiting.pop(request_id, None)
+            connection.send({'type': 'identify', 'id': request_id})
+        d = waiting[request_id] = self.coordinator.identify()
+        d.addCallback(granted)
+        d.addErrback(lambda failure: failure.trap(defer.CancelledError))
+
+    def _maybe_answer(self, query_id):
+        query = self._pending.get(query_id)
+        if query is None or query['waiting']:
+            return
+        del self._pending[query_id]
+        query['origin'].send({'type': 'result', 'id': query['origin_id'], 'results': query['results']})
+
+    def stop(self):
+        self.running = False
+        self.coordinator.stop()
+        for process in list(self.processes.values()):
+            try:
+                process.signalProcess('TERM')
+            except Exception:
+                pass
+        if getattr(self, 'port', None) is not None:
+            return self.port.stopListening()
+
+
+class ClusterBus(protocol.ClientFactory):
+    """
+    The worker side of the IPC channel.
+
+    Events added with L{forward_event} are sent to every other worker, where
+    they are dispatched to the client as C{REMOTE_<EVENT>}. Queries
+    registered with L{register_query} are answered for every worker calling
+    L{query}.
+    """
+    log = Logger()
+    protocol = IPCProtocol
+
+    def __init__(self, worker_id, forward_events=(), reactor=None, codec='json'):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.worker_id = worker_id
+        self.forward_events = set(forward_events)
+        self.codec = get_codec(codec)
+        self.client = None
+        self.connection = None
+        self.queries = {}
+        self._pending = {}
+        self._query_ids = itertools.count()
+        self._identifies = {}
+        self._identify_ids = itertools.count()
+
+    def connect(self, socket_path):
+        return UNIXClientEndpoint(self.reactor, socket_path).connect(self)
+
+    def buildProtocol(self, addr):
+        p = self.protocol()
+        p.factory = self
+        return p
+
+    def connected(self, connection):
+        self.connection = connection
+        connection.send({'type': 'hello', 'worker': self.worker_id})
+
+    def disconnected(self, connection):
+        self.connection = None
+        for d in self._pending.values():
+            d.errback(ClusterError('Lost connection to the cluster supervisor'))
+        self._pending = {}
+        identifies, self._identifies = self._identifies, {}
+        for d in identifies.values():
+            d.errback(ClusterError('Lost connection to the cluster supervisor'))
+
+    def forward_event(self, *events):
+        self.forward_events.update(events)
+
+    def forward(self, event, data, shard_id):
+        if self.connection is not None:
+            self.connection.send({'type': 'event', 'event': event, 'shard_id': shard_id, 'data': data.get('d')})
+
+    def register_query(self, name, func):
+        self.queries[name] = func
+
+    def query(self, name, *args):
+        """
+        Run query C{name} on every worker, this one included. Returns a
+        Deferred firing with the list of their results.
+        """
+        if self.connection is None:
+            return defer.fail(ClusterError('Not connected to the cluster supervisor'))
+        query_id = next(self._query_ids)
+        d = self._pending[query_id] = defer.Deferred()
+        self.connection.send({'type': 'query', 'id': query_id, 'name': name, 'args': list(args)})
+        return d
+
+    def request_identify(self):
+        """
+        Ask the supervisor for an IDENTIFY slot. Returns a Deferred firing
+        once it is granted; cancelling it gives the place in line back.
+        """
+        if self.connection is None:
+            return defer.fail(ClusterError('Not connected to the cluster supervisor'))
+        request_id = next(self._identify_ids)
+
+        def cancel(d):
+            self._identifies.pop(request_id, None)
+            if self.connection is not None:
+                self.connection.send({'type': 'identify_cancel', 'id': request_id})
+        d = self._identifies[request_id] = defer.Deferred(cancel)
+        self.connection.send({'type': 'identify', 'id': request_id})
+        return d
+
+    def received(self, connection, message):
+        kind = message.get('type')
+        if kind == 'event':
+            if self.client is not None:
+                self.client.dispatch('REMOTE_' + message['event'], message.get('data'), shard_id=message.get('shard_id'))
+        elif kind == 'query':
+            func = self.queries.get(message['name'])
+            d = defer.maybeDeferred(func, *message.get('args', [])) if func is not None else defer.succeed(None)
+            d.addErrback(lambda failure: self.log.failure('Query {name} failed', failure, name=message['name']))
+            d.addCallback(lambda result: connection.send({'type': 'reply', 'id': message['id'], 'result': result}))
+        elif kind == 'result':
+            d = self._pending.pop(message['id'], None)
+            if d is not None:
+                d.callback(message['results'])
+        elif kind == 'identify':
+            d = self._identifies.pop(message['id'], None)
+            if d is not None:
+                d.callback(None)
+
+
+class ClusterCoordinator(ReconnectCoordinator):
+    """
+    A L{ReconnectCoordinator} taking IDENTIFY slots from the supervisor, so
+    that the limit holds across the workers. The local limit applies while
+    the supervisor is unreachable.
+    """
+    def __init__(self, bus, reactor=None, **kwargs):
+        ReconnectCoordinator.__init__(self, reactor or bus.reactor, **kwargs)
+        self.bus = bus
+
+    def identify(self):
+        if self.bus.connection is None:
+            return ReconnectCoordinator.identify(self)
+        d = self.bus.request_identify()
+        d.addCallbacks(self._granted, self._ebIdentify)
+        return d
+
+    def _granted(self, result):
+        self.identifies += 1
+        return result
+
+    def _ebIdentify(self, failure):
+        failure.trap(ClusterError)
+        return ReconnectCoordinator.identify(self)
+
+    @property
+    def pending_identifies(self):
+        return len(self._waiting) + len(self.bus._identifies)
+
+
+def load_entrypoint(entrypoint):
+    module, _, name = entrypoint.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def run_worker(argv, reactor=None):
+    if reactor is None:
+        from twisted.internet import reactor
+    entrypoint, socket_path, worker_id, shard_count, shard_ids = argv
+    worker_id = int(worker_id)
+    shard_ids = [int(s) for s in shard_ids.split(',') if s]
+
+    bus = ClusterBus(worker_id, reactor=reactor)
+    client = load_entrypoint(entrypoint)(bus)
+    if not client.token:
+        client.token = os.environ.get(TOKEN_ENV)
+    if client.coordinator is None:
+        client.coordinator = ClusterCoordinator(bus, reactor)
+    bus.client = client
+
+    manager = ShardManager(client, shard_count=int(shard_count), shard_ids=shard_ids)
+    if bus.forward_events:
+        manager.add_listener(bus.forward, bus.forward_events)
+
+    def cbConnected(ignored):
+        return manager.start()
+
+    def ebFatal(failure):
+        Logger().failure('Worker {worker} failed to start', failure, worker=worker_id)
+        if reactor.running:
+            reactor.stop()
+
+    d = bus.connect(socket_path)
+    d.addCallback(cbConnected)
+    d.addErrback(ebFatal)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    from chord.util import start_logging
+    start_logging()
+    run_worker(sys.argv[1:])
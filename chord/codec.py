@@ -0,0 +1,122 @@
+"""
+Serialisation of gateway frames and REST bodies.
+
+C{loads} accepts the raw bytes received from the wire and C{dumps} returns
+bytes ready to be sent, so neither side needs an extra decode/encode copy.
+"""
+import json
+import re
+
+from chord.etf import ETFCodec
+
+
+# Top level envelope fields. Discord sends them ahead of the "d" body.
+_envelope = re.compile(br'"(op|s|t)":(null|-?\d+|"[A-Z0-9_]*")')
+
+
+class JSONCodec(object):
+    name = 'json'
+    # Gateway encoding negotiated for this codec, and whether its frames
+    # are binary websocket messages
+    encoding = 'json'
+    binary = False
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def peek(self, data):
+        """
+        Return C{(op, s, t)} read from the frame's envelope without parsing
+        its body, or C{None} if they cannot be located cheaply.
+        """
+        end = data.find(b'"d":')
+        if end == -1:
+            end = len(data)
+        fields = dict(_envelope.findall(data[:end]))
+        if len(fields) != 3:
+            return None
+        op, seq, event = fields[b'op'], fields[b's'], fields[b't']
+        if op == b'null':
+            return None
+        return (int(op),
+                None if seq == b'null' else int(seq),
+                None if event == b'null' else event[1:-1].decode('ascii'))
+
+    def dumps(self, obj):
+        data = json.dumps(obj, separators=(',', ':'))
+        if not isinstance(data, bytes):
+            data = data.encode('utf8')
+        return data
+
+
+class UJSONCodec(JSONCodec):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj):
+        data = self._ujson.dumps(obj, ensure_ascii=False)
+        if not isinstance(data, bytes):
+            data = data.encode('utf8')
+        return data
+
+
+class OrjsonCodec(JSONCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj)
+
+
+codecs = {
+    'json': JSONCodec,
+    'ujson': UJSONCodec,
+    'orjson': OrjsonCodec,
+    'etf': ETFCodec
+}
+
+# Tried in order when no codec is requested explicitly. ETF is only used
+# for the gateway, when asked for.
+preferred = ('orjson', 'ujson', 'json')
+
+
+def available_codecs():
+    names = []
+    for name in preferred:
+        try:
+            codecs[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_codec(codec=None):
+    """
+    Return a codec instance. C{codec} may be an instance (returned as is), a
+    name from L{codecs}, or C{None} to pick the fastest installed backend.
+    """
+    if codec is None:
+        for name in preferred:
+            try:
+                return codecs[name]()
+            except ImportError:
+                continue
+    if not isinstance(codec, (str, type(u''))):
+        return codec
+    try:
+        return codecs[codec]()
+    except KeyError:
+        raise ValueError('Unknown codec {0!r}'.format(codec))
@@ -0,0 +1,103 @@
+import zlib
+
+from chord.errors import WSError
+
+
+# Largest payload accepted from the gateway, 10 MiB.
+MAX_PAYLOAD = 10490000
+
+ZLIB_SUFFIX = b'\x00\x00\xff\xff'
+
+# First byte of an ETF document; zlib streams start with 0x78
+ETF_VERSION = b'\x83'
+
+
+def too_large():
+    return WSError('Gateway payload over {0} bytes'.format(MAX_PAYLOAD))
+
+
+class PayloadInflater(object):
+    """
+    Per-payload compression: some frames are sent as standalone zlib
+    documents, requested with C{compress} in IDENTIFY.
+    """
+    query = None
+    identify_compress = True
+
+    def feed(self, data):
+        # With encoding=etf, frames left uncompressed are binary as well
+        if data[:1] == ETF_VERSION:
+            return data
+        inflator = zlib.decompressobj()
+        data = inflator.decompress(data, MAX_PAYLOAD)
+        if inflator.unconsumed_tail:
+            raise too_large()
+        return data
+
+    def reset(self):
+        pass
+
+
+class StreamInflater(object):
+    """
+    Transport compression (C{compress=zlib-stream}): all frames of a
+    connection are part of one zlib stream, and a message is complete once
+    a frame ending in the Z_SYNC_FLUSH suffix arrives.
+
+    A message over L{MAX_PAYLOAD} bytes leaves the stream unusable: the
+    inflater is reset and L{WSError} raised, the connection has to be
+    dropped.
+    """
+    query = 'zlib-stream'
+    identify_compress = False
+
+    def __init__(self):
+        self.reset()
+
+    def feed(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered > MAX_PAYLOAD:
+            self.reset()
+            raise too_large()
+        if data[-4:] != ZLIB_SUFFIX:
+            return None
+        if len(self._buffer) > 1:
+            data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        data = self._inflator.decompress(data, MAX_PAYLOAD)
+        if self._inflator.unconsumed_tail:
+            self.reset()
+            raise too_large()
+        return data
+
+    def reset(self):
+        self._inflator = zlib.decompressobj()
+        self._buffer = []
+        self._buffered = 0
+
+
+class NullInflater(object):
+    query = None
+    identify_compress = False
+
+    def feed(self, data):
+        return data
+
+    def reset(self):
+        pass
+
+
+inflaters = {
+    None: NullInflater,
+    'payload': PayloadInflater,
+    'zlib-stream': StreamInflater
+}
+
+
+def get_inflater(compression):
+    try:
+        return inflaters[compression]()
+    except KeyError:
+        raise ValueError('Unknown gateway compression {0!r}'.format(compression))
@@ -24,3 +24,11 @@ class WSError(CordError):
 
 class WSReconnect(CordError):
     pass
+
+
+class SnapshotError(CordError):
+    pass
+
+
+class VoiceError(CordError):
+    pass
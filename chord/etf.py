@@ -0,0 +1,290 @@
+"""
+Erlang external term format, the gateway's binary encoding (C{encoding=etf}).
+
+Frames are decoded to the same shapes as their JSON counterparts, so event
+handlers do not need to know which encoding is in use:
+
+ - binaries, strings and atoms other than C{nil}, C{true} and C{false}
+   become C{str};
+ - snowflakes, sent as 64 bit integers, become C{str} like in JSON: the
+   integers of id keys and id lists (L{chord.snowflake.ID_KEYS} and
+   L{chord.snowflake.ID_LIST_KEYS}). Other integers, such as timestamps in
+   milliseconds, stay integers whatever their size;
+ - tuples become lists.
+
+L{erlpack} is used when installed, a pure Python implementation otherwise.
+"""
+import struct
+import zlib
+
+from chord.snowflake import ID_KEYS, ID_LIST_KEYS
+
+try:
+    import erlpack
+except ImportError:
+    erlpack = None
+
+
+VERSION = 131
+
+NEW_FLOAT_EXT = 70
+COMPRESSED = 80
+SMALL_INTEGER_EXT = 97
+INTEGER_EXT = 98
+FLOAT_EXT = 99
+ATOM_EXT = 100
+SMALL_TUPLE_EXT = 104
+LARGE_TUPLE_EXT = 105
+NIL_EXT = 106
+STRING_EXT = 107
+LIST_EXT = 108
+BINARY_EXT = 109
+SMALL_BIG_EXT = 110
+LARGE_BIG_EXT = 111
+SMALL_ATOM_EXT = 115
+MAP_EXT = 116
+ATOM_UTF8_EXT = 118
+SMALL_ATOM_UTF8_EXT = 119
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+_atoms = {'nil': None, 'true': True, 'false': False}
+
+_uint16 = struct.Struct('>H')
+_uint32 = struct.Struct('>I')
+_int32 = struct.Struct('>i')
+_double = struct.Struct('>d')
+
+_text_type = type(u'')
+
+
+class ETFError(ValueError):
+    pass
+
+
+def decode(data):
+    """
+    Decode a term, C{data} starting with the version byte.
+    """
+    if bytes is str:
+        data = bytearray(data)
+    if not data or data[0] != VERSION:
+        raise ETFError('Not an external term format document')
+    if data[1] == COMPRESSED:
+        size, = _uint32.unpack_from(data, 2)
+        data = zlib.decompress(bytes(data[6:]))
+        if len(data) != size:
+            raise ETFError('Compressed term of unexpected size')
+        if bytes is str:
+            data = bytearray(data)
+        return _decode(data, 0)[0]
+    return _decode(data, 1)[0]
+
+
+def _decode(data, i):
+    """
+    Decode the term at C{data[i]}, returning it with the offset after it.
+    """
+    tag = data[i]
+    i += 1
+    if tag == BINARY_EXT:
+        size, = _uint32.unpack_from(data, i)
+        i += 4
+        return data[i:i + size].decode('utf8'), i + size
+    if tag == MAP_EXT:
+        arity, = _uint32.unpack_from(data, i)
+        i += 4
+        result = {}
+        for _ in range(arity):
+            key, i = _decode(data, i)
+            value, i = _decode(data, i)
+            if value.__class__ is int:
+                if key in ID_KEYS:
+                    value = str(value)
+            elif value.__class__ is list and value and key in ID_LIST_KEYS:
+                value = _str_ids(value)
+            result[key] = value
+        return result, i
+    if tag == SMALL_INTEGER_EXT:
+        return data[i], i + 1
+    if tag == INTEGER_EXT:
+        return _int32.unpack_from(data, i)[0], i + 4
+    if tag == SMALL_ATOM_UTF8_EXT or tag == SMALL_ATOM_EXT:
+        size = data[i]
+        i += 1
+        atom = data[i:i + size].decode('utf8' if tag == SMALL_ATOM_UTF8_EXT else 'latin1')
+        return _atoms.get(atom, atom), i + size
+    if tag == ATOM_EXT or tag == ATOM_UTF8_EXT:
+        size, = _uint16.unpack_from(data, i)
+        i += 2
+        atom = data[i:i + size].decode('utf8' if tag == ATOM_UTF8_EXT else 'latin1')
+        return _atoms.get(atom, atom), i + size
+    if tag == LIST_EXT:
+        size, = _uint32.unpack_from(data, i)
+        i += 4
+        result = []
+        append = result.append
+        for _ in range(size):
+            value, i = _decode(data, i)
+            append(value)
+        # Proper lists end with NIL_EXT, improper tails are dropped
+        _, i = _decode(data, i)
+        return result, i
+    if tag == NIL_EXT:
+        return [], i
+    if tag == SMALL_BIG_EXT or tag == LARGE_BIG_EXT:
+        if tag == SMALL_BIG_EXT:
+            size = data[i]
+            i += 1
+        else:
+            size, = _uint32.unpack_from(data, i)
+            i += 4
+        sign = data[i]
+        i += 1
+        value = 0
+        for digit in reversed(data[i:i + size]):
+            value = value * 256 + digit
+        return -value if sign else value, i + size
+    if tag == NEW_FLOAT_EXT:
+        return _double.unpack_from(data, i)[0], i + 8
+    if tag == STRING_EXT:
+        size, = _uint16.unpack_from(data, i)
+        i += 2
+        return data[i:i + size].decode('latin1'), i + size
+    if tag == SMALL_TUPLE_EXT or tag == LARGE_TUPLE_EXT:
+        if tag == SMALL_TUPLE_EXT:
+            arity = data[i]
+            i += 1
+        else:
+            arity, = _uint32.unpack_from(data, i)
+            i += 4
+        result = []
+        for _ in range(arity):
+            value, i = _decode(data, i)
+            result.append(value)
+        return result, i
+    if tag == FLOAT_EXT:
+        return float(data[i:i + 31].split(b'\x00', 1)[0]), i + 31
+    raise ETFError('Unsupported term tag {0}'.format(tag))
+
+
+def encode(obj):
+    """
+    Encode C{obj} (dicts, lists, tuples, strings, numbers, booleans and
+    C{None}) as a term.
+    """
+    out = bytearray([VERSION])
+    _encode(obj, out)
+    return bytes(out)
+
+
+def _encode(obj, out):
+    if obj is None:
+        out.extend(b'\x77\x03nil')
+    elif obj is True:
+        out.extend(b'\x77\x04true')
+    elif obj is False:
+        out.extend(b'\x77\x05false')
+    elif isinstance(obj, _text_type):
+        data = obj.encode('utf8')
+        out.append(BINARY_EXT)
+        out.extend(_uint32.pack(len(data)))
+        out.extend(data)
+    elif isinstance(obj, bytes):
+        out.append(BINARY_EXT)
+        out.extend(_uint32.pack(len(obj)))
+        out.extend(obj)
+    elif isinstance(obj, int):
+        if 0 <= obj <= 255:
+            out.append(SMALL_INTEGER_EXT)
+            out.append(obj)
+        elif INT32_MIN <= obj <= INT32_MAX:
+            out.append(INTEGER_EXT)
+            out.extend(_int32.pack(obj))
+        else:
+            value = abs(obj)
+            digits = bytearray()
+            while value:
+                digits.append(value & 0xff)
+                value >>= 8
+            if len(digits) > 255:
+                raise ETFError('Integer too large')
+            out.append(SMALL_BIG_EXT)
+            out.append(len(digits))
+            out.append(1 if obj < 0 else 0)
+            out.extend(digits)
+    elif isinstance(obj, float):
+        out.append(NEW_FLOAT_EXT)
+        out.extend(_double.pack(obj))
+    elif isinstance(obj, dict):
+        out.append(MAP_EXT)
+        out.extend(_uint32.pack(len(obj)))
+        for key, value in obj.items():
+            _encode(key, out)
+            _encode(value, out)
+    elif isinstance(obj, (list, tuple)):
+        if obj:
+            out.append(LIST_EXT)
+            out.extend(_uint32.pack(len(obj)))
+            for value in obj:
+                _encode(value, out)
+        out.append(NIL_EXT)
+    else:
+        raise ETFError('Cannot encode {0!r}'.format(obj))
+
+
+def _str_ids(values):
+    return [str(value) if value.__class__ is int else value for value in values]
+
+
+def normalise(obj):
+    """
+    Give a term decoded by erlpack the shapes L{decode} returns.
+    """
+    if isinstance(obj, dict):
+        result = {}
+        for key, value in obj.items():
+            key = normalise(key)
+            value = normalise(value)
+            if value.__class__ is int:
+                if key in ID_KEYS:
+                    value = str(value)
+            elif value.__class__ is list and value and key in ID_LIST_KEYS:
+                value = _str_ids(value)
+            result[key] = value
+        return result
+    if isinstance(obj, (list, tuple)):
+        return [normalise(value) for value in obj]
+    if isinstance(obj, bytes):
+        return obj.decode('utf8')
+    if erlpack is not None and isinstance(obj, erlpack.Atom):
+        return _atoms.get(str(obj), str(obj))
+    return obj
+
+
+class ETFCodec(object):
+    """
+    Gateway codec for C{encoding=etf}; frames are sent and received as
+    binary websocket messages.
+    """
+    name = 'etf'
+    encoding = 'etf'
+    binary = True
+
+    def __init__(self, accelerated=True):
+        self.accelerated = accelerated and erlpack is not None
+
+    def loads(self, data):
+        if self.accelerated:
+            return normalise(erlpack.unpack(data))
+        return decode(data)
+
+    def peek(self, data):
+        # Terms cannot be skipped over without decoding them
+        return None
+
+    def dumps(self, obj):
+        if self.accelerated:
+            return erlpack.pack(obj)
+        return encode(obj)
@@ -0,0 +1,193 @@
+"""
+Running event handlers off the reactor thread.
+
+With a L{HandlerExecutor} given to the L{Client}, synchronous handlers run
+on a bounded thread pool so a slow handler cannot delay heartbeats or the
+processing of other frames. Handlers decorated with L{inline} still run on
+the reactor thread; handlers running on the pool must use
+C{reactor.callFromThread} to talk to the reactor.
+
+Every event type has its own queue. When a queue is full the overflow
+policy decides what happens:
+
+ - C{DROP_OLDEST}: the oldest queued event is discarded.
+ - C{PAUSE}: reading from the gateway is paused until the queues drain
+   below half their depth (the heartbeat keeps being sent). With no
+   connection bound, the oldest queued event is discarded instead.
+ - C{COALESCE}: a queued event for the same entity (see C{coalesce_key}) is
+   replaced by the new one, otherwise the oldest is discarded.
+"""
+from collections import deque
+
+from twisted.internet import threads
+from twisted.logger import Logger
+from twisted.python.threadpool import ThreadPool
+
+
+DROP_OLDEST = 'drop_oldest'
+PAUSE = 'pause'
+COALESCE = 'coalesce'
+
+
+def inline(func):
+    """
+    Mark an event handler to always run on the reactor thread.
+    """
+    func.inline = True
+    return func
+
+
+def entity_key(event, args, kwargs):
+    """
+    Default coalescing key: the user a payload is about, or its id.
+    """
+    data = args[0] if args else None
+    if not isinstance(data, dict):
+        return None
+    user = data.get('user')
+    if isinstance(user, dict) and 'id' in user:
+        return (data.get('guild_id'), user['id'])
+    return data.get('id')
+
+
+class EventQueue(object):
+    def __init__(self, event, max_depth):
+        self.event = event
+        self.max_depth = max_depth
+        self.items = deque()
+        self.scheduled = False
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_lag = 0.0
+
+    def stats(self, now):
+        return {
+            'depth': len(self.items),
+            'lag': now - self.items[0][0] if self.items else 0.0,
+            'max_lag': self.max_lag,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced
+        }
+
+
+class HandlerExecutor(object):
+    log = Logger()
+
+    def __init__(self, reactor=None, threads=4, max_depth=1000, overflow=DROP_OLDEST, depths=None,
+                 coalesce_key=entity_key):
+        if reactor is None:
+            from twisted.internet import reactor
+        if overflow not in (DROP_OLDEST, PAUSE, COALESCE):
+            raise ValueError('Unknown overflow policy {0!r}'.format(overflow))
+        self.reactor = reactor
+        self.threads = threads
+        self.max_depth = max_depth
+        self.depths = depths or {}
+        self.overflow = overflow
+        self.coalesce_key = coalesce_key
+
+        self.pool = ThreadPool(minthreads=0, maxthreads=threads, name='chord-handlers')
+
+        self.queues = {}
+        self.inflight = 0
+        self.paused = False
+        self.transport = None
+        self._ready = deque()
+
+    def bind(self, transport):
+        """
+        Set the producer paused by the C{PAUSE} overflow policy: the gateway
+        protocol, or any transport. Bind the producer of every new
+        connection; it starts paused if the queues are still full.
+        """
+        self.transport = transport
+        if self.paused and transport is not None:
+            transport.pauseProducing()
+
+    def submit(self, event, func, args, kwargs):
+        queue = self.queues.get(event)
+        if queue is None:
+            queue = self.queues[event] = EventQueue(event, self.depths.get(event, self.max_depth))
+
+        key = None
+        if self.overflow == COALESCE and self.coalesce_key is not None:
+            key = self.coalesce_key(event, args, kwargs)
+
+        if len(queue.items) >= queue.max_depth:
+            if self.overflow == PAUSE and self.transport is not None:
+                self._pause()
+            elif not (key is not None and self._coalesce(queue, key, func, args, kwargs)):
+                queue.items.popleft()
+                queue.dropped += 1
+                self.log.debug('Dropped queued {event} event', event=event)
+            else:
+                return
+
+        if not queue.scheduled:
+            queue.scheduled = True
+            self._ready.append(queue)
+        queue.items.append((self.reactor.seconds(), func, args, kwargs, key))
+        self._pump()
+
+    def _coalesce(self, queue, key, func, args, kwargs):
+        for i, item in enumerate(queue.items):
+            if item[4] == key and item[1] == func:
+                queue.items[i] = (item[0], func, args, kwargs, key)
+                queue.coalesced += 1
+                return True
+        return False
+
+    def _pump(self):
+        while self.inflight < self.threads and self._ready:
+            queue = self._ready.popleft()
+            enqueued, func, args, kwargs, key = queue.items.popleft()
+            if queue.items:
+                # Round robin between event types
+                self._ready.append(queue)
+            else:
+                queue.scheduled = False
+            queue.max_lag = max(queue.max_lag, self.reactor.seconds() - enqueued)
+            self.inflight += 1
+            d = self._run(func, args, kwargs)
+            d.addErrback(self._ebHandler, queue.event)
+            d.addBoth(self._done, queue)
+        if self.paused and all(len(q.items) <= q.max_depth // 2 for q in self.queues.values()):
+            self._resume()
+
+    def _run(self, func, args, kwargs):
+        if not self.pool.started:
+            self.pool.start()
+            self.reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+        return threads.deferToThreadPool(self.reactor, self.pool, func, *args, **kwargs)
+
+    def _done(self, result, queue):
+        self.inflight -= 1
+        queue.processed += 1
+        self._pump()
+
+    def _ebHandler(self, failure, event):
+        self.log.failure('Handler for {event} failed', failure, event=event)
+
+    def _pause(self):
+        if not self.paused and self.transport is not None:
+            self.log.warn('Handler queues full, pausing gateway reads')
+            self.paused = True
+            self.transport.pauseProducing()
+
+    def _resume(self):
+        self.paused = False
+        if self.transport is not None:
+            self.transport.resumeProducing()
+
+    def depth(self):
+        return sum(len(q.items) for q in self.queues.values())
+
+    def stats(self):
+        now = self.reactor.seconds()
+        return {
+            'inflight': self.inflight,
+            'paused': self.paused,
+            'events': dict((event, queue.stats(now)) for event, queue in self.queues.items())
+        }
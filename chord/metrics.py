@@ -0,0 +1,208 @@
+"""
+Counters and histograms for the gateway and REST hot paths.
+
+Collection is off unless a L{Metrics} registry is given to the L{Client}
+(or to L{DiscordClientFactory} and L{HTTPClient} directly); the
+instrumented code only checks for C{None} when it is not::
+
+    metrics = Metrics()
+    client = Client(token=token, metrics=metrics)
+    listen_metrics(metrics, 9100)
+
+L{listen_metrics} serves the registry in the Prometheus text format.
+"""
+import bisect
+import re
+import time
+
+from twisted.web import resource, server
+
+
+now = getattr(time, 'perf_counter', time.time)
+
+# Seconds, from a fast decode to a slow REST call
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_route_ids = re.compile(r'/\d+(?=/|$)')
+
+
+class _CounterValue(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _HistogramValue(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def labels(self, *values):
+        """
+        The value for these label values; keep it around on hot paths.
+        """
+        value = self._values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('{0} expects labels {1}'.format(self.name, self.labelnames))
+            value = self._values[values] = self._new_value()
+        return value
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in pairs) + '}'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, value in sorted(self._values.items()):
+            yield self.name + self._label_text(values), value.value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=default_buckets):
+        Metric.__init__(self, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, value in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, value.counts):
+                cumulative += count
+                yield self.name + '_bucket' + self._label_text(values, [('le', repr(float(bound)))]), cumulative
+            yield self.name + '_bucket' + self._label_text(values, [('le', '+Inf')]), value.count
+            yield self.name + '_sum' + self._label_text(values), value.sum
+            yield self.name + '_count' + self._label_text(values), value.count
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=default_buckets):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        The registry in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            for name, value in metric.samples():
+                lines.append('{0} {1}'.format(name, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics(Registry):
+    """
+    The metrics collected by chord.
+    """
+    def __init__(self):
+        Registry.__init__(self)
+        frames = self.counter('chord_gateway_frames_total', 'Gateway frames', ('direction',))
+        self.frames_in = frames.labels('in')
+        self.frames_out = frames.labels('out')
+
+        octets = self.counter('chord_gateway_bytes_total', 'Gateway payload bytes, compressed as on the wire '
+                              'and after decompression', ('direction', 'stage'))
+        self.bytes_in = octets.labels('in', 'wire')
+        self.bytes_in_decompressed = octets.labels('in', 'decompressed')
+        self.bytes_out = octets.labels('out', 'wire')
+
+        self.decode_seconds = self.histogram('chord_gateway_decode_seconds', 'Time decoding gateway frames').labels()
+        self.dispatch_seconds = self.histogram('chord_dispatch_seconds', 'Time handling a dispatch, per event',
+                                               ('event',))
+        self.rest_seconds = self.histogram('chord_rest_request_seconds', 'REST request latency, per route',
+                                           ('route', 'status'))
+        self.reconnects = self.counter('chord_gateway_reconnects_total', 'Gateway reconnects, per reason',
+                                       ('reason',))
+
+    def observe_rest(self, route, status, seconds):
+        self.rest_seconds.labels(_route_ids.sub('/{id}', route), str(status)).observe(seconds)
+
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, registry):
+        resource.Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.registry.render().encode('utf8')
+
+
+def listen_metrics(registry, port, interface='127.0.0.1', reactor=None):
+    """
+    Serve C{registry} to Prometheus on C{interface}:C{port}. Returns the
+    listening port.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    return reactor.listenTCP(port, server.Site(MetricsResource(registry)), interface=interface)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,176 @@
+"""
+Compact models for the entities kept by L{chord.state.ConnectionState}.
+
+Every model declares C{__slots__}, and ids and other strings repeated across
+thousands of entities (role ids, guild ids, regions) are interned, so a
+large guild costs a fraction of the raw payload dicts it was built from.
+"""
+import sys
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern  # noqa: F821 (Python 2)
+
+
+def intern_str(value):
+    if isinstance(value, str):
+        return _intern(value)
+    return value
+
+
+def intern_id(value, ids=None):
+    """
+    The shared object for the id C{value}, a string or an integer.
+
+    Integer ids (see L{chord.snowflake}) cannot go through C{sys.intern}:
+    each payload decodes its own int objects. Ids referenced from many
+    entities share one object through C{ids}, the table of the
+    L{chord.state.ConnectionState} holding them, which only keeps guild and
+    role ids and drops them when they are deleted.
+    """
+    if value.__class__ is int:
+        if ids is None:
+            return value
+        return ids.setdefault(value, value)
+    return intern_str(value)
+
+
+class Model(object):
+    __slots__ = ()
+
+    # Fields copied verbatim from the payload, interned when listed in
+    # _interned, or in _shared_ids for ids referenced from many entities
+    # (shared through the C{ids} table given, see intern_id).
+    _fields = ()
+    _interned = ()
+    _shared_ids = ()
+
+    def __init__(self, data, ids=None):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.update(data, ids)
+
+    def update(self, data, ids=None):
+        for field in self._fields:
+            if field in data:
+                value = data[field]
+                if field in self._shared_ids:
+                    value = intern_id(value, ids)
+                elif field in self._interned:
+                    value = intern_str(value)
+                setattr(self, field, value)
+        return self
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self._fields)
+
+    def __repr__(self):
+        return '<{0} id={1!r}>'.format(self.__class__.__name__, getattr(self, 'id', None))
+
+
+class User(Model):
+    __slots__ = ('id', 'username', 'discriminator', 'avatar', 'bot')
+    _fields = __slots__
+    _interned = ('id',)
+
+
+class Role(Model):
+    __slots__ = ('id', 'name', 'permissions', 'position', 'color', 'hoist', 'managed', 'mentionable')
+    _fields = __slots__
+    _interned = ('name',)
+    _shared_ids = ('id',)
+
+
+class Channel(Model):
+    __slots__ = ('id', 'guild_id', 'name', 'type', 'position', 'topic', 'last_message_id',
+                 'permission_overwrites')
+    _fields = __slots__
+    _interned = ('id', 'type')
+    _shared_ids = ('guild_id',)
+
+    def update(self, data, ids=None):
+        Model.update(self, data, ids)
+        if data.get('permission_overwrites') is not None:
+            self.permission_overwrites = tuple(
+                (intern_str(o.get('id')), intern_str(o.get('type')), o.get('allow'), o.get('deny'))
+                for o in data['permission_overwrites'])
+        return self
+
+    def to_dict(self):
+        data = Model.to_dict(self)
+        if self.permission_overwrites is not None:
+            data['permission_overwrites'] = [
+                {'id': i, 'type': t, 'allow': a, 'deny': d} for i, t, a, d in self.permission_overwrites]
+        return data
+
+
+class Member(Model):
+    """
+    A guild member. C{user} is the L{User} shared by every guild the user is
+    in.
+    """
+    __slots__ = ('user', 'guild_id', 'roles', 'nick', 'joined_at', 'deaf', 'mute')
+    _fields = ('nick', 'joined_at', 'deaf', 'mute')
+
+    def __init__(self, data, user, guild_id, ids=None):
+        Model.__init__(self, data, ids)
+        self.user = user
+        self.guild_id = intern_id(guild_id, ids)
+
+    def update(self, data, ids=None):
+        Model.update(self, data, ids)
+        if 'roles' in data:
+            self.roles = tuple(intern_id(role, ids) for role in data['roles'])
+        return self
+
+    @property
+    def id(self):
+        return self.user.id
+
+    def to_dict(self):
+        data = Model.to_dict(self)
+        data['roles'] = list(self.roles or ())
+        data['user'] = self.user.to_dict()
+        return data
+
+
+class Guild(Model):
+    """
+    A guild with its roles, channels and members, each keyed by id.
+    """
+    __slots__ = ('id', 'name', 'owner_id', 'region', 'icon', 'large', 'member_count',
+                 'unavailable', 'roles', 'channels', 'members')
+    _fields = ('id', 'name', 'owner_id', 'region', 'icon', 'large', 'member_count', 'unavailable')
+    _interned = ('owner_id', 'region')
+    _shared_ids = ('id',)
+
+    def __init__(self, data, ids=None):
+        Model.__init__(self, data, ids)
+        self.roles = {}
+        self.channels = {}
+        self.members = {}
+
+    def to_dict(self):
+        data = Model.to_dict(self)
+        data['roles'] = [role.to_dict() for role in self.roles.values()]
+        data['channels'] = [channel.to_dict() for channel in self.channels.values()]
+        data['members'] = [member.to_dict() for member in self.members.values()]
+        return data
+
+
+class Message(Model):
+    """
+    A message. C{author} is the cached L{User} when available.
+    """
+    __slots__ = ('id', 'channel_id', 'guild_id', 'author', 'content', 'timestamp', 'edited_timestamp',
+                 'pinned', 'tts')
+    _fields = ('id', 'channel_id', 'guild_id', 'content', 'timestamp', 'edited_timestamp', 'pinned', 'tts')
+    _interned = ('id', 'channel_id')
+    _shared_ids = ('guild_id',)
+
+    def to_dict(self):
+        data = Model.to_dict(self)
+        if self.author is not None:
+            data['author'] = self.author.to_dict()
+        return data
@@ -29,20 +29,143 @@ from autobahn.twisted.websocket import WebSocketClientProtocol, \
 from twisted.internet import defer, task, error
 from twisted.logger import Logger
 
-import random
-import json
 import sys
-import zlib
+from collections import deque
 
 
 from chord import __user_agent__
+from chord.codec import get_codec
+from chord.compression import get_inflater
 from chord.errors import WSError, WSReconnect
+from chord.incremental import IncrementalParser, cooperator, peak_memory, depths as incremental_depths
+from chord.metrics import now
+from chord.reconnect import FATAL, IDENTIFY, close_reason, get_coordinator
+from chord.sendqueue import SendQueue
+from chord.snowflake import IntIdCodec
+from chord.util import gateway_url
 
 
 class EventHandler(object):
     def handle_event(self, event, data):
         raise NotImplementedError('handle_event not implemented in client')
 
+    def wants_event(self, event):
+        """
+        Return whether C{event} should be decoded and passed to
+        L{handle_event}. Only consulted when lazy decoding is enabled.
+        """
+        return True
+
+    def protocol_opened(self, protocol):
+        """
+        Called when a protocol of the factory the handler is registered
+        with opens, including those opened when reconnecting.
+        """
+
+
+class MemberRequest(object):
+    def __init__(self, guild_id, expected):
+        self.guild_id = guild_id
+        self.expected = expected
+        self.received = 0
+        self.chunks = 0
+        self.waiters = []
+        self.timeout_call = None
+
+
+class MemberChunker(object):
+    """
+    Fetches complete member lists with REQUEST_MEMBERS.
+
+    Requests made during the same reactor iteration are sent together,
+    C{batch_size} guild ids per frame. The members arrive as
+    GUILD_MEMBERS_CHUNK dispatches, which go through the event handlers
+    (and so the cache) as usual; the Deferred returned by L{request} fires
+    with the number of members received once the last chunk is in.
+    """
+    batch_size = 50
+    # Members per GUILD_MEMBERS_CHUNK, a smaller chunk is the last one
+    chunk_size = 1000
+    timeout = 120
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.pending = {}
+        self.member_counts = {}
+        self._queued = []
+        self._flush_call = None
+
+    def request(self, guild_id):
+        # Chunks carry the guild id in the form the codec decodes it to
+        guild_id = int(guild_id) if self.protocol.factory.int_ids else guild_id
+        request = self.pending.get(guild_id)
+        if request is None:
+            reactor = self.protocol.factory.reactor
+            request = self.pending[guild_id] = MemberRequest(guild_id, self.member_counts.get(guild_id))
+            request.timeout_call = reactor.callLater(self.timeout, self._timed_out, guild_id)
+            self._queued.append(guild_id)
+            if self._flush_call is None:
+                self._flush_call = reactor.callLater(0, self.flush)
+        d = defer.Deferred()
+        request.waiters.append(d)
+        return d
+
+    def flush(self):
+        self._flush_call = None
+        queued, self._queued = self._queued, []
+        for i in range(0, len(queued), self.batch_size):
+            self.protocol.send_op(self.protocol.REQUEST_MEMBERS, {
+                'guild_id': queued[i:i + self.batch_size],
+                'query': '',
+                'limit': 0
+            })
+
+    def guild_available(self, data):
+        if data.get('member_count') is not None:
+            self.member_counts[data['id']] = data['member_count']
+
+    def chunk_received(self, data):
+        request = self.pending.get(data.get('guild_id'))
+        if request is None:
+            return
+        count = len(data.get('members', ()))
+        request.received += count
+        request.chunks += 1
+        if 'chunk_count' in data:
+            done = request.chunks >= data['chunk_count']
+        else:
+            done = count < self.chunk_size or (request.expected is not None and request.received >= request.expected)
+        if done:
+            self._finish(request.guild_id)
+            for d in request.waiters:
+                d.callback(request.received)
+
+    def _finish(self, guild_id):
+        request = self.pending.pop(guild_id)
+        if request.timeout_call is not None and request.timeout_call.active():
+            request.timeout_call.cancel()
+        if guild_id in self._queued:
+            self._queued.remove(guild_id)
+        return request
+
+    def _timed_out(self, guild_id):
+        request = self.pending.get(guild_id)
+        if request is not None:
+            request.timeout_call = None
+            self._fail(guild_id, defer.TimeoutError('Member request for guild {0} timed out'.format(guild_id)))
+
+    def _fail(self, guild_id, error):
+        request = self._finish(guild_id)
+        for d in request.waiters:
+            d.errback(error)
+
+    def fail_all(self, error):
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        for guild_id in list(self.pending):
+            self._fail(guild_id, error)
+
 
 class DiscordClientProtocol(WebSocketClientProtocol):
     _log = Logger()
@@ -57,15 +180,34 @@ class DiscordClientProtocol(WebSocketClientProtocol):
     RECONNECT          = 7
     REQUEST_MEMBERS    = 8
     INVALIDATE_SESSION = 9
+    HELLO              = 10
+    HEARTBEAT_ACK      = 11
+
+    # Dispatches the protocol itself relies on, always decoded.
+    internal_events = frozenset(['READY', 'RESUMED'])
 
     _event_handlers = []
     _ka_task = None
-    sequence = 0
-    session_id = None
+    _inflater = None
+    # Frames held back while handlers finish an earlier one, see _wait
+    _backlog = None
+    # Send time of the heartbeat not acknowledged yet
+    _heartbeat_sent = None
+    # Zombie detection is armed by the first HEARTBEAT_ACK, so gateway
+    # versions that never acknowledge heartbeats are not flagged.
+    _acks_seen = False
+    _gateway_queue = None
+    # Waiting for an IDENTIFY slot, see chord.reconnect
+    _identifying = None
+    # Set while the handler executor holds reads back, see pauseProducing
+    reads_paused = False
 
     def __init__(self, *args, **kwargs):
         WebSocketClientProtocol.__init__(self, *args, **kwargs)
         self._event_handlers = []
+        self._close_waiters = []
+        self.closed = False
+        self.chunker = MemberChunker(self)
 
     def onConnect(self, response):
         self._log.debug("Connecting to Discord server: {0}".format(response.peer))
@@ -74,9 +216,45 @@ class DiscordClientProtocol(WebSocketClientProtocol):
         self._log.debug("Discord connection opened")
         # Reset factory reconnect delay
         self.factory.resetDelay()
-        self.identify()
+        self._inflater = get_inflater(self.factory.compression)
+        self.factory.protocol_opened(self)
+        if self.session_id is not None:
+            self.resume()
+        else:
+            self.identify()
+
+    # Session state lives on the factory so it survives reconnects
+
+    @property
+    def sequence(self):
+        return self.factory.sequence
+
+    @sequence.setter
+    def sequence(self, value):
+        self.factory.sequence = value
+
+    @property
+    def session_id(self):
+        return self.factory.session_id
+
+    @session_id.setter
+    def session_id(self, value):
+        self.factory.session_id = value
 
     def identify(self):
+        """
+        Send IDENTIFY once the factory's coordinator lets it through.
+        """
+        if self._identifying is not None:
+            return
+        d = self.factory.coordinator.identify()
+        if not d.called:
+            self._identifying = d
+        d.addCallback(self._send_identify)
+        d.addErrback(lambda failure: failure.trap(defer.CancelledError))
+
+    def _send_identify(self, _):
+        self._identifying = None
         payload = {
             'op': self.IDENTIFY,
             'd': {
@@ -88,23 +266,137 @@ class DiscordClientProtocol(WebSocketClientProtocol):
                     '$referrer': '',
                     '$referring_domain': ''
                 },
-                'compress': True,
-                'large_threshold': 250,
+                'compress': self._inflater.identify_compress,
+                'large_threshold': self.factory.large_threshold,
                 'v': 3
             }
         }
-        self.sendMessage(json.dumps(payload))
+        if self.factory.shard is not None:
+            payload['d']['shard'] = list(self.factory.shard)
+        self.send_op(self.IDENTIFY, payload['d'])
+
+    def resume(self):
+        self._log.debug('Resuming session {session_id} at {sequence}', session_id=self.session_id, sequence=self.sequence)
+        self.send_op(self.RESUME, {
+            'token': self.factory.token,
+            'session_id': self.session_id,
+            'seq': self.sequence
+        })
 
     def onMessage(self, payload, isBinary):
+        metrics = self.factory.metrics
+        if metrics is not None:
+            metrics.frames_in.inc()
+            metrics.bytes_in.inc(len(payload))
         if isBinary:
-            payload = zlib.decompress(payload, 15, 10490000) # This is 10 MiB
-
-        payload = payload.decode('utf8')
+            try:
+                payload = self._inflater.feed(payload)
+            except WSError as e:
+                self._log.error('Dropping the gateway connection: {error}', error=e)
+                self.dropConnection(abort=True)
+                return
+            if payload is None:
+                return
+        if metrics is not None:
+            metrics.bytes_in_decompressed.inc(len(payload))
 
         #self._log.debug('RECV: {payload}', payload=payload)
 
-        msg = json.loads(payload)
-
+        if self._backlog is not None:
+            # Handlers are still busy with an earlier frame, keep the order,
+            # but do not let a queued ACK make the connection look dead
+            if len(payload) < 128 and self.factory.codec.loads(payload).get('op') == self.HEARTBEAT_ACK:
+                self._ack()
+                return
+            self._backlog.append(payload)
+            return
+        self._process(payload)
+
+    def _process(self, payload):
+        factory = self.factory
+        large = factory.incremental and len(payload) >= factory.large_frame_threshold
+        if factory.lazy or large:
+            envelope = factory.codec.peek(payload)
+            if envelope is not None:
+                op, seq, event = envelope
+                if (factory.lazy and op == self.DISPATCH and event not in self.internal_events
+                        and not self.wants_event(event)):
+                    if seq is not None:
+                        self.sequence = seq
+                    return
+                if large and op == self.DISPATCH and event in incremental_depths:
+                    self._process_large(payload, event)
+                    return
+
+        if factory.metrics is None:
+            msg = factory.codec.loads(payload)
+        else:
+            started = now()
+            msg = factory.codec.loads(payload)
+            factory.metrics.decode_seconds.observe(now() - started)
+        self._wait(self._handle(msg))
+
+    def _process_large(self, payload, event):
+        """
+        Parse and hand a large READY or GUILD_CREATE to the handlers in
+        slices, recording the time and memory it took in
+        C{factory.large_frames}.
+        """
+        self._backlog = deque()
+        clock = self.factory.reactor
+        frame = {'event': event, 'size': len(payload)}
+        started = clock.seconds()
+        memory = peak_memory()
+        parser = IncrementalParser(payload, incremental_depths[event], self.factory.slice_size,
+                                   getattr(self.factory.codec, 'object_hook', None))
+
+        def parsed(_):
+            frame['parse_time'] = clock.seconds() - started
+            waits = self._handle(parser.result)
+            return defer.gatherResults(waits, consumeErrors=True) if waits else None
+
+        def handled(_):
+            frame['total_time'] = clock.seconds() - started
+            frame['peak_memory'] = peak_memory()
+            frame['peak_growth'] = frame['peak_memory'] - memory
+            self.factory.large_frames.append(frame)
+            self._log.info('{event} frame of {size} bytes parsed in {parse_time:.3f}s, handled in '
+                           '{total_time:.3f}s, peak memory {peak_memory} bytes (+{peak_growth})', **frame)
+
+        d = self.factory.cooperator.cooperate(parser.parse()).whenDone()
+        d.addCallback(parsed)
+        d.addCallback(handled)
+        d.addErrback(self._ebProcess)
+        d.addBoth(self._drain)
+
+    def _wait(self, waits):
+        """
+        Hold back the following frames until the Deferreds returned by the
+        handlers fire.
+        """
+        if not waits:
+            return
+        self._backlog = deque()
+        d = defer.gatherResults(waits, consumeErrors=True)
+        d.addErrback(self._ebProcess)
+        d.addBoth(self._drain)
+
+    def _drain(self, result=None):
+        backlog, self._backlog = self._backlog, None
+        while backlog:
+            self._process(backlog.popleft())
+            if self._backlog is not None:
+                # Waiting again, the rest is drained when that is done
+                self._backlog.extend(backlog)
+                return
+
+    def _ebProcess(self, failure):
+        self._log.failure('Processing a frame failed', failure)
+
+    def _handle(self, msg):
+        """
+        Act on a decoded frame, returning the Deferreds handlers returned.
+        """
         op = msg.get('op')
         data = msg.get('d')
 
@@ -112,8 +404,20 @@ class DiscordClientProtocol(WebSocketClientProtocol):
             self.sequence = msg.get('s')
 
         if op == self.RECONNECT:
+            # Closing with 1000 would invalidate the session: drop the
+            # connection instead and resume on a new one right away
             self._log.debug('Got RECONNECT')
-            self.sendClose(code=1000, reason='RECONNECT requested')
+            self.factory.reconnect_now = 'reconnect'
+            self._stop_heartbeat()
+            self.dropConnection(abort=True)
+            return
+
+        if op == self.HEARTBEAT_ACK:
+            self._ack()
+            return
+
+        if op == self.HELLO:
+            self._start_heartbeat(data['heartbeat_interval'])
             return
 
         if op == self.INVALIDATE_SESSION:
@@ -131,40 +435,148 @@ class DiscordClientProtocol(WebSocketClientProtocol):
         if event == 'READY':
             self.sequence = msg.get('s')
             self.session_id = data.get('session_id')
+            self.factory.user_id = (data.get('user') or {}).get('id')
 
-        if event == 'READY' or event == 'RESUMED':
-            interval = data.get('heartbeat_interval') / 1000.0
-            if self._ka_task is not None and self._ka_task.running:
-                self._ka_task.stop()
-            self._ka_task = task.LoopingCall(self.keepAlive)
-            self._ka_task.start(interval)
+        if (event == 'READY' or event == 'RESUMED') and data.get('heartbeat_interval'):
+            self._start_heartbeat(data['heartbeat_interval'])
 
+        if event == 'GUILD_CREATE':
+            self.chunker.guild_available(data)
+            if self.factory.fetch_members and data.get('large'):
+                self.chunker.request(data['id'])
+
+        metrics = self.factory.metrics
+        if metrics is not None:
+            started = now()
+        waits = []
+        for handler in self._event_handlers:
+            result = handler.handle_event(event, msg)
+            if isinstance(result, defer.Deferred):
+                waits.append(result)
+        if metrics is not None:
+            metrics.dispatch_seconds.labels(event).observe(now() - started)
+
+        if event == 'GUILD_MEMBERS_CHUNK':
+            self.chunker.chunk_received(data)
+        return waits
+
+    def wants_event(self, event):
+        if event == 'GUILD_MEMBERS_CHUNK' and self.chunker.pending:
+            return True
+        if event == 'GUILD_CREATE' and self.factory.fetch_members:
+            return True
         for handler in self._event_handlers:
-            handler.handle_event(event, msg)
+            if handler.wants_event(event):
+                return True
+        return False
 
-    def keepAlive(self):
-        self.sendMessage(json.dumps({
-            'op': self.HEARTBEAT,
-            'd': self.sequence
-        }))
+    def request_members(self, guild_id):
+        """
+        Request every member of C{guild_id}. Returns a Deferred firing with
+        the number of members received.
+        """
+        return self.chunker.request(guild_id)
 
-    def sendMessage(self, *args, **kwargs):
-        self._log.debug('SEND: {payload}', payload=args[0])
-        return WebSocketClientProtocol.sendMessage(self, *args, **kwargs)
+    @property
+    def gateway_queue(self):
+        if self._gateway_queue is None:
+            binary = self.factory.codec.binary
+            self._gateway_queue = SendQueue(lambda payload: self.sendMessage(payload, binary), self.factory.reactor)
+        return self._gateway_queue
 
-    def onClose(self, wasClean, code, reason):
+    def send_op(self, op, data):
+        """
+        Queue a frame, see L{chord.sendqueue}.
+        """
+        self.gateway_queue.send(op, data, self.factory.codec.dumps({'op': op, 'd': data}))
+
+    def _start_heartbeat(self, interval):
+        self._stop_heartbeat()
+        self._ka_task = task.LoopingCall(self.keepAlive)
+        self._ka_task.clock = self.factory.reactor
+        self._ka_task.start(interval / 1000.0)
+
+    def _stop_heartbeat(self):
         if self._ka_task is not None and self._ka_task.running:
             self._ka_task.stop()
+        self._heartbeat_sent = None
+
+    def pauseProducing(self):
+        """
+        Stop reading from the socket, for the C{PAUSE} overflow policy of
+        L{chord.executor}. Heartbeats keep going out, but their unread
+        acknowledgements do not mark the connection as a zombie.
+        """
+        self.reads_paused = True
+        self.transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.reads_paused = False
+        # Acknowledgements held back while paused are yet to be read
+        self._heartbeat_sent = None
+        self.transport.resumeProducing()
+
+    def keepAlive(self):
+        if self._heartbeat_sent is not None and self._acks_seen and not self.reads_paused:
+            self._zombie()
+            return
+        self._heartbeat_sent = self.factory.reactor.seconds()
+        self.send_op(self.HEARTBEAT, self.sequence)
+
+    def _ack(self):
+        self._acks_seen = True
+        if self._heartbeat_sent is not None:
+            self.factory.record_latency(self.factory.reactor.seconds() - self._heartbeat_sent)
+            self._heartbeat_sent = None
+
+    def _zombie(self):
+        """
+        The last heartbeat was never acknowledged: drop the connection and
+        resume right away instead of waiting for TCP to notice.
+        """
+        self._log.warn('No HEARTBEAT_ACK received, dropping zombie connection')
+        self.factory.zombies += 1
+        self.factory.reconnect_now = 'zombie'
+        self._stop_heartbeat()
+        self.dropConnection(abort=True)
+
+    def sendMessage(self, payload, *args, **kwargs):
+        if self.factory.log_payloads:
+            self._log.debug('SEND: {payload}', payload=payload)
+        metrics = self.factory.metrics
+        if metrics is not None:
+            metrics.frames_out.inc()
+            metrics.bytes_out.inc(len(payload))
+        return WebSocketClientProtocol.sendMessage(self, payload, *args, **kwargs)
+
+    def when_closed(self):
+        """
+        Return a Deferred firing once the connection is closed.
+        """
+        if self.closed:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._close_waiters.append(d)
+        return d
+
+    def onClose(self, wasClean, code, reason):
+        self._stop_heartbeat()
+        if self._identifying is not None:
+            self._identifying.cancel()
+            self._identifying = None
+        self.closed = True
+        if self.factory.current_protocol is self:
+            self.factory.current_protocol = None
+        self.factory.closed(code)
+        if self._gateway_queue is not None:
+            self._gateway_queue.clear()
+        if self._inflater is not None:
+            self._inflater.reset()
+        self.chunker.fail_all(WSError('Connection closed before all members were received'))
+        waiters, self._close_waiters = self._close_waiters, []
+        for d in waiters:
+            d.callback(None)
 
-        # if code == 1000 and reason == 'RECONNECT requested':
-        #     return self.factory.clientConnectionLost(self.factory.connector, 'Reconnecting to Discord')
-        #
-        # if wasClean:
-        #     # Intentional disconnect.
-        #     self.factory.stopTrying()
-        #     self.factory.stopFactory()
-        # else:
-        #     self.factory.clientConnectionFailed(self.factory.connector, "Discord connection closed: {0} {1}".format(code, reason))
 
     def add_event_handler(self, handler):
         if not isinstance(handler, EventHandler):
@@ -179,6 +591,17 @@ class DiscordClientFactory(WebSocketClientFactory):
     protocol = DiscordClientProtocol
 
     pending = None
+    # The protocol of the connection in progress, None between connections
+    current_protocol = None
+
+    # Gateway session, resumed after a dropped connection
+    session_id = None
+    sequence = 0
+    # The bot's user id, from READY
+    user_id = None
+
+    # Log every frame sent, at debug level
+    log_payloads = False
 
     def __init__(self,
                  url=None,
@@ -187,32 +610,133 @@ class DiscordClientFactory(WebSocketClientFactory):
                  useragent=__user_agent__,
                  headers=None,
                  proxy=None,
-                 reactor=None):
+                 reactor=None,
+                 compression='payload',
+                 codec=None,
+                 lazy=False,
+                 shard=None,
+                 large_threshold=250,
+                 fetch_members=False,
+                 incremental=False,
+                 large_frame_threshold=1024 * 1024,
+                 slice_size=200,
+                 metrics=None,
+                 encoding='json',
+                 int_ids=False,
+                 coordinator=None):
         if reactor is None:
             from twisted.internet import reactor
         self.reactor = reactor
+        self.clock = reactor
         self.token = token
+        # The gateway encoding, 'json' (decoded by codec) or 'etf'
+        self.codec = get_codec('etf' if encoding == 'etf' else codec)
+        # Decode snowflakes as integers, see chord.snowflake
+        self.int_ids = int_ids
+        if int_ids:
+            self.codec = IntIdCodec(self.codec)
+        # Skip decoding dispatches no event handler wants
+        self.lazy = lazy
+        # (shard_id, shard_count) sent in IDENTIFY
+        self.shard = shard
+        # Guilds above large_threshold members are sent without offline
+        # members; fetch_members requests them as they become available.
+        self.large_threshold = large_threshold
+        self.fetch_members = fetch_members
+        self.event_handlers = []
+
+        # READY and GUILD_CREATE frames of large_frame_threshold bytes or
+        # more are parsed slice_size values at a time, see chord.incremental
+        self.incremental = incremental
+        self.large_frame_threshold = large_frame_threshold
+        self.slice_size = slice_size
+        self.cooperator = cooperator(reactor)
+        self.large_frames = deque(maxlen=100)
+        # See chord.metrics
+        self.metrics = metrics
+
+        # Heartbeat round trips of the last connections, in seconds
+        self.latencies = deque(maxlen=100)
+        self.zombies = 0
+        # Why the connection was dropped to reconnect right away ('zombie'
+        # or 'reconnect'), None otherwise
+        self.reconnect_now = None
+        # Shared by the factories of the process, see chord.reconnect
+        self.coordinator = get_coordinator(reactor) if coordinator is None else coordinator
+        # Why the last connection closed, from its close code
+        self.close_reason = None
+
+        # 'payload' (zlib per payload), 'zlib-stream' (one zlib stream per
+        # connection) or None
+        self.compression = compression
+        params = {'encoding': self.codec.encoding}
+        compress = get_inflater(compression).query
+        if compress is not None:
+            params['compress'] = compress
+        if url is not None:
+            url = gateway_url(url, **params)
 
         if not deferred:
             deferred = defer.Deferred()
         self.deferred = deferred
 
-        self.logOctets = False
-        self.logFrames = False
-        self.trackTimings = False
-
-        random.seed()
-        self.setSessionParameters(url, None, None, useragent, headers, proxy)
-        self.resetProtocolOptions()
+        WebSocketClientFactory.__init__(self, url, None, None, useragent, headers, proxy, reactor=reactor)
 
     def buildProtocol(self, addr):
         p = self.protocol()
         p.factory = self
-        self.pending = self.reactor.callLater(
-            0, self.fire, self.deferred.callback, p)
-        self.deferred = None
+        self.current_protocol = p
+        for handler in self.event_handlers:
+            p.add_event_handler(handler)
+        if self.deferred is not None:
+            self.pending = self.reactor.callLater(
+                0, self.fire, self.deferred.callback, p)
+            self.deferred = None
         return p
 
+    def add_event_handler(self, handler):
+        """
+        Register C{handler} with every protocol this factory builds, including
+        the ones built when reconnecting.
+        """
+        if not isinstance(handler, EventHandler):
+            raise ValueError('Invalid event handler')
+        if handler not in self.event_handlers:
+            self.event_handlers.append(handler)
+
+    def protocol_opened(self, protocol):
+        for handler in self.event_handlers:
+            handler.protocol_opened(protocol)
+
+    def record_latency(self, latency):
+        self.latencies.append(latency)
+
+    @property
+    def latency(self):
+        """
+        Round trip of the last acknowledged heartbeat, or C{None}.
+        """
+        return self.latencies[-1] if self.latencies else None
+
+    def latency_stats(self):
+        """
+        Rolling gateway latency over the last heartbeats, in seconds.
+        """
+        ordered = sorted(self.latencies)
+
+        def percentile(p):
+            if not ordered:
+                return None
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+        return {
+            'last': self.latency,
+            'p50': percentile(0.5),
+            'p99': percentile(0.99),
+            'samples': len(ordered),
+            'zombies': self.zombies
+        }
+
     def __repr__(self):
         clz = self.__class__.__name__
         mem = '0x' + hex(id(self))[2:].zfill(8)
@@ -226,18 +750,10 @@ class DiscordClientFactory(WebSocketClientFactory):
         self.pending = None
         func(value)
 
-    # Reconnect
+    # Reconnect, with delays drawn by the coordinator
 
     maxDelay = 3600
     initialDelay = 1.0
-    # Note: These highly sensitive factors have been precisely measured by
-    # the National Institute of Science and Technology.  Take extreme care
-    # in altering them, or you may damage your Internet!
-    # (Seriously: <http://physics.nist.gov/cuu/Constants/index.html>)
-    factor = 2.7182818284590451 # (math.e)
-    # Phi = 1.6180339887498948 # (Phi is acceptable for use as a
-    # factor if e is too large for your application.)
-    jitter = 0.11962656472 # molar Planck constant times c, joule meter/mole
 
     delay = initialDelay
     retries = 0
@@ -248,17 +764,45 @@ class DiscordClientFactory(WebSocketClientFactory):
 
     continueTrying = True
 
+    def closed(self, code):
+        """
+        Act on the close code of the connection: start a new session, or
+        stop reconnecting when the code is fatal.
+        """
+        reason, action = close_reason(code)
+        self.close_reason = reason
+        if action == IDENTIFY:
+            self.session_id = None
+            self.sequence = 0
+        elif action == FATAL:
+            self.coordinator.record_fatal(code, reason)
+            self.stopTrying()
+
+    def _reconnect_reason(self, default):
+        if self.reconnect_now:
+            return self.reconnect_now
+        if self.close_reason is not None and self.close_reason != 'lost':
+            return self.close_reason
+        return default
 
     def clientConnectionFailed(self, connector, reason):
         self._log.debug('Connection failed, reconnecting... ({})'.format(reason))
+        if self.metrics is not None:
+            self.metrics.reconnects.labels('failed').inc()
         if self.continueTrying:
+            self.coordinator.record('failed')
             self.connector = connector
             self.retry()
 
 
     def clientConnectionLost(self, connector, reason):
         self._log.debug('Connection lost, reconnecting... ({})'.format(reason))
+        label = self._reconnect_reason('lost')
+        self.close_reason = None
+        if self.metrics is not None:
+            self.metrics.reconnects.labels(label).inc()
         if self.continueTrying:
+            self.coordinator.record(label)
             self.connector = connector
             self.retry()
 
@@ -285,13 +829,17 @@ class DiscordClientFactory(WebSocketClientFactory):
                         (connector, self.retries))
             return
 
-        self.delay = min(self.delay * self.factor, self.maxDelay)
-        if self.jitter:
-            self.delay = random.normalvariate(self.delay,
-                                              self.delay * self.jitter)
+        if self.reconnect_now:
+            # Dropped a zombie connection or asked to reconnect, resume
+            # without waiting
+            self.reconnect_now = None
+            delay = 0
+        else:
+            self.delay = self.coordinator.next_delay(self.delay, self.initialDelay, self.maxDelay)
+            delay = self.delay
 
         if self.noisy:
-            self._log.debug("%s will retry in %d seconds" % (connector, self.delay,))
+            self._log.debug("%s will retry in %.1f seconds" % (connector, delay,))
 
         def reconnector():
             self._callID = None
@@ -299,7 +847,7 @@ class DiscordClientFactory(WebSocketClientFactory):
         if self.clock is None:
             from twisted.internet import reactor
             self.clock = reactor
-        self._callID = self.clock.callLater(self.delay, reconnector)
+        self._callID = self.clock.callLater(delay, reconnector)
 
 
     def stopTrying(self):
@@ -338,7 +886,7 @@ class DiscordClientFactory(WebSocketClientFactory):
         """
         state = self.__dict__.copy()
         for key in ['connector', 'retries', 'delay',
-                    'continueTrying', '_callID', 'clock']:
+                    'continueTrying', '_callID', 'clock', 'coordinator']:
             if key in state:
                 del state[key]
         return state
@@ -0,0 +1,181 @@
+"""
+Reconnect coordination.
+
+Every gateway factory of a process shares one L{ReconnectCoordinator} per
+reactor, which:
+
+ - spaces reconnect attempts with decorrelated jitter: each delay is drawn
+   uniformly between the base delay and three times the previous one, so
+   sessions dropped together by an outage spread out instead of retrying in
+   step;
+ - lets at most C{max_concurrency} IDENTIFYs through every
+   C{identify_interval} seconds, the limit Discord applies per bot (see
+   C{session_start_limit.max_concurrency} of C{/gateway/bot}); RESUMEs are
+   not limited;
+ - records why connections closed, from the close code, and how often they
+   reconnect.
+
+Close codes map to an action: resume the session, identify a new one, or
+give up. Authentication and sharding errors are fatal, as retrying them
+cannot succeed.
+"""
+import random
+import weakref
+from collections import deque
+
+from twisted.internet import defer
+from twisted.logger import Logger
+
+
+RESUME = 'resume'
+IDENTIFY = 'identify'
+FATAL = 'fatal'
+
+# Gateway close code -> (reason, action)
+CLOSE_CODES = {
+    4000: ('unknown_error', RESUME),
+    4001: ('unknown_opcode', RESUME),
+    4002: ('decode_error', RESUME),
+    4003: ('not_authenticated', RESUME),
+    4004: ('authentication_failed', FATAL),
+    4005: ('already_authenticated', RESUME),
+    4007: ('invalid_seq', IDENTIFY),
+    4008: ('rate_limited', RESUME),
+    4009: ('session_timeout', IDENTIFY),
+    4010: ('invalid_shard', FATAL),
+    4011: ('sharding_required', FATAL),
+    4012: ('invalid_api_version', FATAL),
+    4013: ('invalid_intents', FATAL),
+    4014: ('disallowed_intents', FATAL),
+}
+
+
+def close_reason(code):
+    """
+    C{(reason, action)} for the close code C{code}; closes without a gateway
+    code resume.
+    """
+    if code in CLOSE_CODES:
+        return CLOSE_CODES[code]
+    if code is None or code == 1006:
+        return 'lost', RESUME
+    return 'closed', RESUME
+
+
+def decorrelated_jitter(previous, base, cap, rand=random.uniform):
+    """
+    The delay following C{previous}: uniform between C{base} and three times
+    C{previous}, at most C{cap}.
+    """
+    return min(cap, rand(base, max(base, previous * 3)))
+
+
+class ReconnectCoordinator(object):
+    log = Logger()
+
+    max_concurrency = 1
+    identify_interval = 5.0
+    # Window of reconnect_rate, in seconds
+    window = 60.0
+
+    def __init__(self, reactor=None, max_concurrency=None, identify_interval=None, rand=random.uniform):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        if identify_interval is not None:
+            self.identify_interval = identify_interval
+        self.rand = rand
+
+        # IDENTIFY slots in use, each freed identify_interval after use
+        self._identifying = 0
+        self._waiting = deque()
+        self._calls = []
+
+        self.reconnects = {}
+        self._recent = deque()
+        self.identifies = 0
+        self.fatal = 0
+
+    def next_delay(self, previous, base, cap):
+        return decorrelated_jitter(previous, base, cap, self.rand)
+
+    def identify(self):
+        """
+        Wait for an IDENTIFY slot. Returns a Deferred firing once the caller
+        may send it; cancel it to give up the place in line.
+        """
+        d = defer.Deferred(self._waiting.remove)
+        self._waiting.append(d)
+        self._next()
+        return d
+
+    def _next(self):
+        while self._waiting and self._identifying < self.max_concurrency:
+            self._identifying += 1
+            self.identifies += 1
+            call = self.reactor.callLater(self.identify_interval, self._release)
+            self._calls.append(call)
+            self._waiting.popleft().callback(None)
+
+    def _release(self):
+        self._calls = [call for call in self._calls if call.active()]
+        self._identifying -= 1
+        self._next()
+
+    @property
+    def pending_identifies(self):
+        return len(self._waiting)
+
+    def record(self, reason):
+        """
+        Count a reconnect caused by C{reason}.
+        """
+        self.reconnects[reason] = self.reconnects.get(reason, 0) + 1
+        now = self.reactor.seconds()
+        self._recent.append(now)
+        while self._recent and self._recent[0] <= now - self.window:
+            self._recent.popleft()
+
+    def record_fatal(self, code, reason):
+        self.fatal += 1
+        self.log.error('Gateway closed with {code} ({reason}), not reconnecting', code=code, reason=reason)
+
+    def reconnect_rate(self):
+        """
+        Reconnects per second over the last C{window} seconds.
+        """
+        now = self.reactor.seconds()
+        while self._recent and self._recent[0] <= now - self.window:
+            self._recent.popleft()
+        return len(self._recent) / self.window
+
+    def stats(self):
+        return {
+            'reconnects': dict(self.reconnects),
+            'rate': self.reconnect_rate(),
+            'identifies': self.identifies,
+            'pending_identifies': self.pending_identifies,
+            'fatal': self.fatal
+        }
+
+    def stop(self):
+        for call in self._calls:
+            if call.active():
+                call.cancel()
+        self._calls = []
+        self._identifying = 0
+
+
+_coordinators = weakref.WeakKeyDictionary()
+
+
+def get_coordinator(reactor):
+    """
+    The coordinator shared by the factories running on C{reactor}.
+    """
+    coordinator = _coordinators.get(reactor)
+    if coordinator is None:
+        coordinator = _coordinators[reactor] = ReconnectCoordinator(reactor)
+    return coordinator
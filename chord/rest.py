@@ -0,0 +1,227 @@
+"""
+REST API client.
+
+Endpoints are described by L{Route} templates, formatted once per call and
+keyed to their rate limit bucket. L{RESTClient} builds its headers once,
+shares identical GETs that are already in flight, and offers bulk helpers
+issuing as few requests as the API allows::
+
+    rest = RESTClient(token)
+    rest.get_user('80351110224678912')
+    rest.delete_messages(channel_id, message_ids)
+"""
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.http_headers import Headers
+
+from chord import __user_agent__
+from chord.errors import HTTPError, LoginError, RateLimitError
+from chord.snowflake import snowflake_time
+from chord.util import SimpleReceiver, StringProducer, get_http_client, route_key
+
+
+# Messages deleted per bulk-delete request, and fetched per history page
+BULK_DELETE_LIMIT = 100
+HISTORY_LIMIT = 100
+# Bulk deletes reject messages older than two weeks; a minute of margin
+# covers the time the request takes
+BULK_DELETE_MAX_AGE = 14 * 24 * 3600 - 60
+
+
+class Route(object):
+    """
+    An API endpoint: C{Route('GET', '/channels/{channel_id}', channel_id=1)}.
+    """
+    __slots__ = ('method', 'path', 'key')
+
+    def __init__(self, method, path, **params):
+        self.method = method
+        self.path = path.format(**params) if params else path
+        self.key = route_key(method, self.path)
+
+    def url(self, api_base):
+        return api_base + self.path
+
+    def __repr__(self):
+        return '<Route {0} {1}>'.format(self.method, self.path)
+
+
+class RESTClient(object):
+    def __init__(self, token, http=None, reactor=None):
+        self.http = get_http_client(reactor) if http is None else http
+        self.token = token
+        self._inflight = {}
+        self.coalesced = 0
+
+    @property
+    def token(self):
+        return self._token
+
+    @token.setter
+    def token(self, token):
+        self._token = token
+        self._headers = Headers({
+            'authorization': [token],
+            'User-Agent': [__user_agent__]
+        })
+        self._json_headers = self._headers.copy()
+        self._json_headers.setRawHeaders('content-type', ['application/json'])
+
+    def request(self, route, json=None, params=None, reason=None):
+        """
+        Call C{route}, returning a Deferred firing with the decoded response
+        body (C{None} when empty). Concurrent identical GETs share a single
+        request, and so the decoded body: do not modify it.
+        """
+        url = route.url(self.http.api_base)
+        if params:
+            query = urlencode(sorted((k, v) for k, v in params.items() if v is not None))
+            if query:
+                url += '?' + query
+
+        if route.method == 'GET' and json is None:
+            waiters = self._inflight.get(url)
+            if waiters is not None:
+                self.coalesced += 1
+                d = defer.Deferred()
+                waiters.append(d)
+                return d
+            self._inflight[url] = []
+            d = self._request(route, url, json, reason)
+            d.addBoth(self._release, url)
+            return d
+        return self._request(route, url, json, reason)
+
+    def _request(self, route, url, json, reason):
+        headers = self._headers if json is None else self._json_headers
+        if reason is not None:
+            headers = headers.copy()
+            headers.setRawHeaders('X-Audit-Log-Reason', [reason])
+        body = None if json is None else StringProducer(self.http.codec.dumps(json))
+
+        d = self.http.request(route.method, url, headers=headers, bodyProducer=body, route=route.key)
+        d.addCallback(self._cbResponse)
+        return d
+
+    def _cbResponse(self, response):
+        d = defer.Deferred()
+        response.deliverBody(SimpleReceiver(d))
+        d.addCallback(self._cbBody, response)
+        return d
+
+    def _cbBody(self, body, response):
+        if response.code == 429:
+            raise RateLimitError('Rate limited')
+        if response.code == 401 or response.code == 403:
+            raise LoginError('Unauthorized ({0})'.format(response.code))
+        if response.code >= 400:
+            raise HTTPError('Unexpected response from server ({0})'.format(response.code))
+        if not body:
+            return None
+        return self.http.codec.loads(body)
+
+    def _release(self, result, url):
+        for d in self._inflight.pop(url, ()):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        return result
+
+    # Users
+
+    def get_user(self, user_id):
+        return self.request(Route('GET', '/users/{user_id}', user_id=user_id))
+
+    def get_users(self, user_ids):
+        """
+        Fetch several users concurrently, each at most once.
+        """
+        return defer.gatherResults([self.get_user(user_id) for user_id in set(user_ids)], consumeErrors=True)
+
+    # Guilds
+
+    def get_guild(self, guild_id):
+        return self.request(Route('GET', '/guilds/{guild_id}', guild_id=guild_id))
+
+    def get_member(self, guild_id, user_id):
+        return self.request(Route('GET', '/guilds/{guild_id}/members/{user_id}', guild_id=guild_id, user_id=user_id))
+
+    # Channels and messages
+
+    def get_channel(self, channel_id):
+        return self.request(Route('GET', '/channels/{channel_id}', channel_id=channel_id))
+
+    def get_message(self, channel_id, message_id):
+        return self.request(Route('GET', '/channels/{channel_id}/messages/{message_id}',
+                                  channel_id=channel_id, message_id=message_id))
+
+    def send_message(self, channel_id, content, tts=False, **fields):
+        fields.update(content=content, tts=tts)
+        return self.request(Route('POST', '/channels/{channel_id}/messages', channel_id=channel_id), json=fields)
+
+    def edit_message(self, channel_id, message_id, **fields):
+        return self.request(Route('PATCH', '/channels/{channel_id}/messages/{message_id}',
+                                  channel_id=channel_id, message_id=message_id), json=fields)
+
+    def delete_message(self, channel_id, message_id, reason=None):
+        return self.request(Route('DELETE', '/channels/{channel_id}/messages/{message_id}',
+                                  channel_id=channel_id, message_id=message_id), reason=reason)
+
+    def delete_messages(self, channel_id, message_ids, reason=None):
+        """
+        Delete messages with as few requests as possible: one bulk delete
+        per C{BULK_DELETE_LIMIT} messages, a plain delete for a single one.
+        Repeated ids are deleted once, and messages too old for bulk
+        deletes (see C{BULK_DELETE_MAX_AGE}) one by one.
+        """
+        now = self.http.reactor.seconds()
+        seen = set()
+        recent = []
+        ds = []
+        for message_id in message_ids:
+            key = str(message_id)
+            if key in seen:
+                continue
+            seen.add(key)
+            if now - snowflake_time(message_id) < BULK_DELETE_MAX_AGE:
+                recent.append(message_id)
+            else:
+                ds.append(self.delete_message(channel_id, message_id, reason=reason))
+        for i in range(0, len(recent), BULK_DELETE_LIMIT):
+            batch = recent[i:i + BULK_DELETE_LIMIT]
+            if len(batch) == 1:
+                ds.append(self.delete_message(channel_id, batch[0], reason=reason))
+            else:
+                route = Route('POST', '/channels/{channel_id}/messages/bulk-delete', channel_id=channel_id)
+                ds.append(self.request(route, json={'messages': batch}, reason=reason))
+        d = defer.gatherResults(ds, consumeErrors=True)
+        d.addCallback(lambda ignored: None)
+        return d
+
+    def get_messages(self, channel_id, limit=HISTORY_LIMIT, before=None):
+        """
+        Fetch up to C{limit} messages before C{before} (the latest by
+        default), newest first, C{HISTORY_LIMIT} per request.
+        """
+        route = Route('GET', '/channels/{channel_id}/messages', channel_id=channel_id)
+        messages = []
+
+        def fetch(before):
+            page_size = min(HISTORY_LIMIT, limit - len(messages))
+            d = self.request(route, params={'limit': page_size, 'before': before})
+            d.addCallback(cbPage, page_size)
+            return d
+
+        def cbPage(page, page_size):
+            messages.extend(page or ())
+            if not page or len(page) < page_size or len(messages) >= limit:
+                return messages
+            return fetch(page[-1]['id'])
+
+        return fetch(before)
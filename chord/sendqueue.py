@@ -0,0 +1,149 @@
+"""
+Outbound gateway queue.
+
+The gateway closes connections sending more than C{limit} frames every
+C{per} seconds. L{SendQueue} keeps every connection under that budget:
+
+ - C{reserved} slots of the budget are kept for heartbeats, which are
+   never queued behind other frames.
+ - Control frames (IDENTIFY, RESUME) go before everything else.
+ - A queued PRESENCE, or VOICE_STATE for the same guild, is replaced by a
+   newer one instead of both being sent.
+
+Frames are serialized once, when enqueued.
+"""
+from collections import deque
+
+from twisted.logger import Logger
+
+
+HEARTBEAT = 1
+IDENTIFY = 2
+PRESENCE = 3
+VOICE_STATE = 4
+RESUME = 6
+
+CONTROL = 0
+NORMAL = 1
+
+_control_ops = frozenset([IDENTIFY, RESUME])
+
+
+def coalesce_key(op, data):
+    """
+    Frames with the same key supersede each other while queued.
+    """
+    if op == PRESENCE:
+        return (op,)
+    if op == VOICE_STATE and isinstance(data, dict):
+        return (op, data.get('guild_id'))
+    return None
+
+
+class SendQueue(object):
+    log = Logger()
+
+    limit = 120
+    per = 60.0
+    reserved = 3
+
+    def __init__(self, write, clock, limit=None, per=None, reserved=None):
+        self.write = write
+        self.clock = clock
+        if limit is not None:
+            self.limit = limit
+        if per is not None:
+            self.per = per
+        if reserved is not None:
+            self.reserved = reserved
+
+        # Send times within the last `per` seconds
+        self.sent = deque()
+        self.queues = (deque(), deque())
+        # coalesce key -> queued entry, entries are [key, payload, budget]
+        self.pending = {}
+        self._flush_call = None
+
+        self.total_sent = 0
+        self.coalesced = 0
+        self.delayed = 0
+
+    def send(self, op, data, payload):
+        """
+        Send C{payload}, the serialized frame for C{op} and C{data}, as soon
+        as the budget allows.
+        """
+        if op == HEARTBEAT:
+            if self._available(self.limit):
+                self._write(payload)
+                return
+            self.queues[CONTROL].appendleft([None, payload, self.limit])
+        else:
+            key = coalesce_key(op, data)
+            entry = self.pending.get(key) if key is not None else None
+            if entry is not None:
+                entry[1] = payload
+                self.coalesced += 1
+                return
+            entry = [key, payload, self.limit - self.reserved]
+            if key is not None:
+                self.pending[key] = entry
+            self.queues[CONTROL if op in _control_ops else NORMAL].append(entry)
+        self.flush()
+
+    def _available(self, budget):
+        cutoff = self.clock.seconds() - self.per
+        while self.sent and self.sent[0] <= cutoff:
+            self.sent.popleft()
+        return len(self.sent) < budget
+
+    def _write(self, payload):
+        self.sent.append(self.clock.seconds())
+        self.total_sent += 1
+        self.write(payload)
+
+    def _timer(self):
+        self._flush_call = None
+        self.flush()
+
+    def flush(self):
+        for queue in self.queues:
+            while queue:
+                if not self._available(queue[0][2]):
+                    self._schedule()
+                    return
+                key, payload, _ = queue.popleft()
+                if key is not None:
+                    del self.pending[key]
+                self._write(payload)
+
+    def _schedule(self):
+        if self._flush_call is None:
+            self.delayed += 1
+            self.log.debug('Gateway send budget exhausted, {depth} frames queued', depth=self.depth())
+            delay = max(0, self.sent[0] + self.per - self.clock.seconds())
+            self._flush_call = self.clock.callLater(delay, self._timer)
+
+    def clear(self):
+        """
+        Drop queued frames and forget the budget used, for a new connection.
+        """
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        for queue in self.queues:
+            queue.clear()
+        self.pending.clear()
+        self.sent.clear()
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues)
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'window': len(self.sent),
+            'sent': self.total_sent,
+            'coalesced': self.coalesced,
+            'delayed': self.delayed
+        }
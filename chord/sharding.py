@@ -0,0 +1,132 @@
+from twisted.internet import defer
+from twisted.logger import Logger
+from autobahn.twisted import websocket
+
+from chord.errors import LoginError
+from chord.protocol import EventHandler
+from chord.util import get_gateway_bot
+
+
+class ShardHandler(EventHandler):
+    """
+    Forwards the events of one shard to the manager's client, tagged with
+    the shard id.
+    """
+    def __init__(self, manager, shard_id):
+        self.manager = manager
+        self.shard_id = shard_id
+
+    def wants_event(self, event):
+        return self.manager.wants_event(event)
+
+    def handle_event(self, event, data):
+        return self.manager.handle_event(event, data, self.shard_id)
+
+    def protocol_opened(self, protocol):
+        self.manager.protocols[self.shard_id] = protocol
+
+
+class ShardManager(object):
+    """
+    Runs several gateway sessions for one L{Client}, each identifying as
+    C{[shard_id, shard_count]}.
+
+    Every event of every shard is dispatched to the client. Handlers and
+    C{wait_for} predicates taking a C{shard_id} argument (or C{**kwargs})
+    are called with the shard's id as a keyword argument. Connections are
+    opened C{identify_interval} seconds apart to stay within the IDENTIFY
+    rate limit.
+    """
+    log = Logger()
+
+    identify_interval = 5.0
+
+    def __init__(self, client, shard_count=None, shard_ids=None):
+        self.client = client
+        self.reactor = client.reactor
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.factories = {}
+        self.protocols = {}
+        self.listeners = []
+        self._calls = []
+
+    def add_listener(self, callback, events):
+        """
+        Call C{callback(event, data, shard_id)} for every dispatch of one of
+        C{events}, in addition to the client's handlers.
+        """
+        self.listeners.append((callback, frozenset(events)))
+
+    def wants_event(self, event):
+        if self.client.wants_event(event):
+            return True
+        for callback, events in self.listeners:
+            if event in events:
+                return True
+        return False
+
+    def handle_event(self, event, data, shard_id):
+        result = self.client.handle_event(event, data, shard_id=shard_id)
+        for callback, events in self.listeners:
+            if event in events:
+                callback(event, data, shard_id)
+        return result
+
+    def start(self):
+        """
+        Connect every shard. Returns a Deferred firing with the list of
+        protocols once all of them are connected.
+        """
+        if not self.client.token:
+            raise LoginError('Invalid token, try using fetch_token first.')
+
+        d = get_gateway_bot(self.client.token, reactor=self.reactor, http=self.client.http)
+        d.addCallback(self._cbGateway)
+        return d
+
+    def _cbGateway(self, result):
+        gateway, recommended = result
+        self.client._gateway = gateway
+        if self.shard_count is None:
+            self.shard_count = recommended
+        if self.shard_ids is None:
+            self.shard_ids = list(range(self.shard_count))
+        self.log.info('Starting {count} shard(s) of {total}', count=len(self.shard_ids), total=self.shard_count)
+
+        ds = []
+        for i, shard_id in enumerate(self.shard_ids):
+            d = defer.Deferred()
+            self._calls.append(self.reactor.callLater(i * self.identify_interval, self.connect_shard, shard_id, d))
+            ds.append(d)
+        return defer.gatherResults(ds)
+
+    def connect_shard(self, shard_id, deferred=None):
+        if deferred is None:
+            deferred = defer.Deferred()
+        factory = self.client.build_factory(self.client._gateway, deferred=deferred,
+                                            shard=(shard_id, self.shard_count))
+        factory.add_event_handler(ShardHandler(self, shard_id))
+        self.factories[shard_id] = factory
+
+        def cbConnected(protocol):
+            self.protocols[shard_id] = protocol
+            return protocol
+
+        websocket.connectWS(factory)
+        deferred.addCallback(cbConnected)
+        return deferred
+
+    def shard_for_guild(self, guild_id):
+        return (int(guild_id) >> 22) % self.shard_count
+
+    def stop(self):
+        for call in self._calls:
+            if call.active():
+                call.cancel()
+        self._calls = []
+        for shard_id, factory in self.factories.items():
+            factory.stopTrying()
+            protocol = self.protocols.get(shard_id)
+            if protocol is not None:
+                protocol.dropConnection(abort=True)
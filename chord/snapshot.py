@@ -0,0 +1,173 @@
+"""
+On-disk snapshots of a connection: gateway URL, session and entity cache.
+
+A restarted client restores the cache from a snapshot and RESUMEs the old
+session instead of identifying and rebuilding everything::
+
+    client.save_snapshot('bot.snapshot')
+    ...
+    client.restore_snapshot('bot.snapshot')
+    client.connect()
+
+The file is a magic line followed by length-prefixed records (a 4 byte
+big-endian length, then the encoded record). The first record holds the
+connection metadata; the others hold batches of entities of one kind, in
+an order that lets them be restored one by one. Records are read straight
+from a memory map. The token is only stored when asked for.
+"""
+import mmap
+import os
+import struct
+
+from chord.codec import get_codec
+from chord.errors import SnapshotError
+from chord.models import Guild, Member, Role
+
+
+MAGIC = b'CHORDSNAP1\n'
+BATCH_SIZE = 1000
+
+_length = struct.Struct('>I')
+
+
+def _records(state):
+    """
+    Yield C{(kind, data)} for every cached entity, users before the
+    guilds, channels and members referring to them.
+    """
+    for user in state.users.values():
+        yield 'users', user.to_dict()
+    for guild in state.guilds.values():
+        data = guild.to_dict()
+        data['members'] = []
+        yield 'guilds', data
+    for channel in state.channels.values():
+        if channel.guild_id is None:
+            yield 'channels', channel.to_dict()
+    for (guild_id, user_id), member in state.members.items():
+        data = member.to_dict()
+        data['user'] = user_id
+        data['guild_id'] = guild_id
+        yield 'members', data
+    for message in state.messages.values():
+        yield 'messages', message.to_dict()
+
+
+def write_snapshot(path, meta, state=None, codec=None, batch_size=BATCH_SIZE):
+    """
+    Write C{meta} and the entities of C{state} to C{path}, replacing it
+    atomically.
+    """
+    codec = get_codec(codec)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fp:
+        fp.write(MAGIC)
+
+        def record(obj):
+            data = codec.dumps(obj)
+            fp.write(_length.pack(len(data)))
+            fp.write(data)
+
+        record(meta)
+        if state is not None:
+            kind, batch = None, []
+            for entity_kind, data in _records(state):
+                if entity_kind != kind or len(batch) >= batch_size:
+                    if batch:
+                        record({'k': kind, 'd': batch})
+                    kind, batch = entity_kind, []
+                batch.append(data)
+            if batch:
+                record({'k': kind, 'd': batch})
+    os.rename(tmp, path)
+
+
+class Snapshot(object):
+    """
+    A snapshot file, memory mapped. C{meta} is the connection metadata.
+    """
+    def __init__(self, path, codec=None):
+        self.codec = get_codec(codec)
+        with open(path, 'rb') as fp:
+            try:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError('Empty snapshot {0}'.format(path))
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise SnapshotError('{0} is not a chord snapshot'.format(path))
+        self._offset = len(MAGIC)
+        self.meta = self._read()
+
+    def _read(self):
+        if self._offset + _length.size > len(self._map):
+            return None
+        size, = _length.unpack_from(self._map, self._offset)
+        start = self._offset + _length.size
+        if start + size > len(self._map):
+            raise SnapshotError('Truncated snapshot')
+        self._offset = start + size
+        return self.codec.loads(self._map[start:start + size])
+
+    def batches(self):
+        """
+        Yield the C{(kind, entities)} batches after the metadata.
+        """
+        while True:
+            record = self._read()
+            if record is None:
+                return
+            yield record['k'], record['d']
+
+    def restore_iter(self, state):
+        """
+        Load the entities into C{state}, yielding after every batch, for
+        C{task.cooperate}.
+        """
+        user_id = self.meta.get('user_id')
+        for kind, entities in self.batches():
+            restore = getattr(self, '_restore_' + kind, None)
+            if restore is not None:
+                for data in entities:
+                    restore(state, data)
+            if user_id is not None and state.user is None:
+                state.user = state.users.get(user_id)
+            yield None
+        self.close()
+
+    def restore(self, state):
+        for _ in self.restore_iter(state):
+            pass
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _restore_users(self, state, data):
+        state._user(data)
+
+    def _restore_guilds(self, state, data):
+        guild = state.guilds.get(data['id'])
+        if guild is None:
+            guild = state.guilds[data['id']] = Guild(data, state._ids)
+        for role in data.get('roles', ()):
+            role = Role(role, state._ids)
+            guild.roles[role.id] = role
+        for channel in data.get('channels', ()):
+            state._add_channel(channel, guild)
+
+    def _restore_channels(self, state, data):
+        state._add_channel(data)
+
+    def _restore_members(self, state, data):
+        guild = state.guilds.get(data['guild_id'])
+        user = state.users.get(data['user'])
+        if guild is None or user is None:
+            return
+        member = Member(data, user, guild.id, state._ids)
+        if state.members.set((guild.id, user.id), member):
+            guild.members[user.id] = member
+
+    def _restore_messages(self, state, data):
+        state.parse_message_create(data)
@@ -0,0 +1,135 @@
+"""
+Snowflakes, Discord's 64 bit ids.
+
+An id holds its creation time (milliseconds since L{DISCORD_EPOCH}) in its
+upper 42 bits, then the worker and process that generated it and a per
+process increment::
+
+    snowflake_time(175928847299117063)  # 1462015105.796
+    after = time_snowflake(time.time() - 3600)  # history of the last hour
+
+Ids arrive as strings. With C{int_ids} (see L{IntIdCodec}), they are turned
+into integers while frames are decoded: an int costs less than half the
+memory of its string and hashes faster, which adds up in the guild,
+channel, user and member maps of a large cache.
+"""
+import json
+
+DISCORD_EPOCH = 1420070400000
+
+# Payload keys holding an id, and lists of ids
+ID_KEYS = frozenset([
+    'id', 'guild_id', 'channel_id', 'user_id', 'message_id', 'role_id', 'owner_id', 'application_id',
+    'webhook_id', 'parent_id', 'last_message_id', 'afk_channel_id', 'embed_channel_id',
+    'widget_channel_id', 'system_channel_id'
+])
+ID_LIST_KEYS = frozenset(['roles', 'mention_roles'])
+
+
+def snowflake_time(snowflake):
+    """
+    Creation time of C{snowflake}, in seconds since the UNIX epoch.
+    """
+    return ((int(snowflake) >> 22) + DISCORD_EPOCH) / 1000.0
+
+
+def worker_id(snowflake):
+    return (int(snowflake) >> 17) & 0x1f
+
+
+def process_id(snowflake):
+    return (int(snowflake) >> 12) & 0x1f
+
+
+def increment(snowflake):
+    return int(snowflake) & 0xfff
+
+
+def time_snowflake(seconds, high=False):
+    """
+    The smallest id created at C{seconds} (UNIX time), or the largest with
+    C{high}. Use it as C{after}/C{before} bound to query by time: messages
+    after T are those after C{time_snowflake(T, high=True)}.
+    """
+    value = (int(seconds * 1000) - DISCORD_EPOCH) << 22
+    return value + (1 << 22) - 1 if high else value
+
+
+def snowflake_range(start=None, end=None):
+    """
+    C{(after, before)} id bounds selecting what was created between the
+    UNIX times C{start} and C{end}; either may be C{None}.
+    """
+    after = None if start is None else time_snowflake(start) - 1
+    before = None if end is None else time_snowflake(end, high=True) + 1
+    return after, before
+
+
+def in_range(snowflake, after=None, before=None):
+    snowflake = int(snowflake)
+    return (after is None or snowflake > int(after)) and (before is None or snowflake < int(before))
+
+
+def int_ids(obj):
+    """
+    Turn the ids of the dict C{obj} into integers, in place; usable as a
+    JSON C{object_hook}.
+    """
+    for key in ID_KEYS.intersection(obj):
+        value = obj[key]
+        if value.__class__ is str and value.isdigit():
+            obj[key] = int(value)
+    for key in ID_LIST_KEYS.intersection(obj):
+        values = obj[key]
+        if values and values.__class__ is list and values[0].__class__ is str and values[0].isdigit():
+            obj[key] = [int(value) for value in values]
+    return obj
+
+
+def convert_ids(obj):
+    """
+    Apply L{int_ids} to every dict in a decoded document.
+    """
+    if isinstance(obj, dict):
+        for value in obj.values():
+            if isinstance(value, (dict, list)):
+                convert_ids(value)
+        int_ids(obj)
+    elif isinstance(obj, list):
+        for value in obj:
+            if isinstance(value, (dict, list)):
+                convert_ids(value)
+    return obj
+
+
+class IntIdCodec(object):
+    """
+    Wrap a gateway codec to decode ids as integers. The stdlib JSON codec
+    converts them while parsing, others once the frame is decoded.
+    """
+    # For chord.incremental
+    object_hook = staticmethod(int_ids)
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.name = codec.name
+        self.encoding = codec.encoding
+        self.binary = getattr(codec, 'binary', False)
+        self.peek = codec.peek
+        self.dumps = codec.dumps
+        if codec.name == 'json':
+            self.loads = self._json_loads
+
+    def _json_loads(self, data):
+        return json.loads(data, object_hook=int_ids)
+
+    def loads(self, data):
+        return convert_ids(self.codec.loads(data))
+
+
+def to_int(snowflake):
+    return int(snowflake)
+
+
+def to_str(snowflake):
+    return str(snowflake)
@@ -0,0 +1,310 @@
+from chord.cache import ActiveGuildsCache, Cache, NoCache
+from chord.models import Channel, Guild, Member, Message, Role, User
+from chord.snowflake import to_int, to_str
+
+
+# Events only useful to the cache while a given entity type is stored
+_entity_events = {
+    'members': ('GUILD_MEMBER_ADD', 'GUILD_MEMBER_UPDATE', 'GUILD_MEMBERS_CHUNK'),
+    'messages': ('MESSAGE_CREATE', 'MESSAGE_UPDATE', 'MESSAGE_DELETE', 'MESSAGE_DELETE_BULK')
+}
+
+
+class ConnectionState(object):
+    """
+    Entity cache fed with the gateway dispatches.
+
+    Guilds, channels and users are indexed by id; roles, channels and members
+    are also reachable through their L{Guild}. Events for entities that are
+    not cached are ignored, the raw payload is still dispatched to handlers.
+
+    Members, users and messages are kept in the stores given in C{policies}
+    (see L{chord.cache}); by default members and users are kept forever and
+    messages are not cached.
+
+    With C{int_ids}, the payloads carry integer ids (see L{chord.snowflake})
+    and entities are keyed by them; lookups accept either form.
+    """
+    def __init__(self, policies=None, int_ids=False):
+        policies = policies or {}
+        self.int_ids = int_ids
+        self._id = to_int if int_ids else to_str
+        self.user = None
+        self.guilds = {}
+        self.channels = {}
+        self.users = policies.get('users', Cache())
+        self.members = policies.get('members', Cache())
+        self.messages = policies.get('messages', NoCache())
+        self.members.on_evict = self._member_evicted
+        # Guild and role ids shared by the entities referencing them, see
+        # chord.models.intern_id
+        self._ids = {}
+
+        self._handlers = {}
+        for name in dir(self):
+            if name.startswith('parse_'):
+                self._handlers[name[6:].upper()] = getattr(self, name)
+        events = set(self._handlers)
+        for entity, entity_events in _entity_events.items():
+            if not getattr(self, entity).enabled:
+                events.difference_update(entity_events)
+        self.events = frozenset(events)
+
+    def set_guild_active(self, guild_id, active):
+        """
+        Mark C{guild_id} as having handlers, or no longer, for the stores
+        keeping only active guilds (see L{ActiveGuildsCache}).
+        """
+        guild_id = self._id(guild_id)
+        for store in (self.users, self.members, self.messages):
+            if isinstance(store, ActiveGuildsCache):
+                if active:
+                    store.listen(guild_id)
+                else:
+                    store.unlisten(guild_id)
+
+    def apply(self, event, data):
+        handler = self._handlers.get(event)
+        if handler is not None and data is not None:
+            handler(data)
+
+    def apply_iter(self, event, data, slice_size=500):
+        """
+        Like L{apply}, as a generator for C{task.cooperate} yielding every
+        C{slice_size} members (and after every guild) of READY and
+        GUILD_CREATE payloads.
+        """
+        if data is None:
+            return
+        if event == 'READY':
+            if 'user' in data:
+                self.user = self._user(data['user'])
+            for guild in data.get('guilds', ()):
+                for step in self._iter_add_guild(guild, slice_size):
+                    yield step
+                yield None
+            for channel in data.get('private_channels', ()):
+                self._add_channel(channel)
+        elif event == 'GUILD_CREATE':
+            for step in self._iter_add_guild(data, slice_size):
+                yield step
+        else:
+            self.apply(event, data)
+
+    # Lookups
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(self._id(guild_id))
+
+    def get_channel(self, channel_id):
+        return self.channels.get(self._id(channel_id))
+
+    def get_user(self, user_id):
+        return self.users.get(self._id(user_id))
+
+    def get_member(self, guild_id, user_id):
+        return self.members.get((self._id(guild_id), self._id(user_id)))
+
+    def get_message(self, message_id):
+        return self.messages.get(self._id(message_id))
+
+    def stats(self):
+        return {
+            'guilds': len(self.guilds),
+            'channels': len(self.channels),
+            'users': self.users.stats(),
+            'members': self.members.stats(),
+            'messages': self.messages.stats()
+        }
+
+    # Helpers
+
+    def _user(self, data):
+        user = self.users.get(data['id'])
+        if user is None:
+            user = User(data)
+            self.users.set(user.id, user)
+        else:
+            user.update(data)
+        return user
+
+    def _add_guild(self, data):
+        for _ in self._iter_add_guild(data, None):
+            pass
+        return self.guilds[data['id']]
+
+    def _iter_add_guild(self, data, slice_size):
+        guild = self.guilds.get(data['id'])
+        if guild is None:
+            guild = Guild(data, self._ids)
+            self.guilds[guild.id] = guild
+        else:
+            guild.update(data, self._ids)
+        for role in data.get('roles', ()):
+            role = Role(role, self._ids)
+            guild.roles[role.id] = role
+        for channel in data.get('channels', ()):
+            self._add_channel(channel, guild)
+        for i, member in enumerate(data.get('members', ()), 1):
+            self._add_member(member, guild)
+            if slice_size and i % slice_size == 0:
+                yield None
+
+    def _add_channel(self, data, guild=None):
+        channel = self.channels.get(data['id'])
+        if channel is None:
+            channel = Channel(data, self._ids)
+            self.channels[channel.id] = channel
+        else:
+            channel.update(data, self._ids)
+        if guild is not None:
+            channel.guild_id = guild.id
+            guild.channels[channel.id] = channel
+        return channel
+
+    def _add_member(self, data, guild):
+        if not self.members.enabled:
+            return None
+        user = self._user(data['user'])
+        member = self.members.get((guild.id, user.id))
+        if member is None:
+            member = Member(data, user, guild.id, self._ids)
+            if self.members.set((guild.id, user.id), member):
+                guild.members[user.id] = member
+        else:
+            member.update(data, self._ids)
+        return member
+
+    def _member_evicted(self, key, member):
+        guild = self.guilds.get(key[0])
+        if guild is not None:
+            guild.members.pop(key[1], None)
+
+    def _remove_guild(self, guild):
+        for channel_id in guild.channels:
+            self.channels.pop(channel_id, None)
+        for user_id in guild.members:
+            self.members.pop((guild.id, user_id), None)
+        for role_id in guild.roles:
+            self._ids.pop(role_id, None)
+        self._ids.pop(guild.id, None)
+
+    # Events
+
+    def parse_ready(self, data):
+        if 'user' in data:
+            self.user = self._user(data['user'])
+        for guild in data.get('guilds', ()):
+            self._add_guild(guild)
+        for channel in data.get('private_channels', ()):
+            self._add_channel(channel)
+
+    def parse_guild_create(self, data):
+        self._add_guild(data)
+
+    def parse_guild_update(self, data):
+        guild = self.guilds.get(data.get('id'))
+        if guild is not None:
+            guild.update(data, self._ids)
+
+    def parse_guild_delete(self, data):
+        if data.get('unavailable'):
+            guild = self.guilds.get(data.get('id'))
+            if guild is not None:
+                guild.unavailable = True
+            return
+        guild = self.guilds.pop(data.get('id'), None)
+        if guild is not None:
+            self._remove_guild(guild)
+
+    def parse_channel_create(self, data):
+        self._add_channel(data, self.guilds.get(data.get('guild_id')))
+
+    def parse_channel_update(self, data):
+        channel = self.channels.get(data.get('id'))
+        if channel is not None:
+            channel.update(data, self._ids)
+
+    def parse_channel_delete(self, data):
+        channel = self.channels.pop(data.get('id'), None)
+        if channel is None:
+            return
+        guild = self.guilds.get(channel.guild_id)
+        if guild is not None:
+            guild.channels.pop(channel.id, None)
+
+    def parse_guild_member_add(self, data):
+        guild = self.guilds.get(data.get('guild_id'))
+        if guild is not None:
+            self._add_member(data, guild)
+            if guild.member_count is not None:
+                guild.member_count += 1
+
+    def parse_guild_member_update(self, data):
+        guild = self.guilds.get(data.get('guild_id'))
+        if guild is not None:
+            self._add_member(data, guild)
+
+    def parse_guild_member_remove(self, data):
+        guild = self.guilds.get(data.get('guild_id'))
+        if guild is None:
+            return
+        guild.members.pop(data['user']['id'], None)
+        self.members.pop((guild.id, data['user']['id']), None)
+        if guild.member_count:
+            guild.member_count -= 1
+
+    def parse_guild_members_chunk(self, data):
+        guild = self.guilds.get(data.get('guild_id'))
+        if guild is not None:
+            for member in data.get('members', ()):
+                self._add_member(member, guild)
+
+    def parse_guild_role_create(self, data):
+        guild = self.guilds.get(data.get('guild_id'))
+        if guild is not None:
+            role = Role(data['role'], self._ids)
+            guild.roles[role.id] = role
+
+    def parse_guild_role_update(self, data):
+        guild = self.guilds.get(data.get('guild_id'))
+        if guild is None:
+            return
+        role = data['role']
+        cached = guild.roles.get(role['id'])
+        if cached is None:
+            cached = Role(role, self._ids)
+            guild.roles[cached.id] = cached
+        else:
+            cached.update(role, self._ids)
+
+    def parse_guild_role_delete(self, data):
+        guild = self.guilds.get(data.get('guild_id'))
+        if guild is not None:
+            guild.roles.pop(data.get('role_id'), None)
+            self._ids.pop(data.get('role_id'), None)
+
+    def parse_user_update(self, data):
+        self.user = self._user(data)
+
+    def parse_message_create(self, data):
+        message = Message(data, self._ids)
+        if message.guild_id is None:
+            channel = self.channels.get(message.channel_id)
+            if channel is not None:
+                message.guild_id = channel.guild_id
+        if 'author' in data:
+            message.author = self.users.get(data['author']['id']) or User(data['author'])
+        self.messages.set(message.id, message)
+
+    def parse_message_update(self, data):
+        message = self.messages.get(data.get('id'))
+        if message is not None:
+            message.update(data, self._ids)
+
+    def parse_message_delete(self, data):
+        self.messages.pop(data.get('id'), None)
+
+    def parse_message_delete_bulk(self, data):
+        for message_id in data.get('ids', ()):
+            self.messages.pop(message_id, None)
@@ -0,0 +1,418 @@
+"""
+A local stand-in for the Discord gateway and REST API.
+
+L{FakeDiscord} serves a gateway websocket and the REST endpoints chord
+needs to connect on localhost, and replays a session (a list of gateway
+frames, recorded or synthetic) to every client that identifies::
+
+    discord = FakeDiscord([ready, guild_create, message_create])
+    discord.start()
+    http = HTTPClient(api_base=discord.api_base)
+    client = Client(token=discord.token, http=http)
+    client.fetch_gateway().addCallback(client.connect)
+
+The gateway answers heartbeats, honours the C{compress} flag of IDENTIFY
+and the C{zlib-stream} and C{encoding=etf} query parameters, and records
+every frame and request it receives. Like Discord, it invalidates the
+session when a client closes with code 1000, answering the next RESUME
+with INVALIDATE_SESSION.
+
+With C{voice=True}, VOICE_STATE requests are answered with a
+L{FakeVoiceServer}, whose L{UDPSink} records the audio packets it receives
+and measures their timing.
+"""
+import json
+import os
+import zlib
+
+from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
+from twisted.internet import defer, task
+from twisted.internet.protocol import DatagramProtocol
+from twisted.web import resource, server
+
+from chord import voice
+from chord.codec import get_codec
+from chord.metrics import now
+
+
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+VOICE_STATE = 4
+RESUME = 6
+RECONNECT = 7
+REQUEST_MEMBERS = 8
+INVALIDATE_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+
+class FakeGatewayProtocol(WebSocketServerProtocol):
+    stream = False
+    compress = False
+    codec = None
+    sequence = 0
+    _compressor = None
+
+    def onConnect(self, request):
+        self.stream = 'zlib-stream' in request.params.get('compress', [])
+        if 'etf' in request.params.get('encoding', []):
+            self.codec = get_codec('etf')
+        else:
+            self.codec = self.factory.codec
+
+    def onOpen(self):
+        self.factory.connections.append(self)
+        if self.stream:
+            self._compressor = zlib.compressobj()
+        self.send_frame({'op': HELLO, 'd': {'heartbeat_interval': self.factory.heartbeat_interval}})
+
+    def onMessage(self, payload, isBinary):
+        msg = self.codec.loads(payload)
+        self.factory.received.append(msg)
+        op = msg.get('op')
+        if op == HEARTBEAT:
+            if self.factory.ack_heartbeats:
+                self.send_frame({'op': HEARTBEAT_ACK})
+        elif op == IDENTIFY:
+            self.compress = bool(msg['d'].get('compress'))
+            self.factory.identifies += 1
+            self.factory.resumable = True
+            self.replay()
+        elif op == RESUME:
+            if self.factory.resumable:
+                self.send_frame({'op': DISPATCH, 't': 'RESUMED', 's': msg['d'].get('seq'), 'd': {}})
+            else:
+                self.send_frame({'op': INVALIDATE_SESSION, 'd': False})
+        elif op == VOICE_STATE and self.factory.voice is not None:
+            self.voice_state(msg['d'])
+        elif op == REQUEST_MEMBERS:
+            for guild_id in msg['d']['guild_id']:
+                self.send_dispatch('GUILD_MEMBERS_CHUNK', {
+                    'guild_id': guild_id, 'members': self.factory.members(guild_id),
+                    'chunk_index': 0, 'chunk_count': 1
+                })
+
+    def onClose(self, wasClean, code, reason):
+        if self in self.factory.connections:
+            self.factory.connections.remove(self)
+        if code == 1000 and not self.closedByMe:
+            self.factory.resumable = False
+
+    def request_reconnect(self):
+        """
+        Ask the client to reconnect and resume (op 7).
+        """
+        self.send_frame({'op': RECONNECT, 'd': None})
+
+    def send_frame(self, frame):
+        self.send_encoded(self.codec.dumps(frame))
+
+    def send_encoded(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.sendMessage(data, isBinary=True)
+        elif self.compress:
+            self.sendMessage(zlib.compress(data), isBinary=True)
+        else:
+            self.sendMessage(data, isBinary=self.codec.binary)
+
+    def replay(self):
+        """
+        Send the session, a slice of frames per reactor iteration.
+        """
+        def frames():
+            for i, data in enumerate(self.factory.encoded(self.codec)):
+                if self.state != self.STATE_OPEN:
+                    return
+                self.send_encoded(data)
+                if i % self.factory.slice_size == 0:
+                    yield None
+        d = self.factory.cooperator.cooperate(frames()).whenDone()
+        d.addCallback(self._replayed)
+        return d
+
+    def voice_state(self, data):
+        guild_id = data['guild_id']
+        self.send_dispatch('VOICE_STATE_UPDATE', {
+            'guild_id': guild_id, 'channel_id': data.get('channel_id'), 'user_id': '1',
+            'session_id': 'voice-session', 'self_mute': data.get('self_mute'), 'self_deaf': data.get('self_deaf')
+        })
+        if data.get('channel_id') is not None:
+            self.send_dispatch('VOICE_SERVER_UPDATE', {
+                'guild_id': guild_id, 'token': self.factory.voice.token, 'endpoint': self.factory.voice.endpoint
+            })
+
+    def send_dispatch(self, event, data):
+        self.sequence = max(self.sequence, len(self.factory.session)) + 1
+        self.send_frame({'op': DISPATCH, 't': event, 's': self.sequence, 'd': data})
+
+    def _replayed(self, ignored):
+        if not self.factory.replayed.called:
+            self.factory.replayed.callback(self)
+
+
+class FakeGatewayFactory(WebSocketServerFactory):
+    protocol = FakeGatewayProtocol
+
+    heartbeat_interval = 41250
+    # Frames sent per reactor iteration while replaying
+    slice_size = 100
+    ack_heartbeats = True
+    # FakeVoiceServer handing out voice connections
+    voice = None
+
+    def __init__(self, session, url=None, codec=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        WebSocketServerFactory.__init__(self, url, reactor=reactor)
+        self.session = list(session)
+        self.codec = get_codec(codec)
+        self.cooperator = task.Cooperator(scheduler=lambda work: reactor.callLater(0, work))
+        self.connections = []
+        self.received = []
+        self.identifies = 0
+        # False once a client closed the session with code 1000
+        self.resumable = True
+        # Fires with the first protocol done replaying the session
+        self.replayed = defer.Deferred()
+        # codec name -> encoded session
+        self._encoded = {}
+
+    def members(self, guild_id):
+        """
+        The members of C{guild_id} in the session's GUILD_CREATE.
+        """
+        for frame in self.session:
+            if not isinstance(frame, dict):
+                frame = self.codec.loads(frame)
+            data = frame.get('d')
+            if frame.get('t') == 'GUILD_CREATE' and str(data.get('id')) == str(guild_id):
+                return data.get('members', [])
+        return []
+
+    def encoded(self, codec=None):
+        """
+        The session frames, numbered and encoded once per codec.
+        """
+        codec = self.codec if codec is None else codec
+        encoded = self._encoded.get(codec.name)
+        if encoded is None:
+            encoded = self._encoded[codec.name] = []
+            for seq, frame in enumerate(self.session, 1):
+                if not isinstance(frame, dict):
+                    frame = self.codec.loads(frame)
+                frame = dict(frame, s=seq) if frame.get('op', DISPATCH) == DISPATCH else frame
+                encoded.append(codec.dumps(frame))
+        return encoded
+
+
+class FakeAPI(resource.Resource):
+    """
+    The REST endpoints used to log in and connect. Other requests are
+    answered from C{routes}, keyed by method and path, with the value (or
+    the result of calling it with the request), or an empty JSON object.
+    """
+    isLeaf = True
+
+    def __init__(self, token, gateway_url, shards=1, codec=None):
+        resource.Resource.__init__(self)
+        self.token = token
+        self.gateway_url = gateway_url
+        self.shards = shards
+        self.codec = get_codec(codec)
+        self.requests = []
+        self.routes = {}
+
+    def render(self, request):
+        path = request.path.decode('ascii')
+        body = request.content.read() if request.content is not None else b''
+        method = request.method.decode('ascii')
+        self.requests.append((method, path, body))
+        request.setHeader(b'Content-Type', b'application/json')
+
+        if path == '/api/auth/login':
+            return self.codec.dumps({'token': self.token})
+        if path == '/api/auth/logout':
+            request.setResponseCode(204)
+            return b''
+
+        authorization = request.getHeader(b'authorization')
+        if authorization is None or authorization.decode('ascii') != self.token:
+            request.setResponseCode(401)
+            return self.codec.dumps({'code': 0, 'message': '401: Unauthorized'})
+        if path == '/api/gateway':
+            return self.codec.dumps({'url': self.gateway_url})
+        if path == '/api/gateway/bot':
+            return self.codec.dumps({'url': self.gateway_url, 'shards': self.shards})
+        if path == '/api/users/@me':
+            return self.codec.dumps({'id': '1', 'username': 'chord', 'discriminator': '0001', 'bot': True})
+        response = self.routes.get((method, path), {})
+        if callable(response):
+            response = response(request)
+        if response is None:
+            request.setResponseCode(204)
+            return b''
+        return self.codec.dumps(response)
+
+
+class FakeDiscord(object):
+    """
+    A gateway and REST API listening on C{interface}, on ports chosen by
+    the system.
+    """
+    def __init__(self, session, token='fake-token', codec=None, shards=1, interface='127.0.0.1', voice=False,
+                 reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.token = token
+        self.interface = interface
+        self.gateway = FakeGatewayFactory(session, codec=codec, reactor=reactor)
+        self.api = FakeAPI(token, None, shards=shards, codec=codec)
+        self.voice = FakeVoiceServer(interface=interface, reactor=reactor) if voice else None
+        self.gateway.voice = self.voice
+        self.ports = []
+
+    def start(self):
+        gateway = self.reactor.listenTCP(0, self.gateway, interface=self.interface)
+        api = self.reactor.listenTCP(0, server.Site(self.api), interface=self.interface)
+        self.ports = [gateway, api]
+        self.gateway_url = 'ws://{0}:{1}'.format(self.interface, gateway.getHost().port)
+        self.api_base = 'http://{0}:{1}/api'.format(self.interface, api.getHost().port)
+        self.api.gateway_url = self.gateway_url
+        if self.voice is not None:
+            self.voice.start()
+        return self
+
+    def stop(self):
+        for connection in list(self.gateway.connections):
+            connection.dropConnection(abort=True)
+        ds = [defer.maybeDeferred(port.stopListening) for port in self.ports]
+        if self.voice is not None:
+            ds.append(self.voice.stop())
+        return defer.gatherResults(ds)
+
+
+class UDPSink(DatagramProtocol):
+    """
+    The UDP side of L{FakeVoiceServer}: answers IP discovery and records
+    every other packet with its arrival time.
+    """
+    def __init__(self):
+        self.packets = []
+        self.encryptor = None
+
+    def datagramReceived(self, data, addr):
+        discovery = voice.parse_discovery(data)
+        if discovery is not None and discovery[0] == 1:
+            self.transport.write(voice.discovery_response(discovery[1], addr[0], addr[1]), addr)
+            return
+        self.packets.append((now(), data))
+
+    def set_key(self, mode, key):
+        self.encryptor = voice.get_encryptor(mode)(key)
+
+    def frames(self):
+        """
+        The C{(sequence, timestamp, ssrc, frame)} received, decrypted.
+        """
+        return [voice.parse_rtp_header(packet) + (self.encryptor.decrypt(packet),) for _, packet in self.packets]
+
+    def jitter(self):
+        """
+        Timing of the packets received: intervals between arrivals and
+        their deviation from the frame duration, in seconds, and the
+        RFC 3550 interarrival jitter.
+        """
+        deviations = []
+        intervals = []
+        jitter = 0.0
+        previous = None
+        for arrival, packet in self.packets:
+            _, timestamp, _ = voice.parse_rtp_header(packet)
+            if previous is not None:
+                interval = arrival - previous[0]
+                intervals.append(interval)
+                deviations.append(abs(interval - voice.FRAME_DURATION))
+                transit = interval - float(timestamp - previous[1]) / voice.SAMPLE_RATE
+                jitter += (abs(transit) - jitter) / 16
+            previous = arrival, timestamp
+        if not intervals:
+            return {'packets': len(self.packets)}
+        deviations.sort()
+        return {
+            'packets': len(self.packets),
+            'mean_interval': sum(intervals) / len(intervals),
+            'mean_deviation': sum(deviations) / len(deviations),
+            'p99_deviation': deviations[min(len(deviations) - 1, int(len(deviations) * 0.99))],
+            'max_deviation': deviations[-1],
+            'rfc3550': jitter
+        }
+
+
+class FakeVoiceProtocol(WebSocketServerProtocol):
+    def onOpen(self):
+        self.factory.connections.append(self)
+        self.send_op(voice.HELLO, {'heartbeat_interval': self.factory.heartbeat_interval})
+
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode('utf8'))
+        self.factory.received.append(msg)
+        op, data = msg['op'], msg['d']
+        server = self.factory.server
+        if op == voice.IDENTIFY:
+            self.send_op(voice.READY, {
+                'ssrc': server.ssrc, 'ip': server.interface, 'port': server.udp_port.getHost().port,
+                'modes': server.modes, 'heartbeat_interval': self.factory.heartbeat_interval
+            })
+        elif op == voice.SELECT_PROTOCOL:
+            mode = data['data']['mode']
+            key = os.urandom(32)
+            server.sink.set_key(mode, key)
+            self.send_op(voice.SESSION_DESCRIPTION, {'mode': mode, 'secret_key': list(bytearray(key))})
+        elif op == voice.HEARTBEAT:
+            self.send_op(voice.HEARTBEAT_ACK, data)
+
+    def onClose(self, wasClean, code, reason):
+        if self in self.factory.connections:
+            self.factory.connections.remove(self)
+
+    def send_op(self, op, data):
+        self.sendMessage(json.dumps({'op': op, 'd': data}).encode('utf8'))
+
+
+class FakeVoiceServer(object):
+    """
+    A voice gateway and UDP sink listening on C{interface}.
+    """
+    heartbeat_interval = 13750
+    ssrc = 1234
+
+    def __init__(self, token='voice-token', interface='127.0.0.1', modes=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.token = token
+        self.interface = interface
+        self.modes = voice.supported_modes() if modes is None else modes
+        self.sink = UDPSink()
+        self.gateway = WebSocketServerFactory(reactor=reactor)
+        self.gateway.protocol = FakeVoiceProtocol
+        self.gateway.server = self
+        self.gateway.heartbeat_interval = self.heartbeat_interval
+        self.gateway.connections = []
+        self.gateway.received = []
+        self.ports = []
+
+    def start(self):
+        gateway = self.reactor.listenTCP(0, self.gateway, interface=self.interface)
+        self.udp_port = self.reactor.listenUDP(0, self.sink, interface=self.interface)
+        self.ports = [gateway, self.udp_port]
+        self.endpoint = 'ws://{0}:{1}'.format(self.interface, gateway.getHost().port)
+        return self
+
+    def stop(self):
+        for connection in list(self.gateway.connections):
+            connection.dropConnection(abort=True)
+        return defer.gatherResults([defer.maybeDeferred(port.stopListening) for port in self.ports])
@@ -1,14 +1,19 @@
 
+import re
 import sys
+import time
+from collections import deque
 
-from twisted.web.client import Agent, readBody, ResponseDone
+from twisted.web.client import Agent, HTTPConnectionPool, readBody, ResponseDone
 from twisted.internet import defer, protocol
+from twisted.python.failure import Failure
 from twisted.web.http_headers import Headers
-from twisted.logger import globalLogBeginner, textFileLogObserver, FilteringLogObserver, LogLevelFilterPredicate, LogLevel
+from twisted.logger import Logger, globalLogBeginner, textFileLogObserver, FilteringLogObserver, LogLevelFilterPredicate, LogLevel
 
-from errors import GatewayError, HTTPError, LoginError
+from chord.codec import get_codec
+from chord.errors import GatewayError, HTTPError, LoginError, RateLimitError
+from chord.metrics import now
 
-import json
 
 from chord import __user_agent__
 
@@ -31,17 +36,362 @@ class StringProducer(object):
 
 class SimpleReceiver(protocol.Protocol):
     def __init__(self, d):
-        self.buf = ''
+        self.chunks = []
         self.d = d
     def dataReceived(self, data):
-        self.buf += data
+        self.chunks.append(data)
     def connectionLost(self, reason):
         if reason.check(ResponseDone):
-            self.d.callback(self.buf)
+            self.d.callback(b''.join(self.chunks))
         else:
             self.d.errback(reason)
 
 
+class CountingConnectionPool(HTTPConnectionPool):
+    """
+    L{HTTPConnectionPool} which keeps track of how many requests were served
+    from a cached (kept-alive) connection and how many had to open a new one.
+    """
+    requests = 0
+    misses = 0
+
+    @property
+    def hits(self):
+        return self.requests - self.misses
+
+    def getConnection(self, key, endpoint):
+        self.requests += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self.misses += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'idle': sum(len(c) for c in self._connections.values())
+        }
+
+
+API_BASE = 'https://discordapp.com/api'
+
+
+class HTTPClient(object):
+    """
+    Keep-alive HTTP client shared by the REST helpers, so consecutive calls
+    reuse the TCP/TLS connection to the API instead of handshaking again.
+
+    C{api_base} is the root of the REST API the helpers talk to.
+    """
+    api_base = API_BASE
+    maxPersistentPerHost = 4
+    cachedConnectionTimeout = 120
+
+    maxRateLimitRetries = 5
+
+    def __init__(self, reactor=None, maxPersistentPerHost=None, cachedConnectionTimeout=None, ratelimiter=None, codec=None,
+                 metrics=None, api_base=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+        self.pool = CountingConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = self.maxPersistentPerHost if maxPersistentPerHost is None else maxPersistentPerHost
+        self.pool.cachedConnectionTimeout = self.cachedConnectionTimeout if cachedConnectionTimeout is None else cachedConnectionTimeout
+        self.agent = Agent(reactor, pool=self.pool)
+        self.ratelimiter = RateLimiter(reactor) if ratelimiter is None else ratelimiter
+        self.codec = get_codec(codec)
+        # See chord.metrics
+        self.metrics = metrics
+        if api_base is not None:
+            self.api_base = api_base.rstrip('/')
+
+    def request(self, method, uri, headers=None, bodyProducer=None, route=None):
+        """
+        Issue a request once its rate limit bucket has capacity. Requests
+        rejected with a 429 are queued again and retried up to
+        C{maxRateLimitRetries} times before the 429 response is returned.
+        """
+        if headers is not None and not isinstance(headers, Headers):
+            headers = Headers(headers)
+        if route is None:
+            route = route_key(method, uri)
+        return self._request(route, _bytes(method), _bytes(uri), headers, bodyProducer, 0)
+
+    def _request(self, route, method, uri, headers, bodyProducer, attempt):
+        def cbAcquired(ignored):
+            d = self.agent.request(method=method, uri=uri, headers=headers, bodyProducer=bodyProducer)
+            if self.metrics is not None:
+                d.addBoth(self._observe, route, now())
+            d.addCallbacks(cbResponse, ebRequest)
+            return d
+
+        def cbResponse(response):
+            self.ratelimiter.update(route, response.code, response.headers)
+            if response.code != 429 or attempt >= self.maxRateLimitRetries:
+                return response
+            d = readBody(response)
+            d.addBoth(lambda ignored: self._request(route, method, uri, headers, bodyProducer, attempt + 1))
+            return d
+
+        def ebRequest(failure):
+            self.ratelimiter.update(route, None, None)
+            return failure
+
+        d = self.ratelimiter.acquire(route)
+        d.addCallback(cbAcquired)
+        return d
+
+    def _observe(self, result, route, started):
+        status = 'error' if isinstance(result, Failure) else result.code
+        self.metrics.observe_rest(route, status, now() - started)
+        return result
+
+    def stats(self):
+        stats = self.pool.stats()
+        stats.update(self.ratelimiter.stats())
+        return stats
+
+    def close(self):
+        return self.pool.closeCachedConnections()
+
+
+_major_parameters = ('channels', 'guilds', 'webhooks')
+_api_prefix = re.compile(r'^/api(?:/v\d+)?')
+_snowflake = re.compile(r'^\d+$')
+
+
+def route_key(method, uri):
+    """
+    Return the rate limit bucket for a request: the method and the API path
+    with every id except the major parameter (channel, guild or webhook id)
+    replaced by a placeholder.
+    """
+    if isinstance(method, bytes):
+        method = method.decode('ascii')
+    if isinstance(uri, bytes):
+        uri = uri.decode('ascii')
+    path = uri.split('://', 1)[-1]
+    path = '/' + path.split('/', 1)[1] if '/' in path else '/'
+    path = _api_prefix.sub('', path.split('?', 1)[0])
+
+    parts = path.split('/')
+    for i, part in enumerate(parts):
+        if _snowflake.match(part) and not (i > 0 and parts[i - 1] in _major_parameters):
+            parts[i] = '{id}'
+    return '{0} {1}'.format(method.upper(), '/'.join(parts))
+
+
+class RateLimitBucket(object):
+    def __init__(self, key):
+        self.key = key
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.known = False
+        self.inflight = 0
+        self.waiting = deque()
+        self.call = None
+
+
+class RateLimiter(object):
+    """
+    Paces REST requests according to the X-RateLimit-* and Retry-After
+    headers returned by the API.
+
+    Every route (see L{route_key}) gets a bucket. Requests wait in the
+    bucket's queue and are released as soon as the bucket, and the global
+    limit, have capacity again. Until the first response for a route arrives
+    only one request is let through so its limits can be learned.
+    """
+    log = Logger()
+
+    # Used to convert the absolute X-RateLimit-Reset into reactor time.
+    wallclock = staticmethod(time.time)
+    # Buckets idle past their reset are dropped, checked at most this often
+    # (in seconds) when a request is queued.
+    prune_interval = 60.0
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.buckets = {}
+        self.global_reset = None
+        self._global_call = None
+        self._pruned = reactor.seconds()
+
+    def bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = RateLimitBucket(key)
+        return bucket
+
+    def acquire(self, key):
+        """
+        Return a Deferred which fires once a request may be sent on C{key}.
+        Every acquire must be followed by an L{update} for the same key.
+        """
+        self._prune()
+        bucket = self.bucket(key)
+        d = defer.Deferred()
+        bucket.waiting.append(d)
+        self._drain(bucket)
+        return d
+
+    def update(self, key, code, headers):
+        """
+        Record the response (or failure, when C{code} is C{None}) of a request
+        previously released by L{acquire}.
+        """
+        bucket = self.bucket(key)
+        bucket.inflight = max(0, bucket.inflight - 1)
+        if code is not None:
+            now = self.reactor.seconds()
+            limit = _header(headers, b'X-RateLimit-Limit', int)
+            remaining = _header(headers, b'X-RateLimit-Remaining', int)
+            reset_after = _header(headers, b'X-RateLimit-Reset-After', float)
+            if reset_after is None:
+                reset = _header(headers, b'X-RateLimit-Reset', float)
+                if reset is not None:
+                    reset_after = max(0.0, reset - self.wallclock())
+
+            bucket.known = True
+            if limit is not None:
+                bucket.limit = limit
+            if remaining is not None:
+                bucket.remaining = remaining
+            if reset_after is not None:
+                bucket.reset = now + reset_after
+
+            if code == 429:
+                retry_after = _header(headers, b'Retry-After', float)
+                if retry_after is None:
+                    retry_after = 1.0
+                if _header(headers, b'X-RateLimit-Global', str) is not None:
+                    self.log.warn('Globally rate limited for {delay}s', delay=retry_after)
+                    self.global_reset = now + retry_after
+                else:
+                    self.log.debug('Rate limited on {key} for {delay}s', key=key, delay=retry_after)
+                    bucket.remaining = 0
+                    bucket.reset = now + retry_after
+        self._drain(bucket)
+
+    def _drain(self, bucket):
+        now = self.reactor.seconds()
+        if self.global_reset is not None:
+            if now < self.global_reset:
+                self._schedule_global()
+                return
+            self.global_reset = None
+
+        if bucket.reset is not None and now >= bucket.reset:
+            bucket.reset = None
+            bucket.remaining = bucket.limit
+
+        while bucket.waiting:
+            if not bucket.known:
+                if bucket.inflight:
+                    return
+            elif bucket.remaining is not None:
+                if bucket.remaining <= 0:
+                    if bucket.reset is not None:
+                        self._schedule(bucket, bucket.reset - now)
+                        return
+                    if bucket.inflight:
+                        return
+                else:
+                    bucket.remaining -= 1
+            bucket.inflight += 1
+            bucket.waiting.popleft().callback(None)
+
+    def _prune(self):
+        """
+        Forget the buckets with nothing queued or in flight whose reset has
+        passed; one is created again, and its limits learned, on the next
+        request to its route.
+        """
+        now = self.reactor.seconds()
+        if now - self._pruned < self.prune_interval:
+            return
+        self._pruned = now
+        for key, bucket in list(self.buckets.items()):
+            if bucket.waiting or bucket.inflight or (bucket.call is not None and bucket.call.active()):
+                continue
+            if bucket.reset is None or bucket.reset <= now:
+                del self.buckets[key]
+
+    def _schedule(self, bucket, delay):
+        if bucket.call is not None and bucket.call.active():
+            return
+        def wake():
+            bucket.call = None
+            self._drain(bucket)
+        bucket.call = self.reactor.callLater(max(0, delay), wake)
+
+    def _schedule_global(self):
+        if self._global_call is not None and self._global_call.active():
+            return
+        def wake():
+            self._global_call = None
+            for bucket in list(self.buckets.values()):
+                self._drain(bucket)
+        self._global_call = self.reactor.callLater(max(0, self.global_reset - self.reactor.seconds()), wake)
+
+    def stats(self):
+        return {
+            'buckets': len(self.buckets),
+            'queued': sum(len(b.waiting) for b in self.buckets.values())
+        }
+
+
+def _header(headers, name, convert):
+    values = headers.getRawHeaders(name) if headers is not None else None
+    if not values:
+        return None
+    value = values[0]
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+    try:
+        return convert(value)
+    except ValueError:
+        return None
+
+
+_http_clients = {}
+
+
+def get_http_client(reactor=None):
+    """
+    Return the L{HTTPClient} shared by every helper running on C{reactor}.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    client = _http_clients.get(reactor)
+    if client is None:
+        client = _http_clients[reactor] = HTTPClient(reactor)
+    return client
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('ascii')
+
+
+def gateway_url(url, **params):
+    """
+    Add query parameters (such as C{encoding} or C{compress}) to a gateway
+    URL, replacing any it already carries.
+    """
+    base, _, query = url.partition('?')
+    args = [arg for arg in query.split('&') if arg and arg.split('=', 1)[0] not in params]
+    args.extend('{0}={1}'.format(k, v) for k, v in sorted(params.items()))
+    return '{0}?{1}'.format(base, '&'.join(args))
+
+
 def start_logging(level=LogLevel.info):
     observers = []
 
@@ -51,9 +401,9 @@ def start_logging(level=LogLevel.info):
     globalLogBeginner.beginLoggingTo(observers)
 
 
-def get_token(email, password, reactor=None):
-    if reactor is None:
-        from twisted.internet import reactor
+def get_token(email, password, reactor=None, http=None):
+    if http is None:
+        http = get_http_client(reactor)
     headers = {
         'content-type': ['application/json'],
         'User-Agent': [__user_agent__]
@@ -62,11 +412,11 @@ def get_token(email, password, reactor=None):
         'email': email,
         'password': password
     }
-    payload = json.dumps(payload)
+    payload = http.codec.dumps(payload)
 
-    d = Agent(reactor).request(
+    d = http.request(
         method='POST',
-        uri='https://discordapp.com/api/auth/login',
+        uri=http.api_base + '/auth/login',
         headers=Headers(headers),
         bodyProducer=StringProducer(payload))
 
@@ -75,7 +425,7 @@ def get_token(email, password, reactor=None):
             raise LoginError('Unauthorized login, maybe incorrect username/password combination? ({response.code})'.format(response=response))
         elif response.code != 200:
             raise HTTPError('Unexpected response from server ({response.code})'.format(response=response))
-        res = json.loads(body)
+        res = http.codec.loads(body)
         if 'token' not in res:
             raise LoginError('Login response did not contain the token, did the API change?')
         return res['token']
@@ -90,9 +440,9 @@ def get_token(email, password, reactor=None):
     return d
 
 
-def invalidate_token(token, reactor=None):
-    if reactor is None:
-        from twisted.internet import reactor
+def invalidate_token(token, reactor=None, http=None):
+    if http is None:
+        http = get_http_client(reactor)
     headers = {
         'authorization': [token],
         'content-type': ['application/json'],
@@ -101,11 +451,11 @@ def invalidate_token(token, reactor=None):
     payload = {
         'token': token
     }
-    payload = json.dumps(payload)
+    payload = http.codec.dumps(payload)
 
-    d = Agent(reactor).request(
+    d = http.request(
         method='POST',
-        uri='https://discordapp.com/api/auth/logout',
+        uri=http.api_base + '/auth/logout',
         headers=Headers(headers),
         bodyProducer=StringProducer(payload))
 
@@ -123,18 +473,18 @@ def invalidate_token(token, reactor=None):
     return d
 
 
-def get_gateway(token, reactor=None):
-    if reactor is None:
-        from twisted.internet import reactor
+def get_gateway(token, reactor=None, http=None):
+    if http is None:
+        http = get_http_client(reactor)
     headers = {
         'authorization': [token],
         'content-type': ['application/json'],
         'User-Agent': [__user_agent__]
     }
 
-    d = Agent(reactor).request(
+    d = http.request(
         method='GET',
-        uri='https://discordapp.com/api/gateway?encoding=json&v=4',
+        uri=http.api_base + '/gateway?encoding=json&v=4',
         headers=Headers(headers),
         bodyProducer=None)
 
@@ -146,48 +496,88 @@ def get_gateway(token, reactor=None):
         return d
 
     def cbExtractUrl(body):
-        return json.loads(body)['url']
+        return http.codec.loads(body)['url']
 
     d.addCallback(cbResponse)
     return d
 
 
-def check_token(token, reactor=None):
-    if reactor is None:
-        from twisted.internet import reactor
+def get_gateway_bot(token, reactor=None, http=None):
+    """
+    Return C{(url, shards)}, the gateway URL and the number of shards Discord
+    recommends for the bot.
+    """
+    if http is None:
+        http = get_http_client(reactor)
     headers = {
         'authorization': [token],
         'content-type': ['application/json'],
         'User-Agent': [__user_agent__]
     }
 
-    d = Agent(reactor).request(
+    d = http.request(
         method='GET',
-        uri='https://discordapp.com/api/users/@me',
+        uri=http.api_base + '/gateway/bot',
         headers=Headers(headers),
         bodyProducer=None)
 
     def cbResponse(response):
+        if response.code != 200:
+            raise GatewayError('Did not receive expected response from gateway/bot endpoint. ({response.code})'.format(response=response))
+        d = readBody(response)
+        d.addCallback(cbExtractGateway)
+        return d
+
+    def cbExtractGateway(body):
+        res = http.codec.loads(body)
+        return res['url'], res.get('shards', 1)
+
+    d.addCallback(cbResponse)
+    return d
+
+
+def check_token(token, reactor=None, http=None):
+    if http is None:
+        http = get_http_client(reactor)
+    headers = {
+        'authorization': [token],
+        'content-type': ['application/json'],
+        'User-Agent': [__user_agent__]
+    }
+
+    d = http.request(
+        method='GET',
+        uri=http.api_base + '/users/@me',
+        headers=Headers(headers),
+        bodyProducer=None)
+
+    def cbResponse(body, response):
         if response.code != 200:
             raise LoginError('Did not receive expected response from @me endpoint. ({response.code})'.format(response=response))
         return token
 
-    d.addCallback(cbResponse)
+    def cbReadBody(response):
+        # Consume the body so the connection goes back to the pool
+        d = readBody(response)
+        d.addCallback(cbResponse, response)
+        return d
+
+    d.addCallback(cbReadBody)
     return d
 
 
-def get_user_for_token(token, reactor=None):
-    if reactor is None:
-        from twisted.internet import reactor
+def get_user_for_token(token, reactor=None, http=None):
+    if http is None:
+        http = get_http_client(reactor)
     headers = {
         'authorization': [token],
         'content-type': ['application/json'],
         'User-Agent': [__user_agent__]
     }
 
-    d = Agent(reactor).request(
+    d = http.request(
         method='GET',
-        uri='https://discordapp.com/api/users/@me',
+        uri=http.api_base + '/users/@me',
         headers=Headers(headers),
         bodyProducer=None)
 
@@ -199,30 +589,30 @@ def get_user_for_token(token, reactor=None):
         return d
 
     def cbParseJson(body):
-        return json.loads(body)
+        return http.codec.loads(body)
 
     d.addCallback(cbResponse)
     return d
 
 
-def http_post(endpoint, token, data, reactor=None):
-    if reactor is None:
-        from twisted.internet import reactor
+def http_post(endpoint, token, data, reactor=None, http=None):
+    if http is None:
+        http = get_http_client(reactor)
     headers = {
         'authorization': [token],
         'content-type': ['application/json'],
         'User-Agent': [__user_agent__]
     }
-    payload = json.dumps(data)
+    payload = http.codec.dumps(data)
 
-    d = Agent(reactor).request(
+    d = http.request(
         method='POST',
         uri=endpoint,
         headers=Headers(headers),
         bodyProducer=StringProducer(payload))
 
     def cbResponse(body, response):
-        if response.code == 501:
+        if response.code == 429:
             raise RateLimitError('Rate limited')
         elif response.code == 400:
             raise LoginError('Unable to peform operation')
@@ -240,9 +630,9 @@ def http_post(endpoint, token, data, reactor=None):
     return d
 
 
-def http_patch(endpoint, token, data, reactor=None):
-    if reactor is None:
-        from twisted.internet import reactor
+def http_patch(endpoint, token, data, reactor=None, http=None):
+    if http is None:
+        http = get_http_client(reactor)
     assert endpoint is not None
     assert data is not None
     headers = {
@@ -250,16 +640,16 @@ def http_patch(endpoint, token, data, reactor=None):
         'content-type': ['application/json'],
         'User-Agent': [__user_agent__]
     }
-    payload = json.dumps(data)
+    payload = http.codec.dumps(data)
 
-    d = Agent(reactor).request(
+    d = http.request(
         method='PATCH',
         uri=endpoint,
         headers=Headers(headers),
         bodyProducer=StringProducer(payload))
 
     def cbResponse(body, response):
-        if response.code == 501:
+        if response.code == 429:
             raise RateLimitError('Rate limited')
         elif response.code == 400:
             raise LoginError('Unable to peform operation')
@@ -0,0 +1,686 @@
+"""
+Voice connections: the voice gateway, UDP transport and audio sending.
+
+L{Client.join_voice} asks the main gateway for a voice server and returns
+a L{VoiceConnection} once its websocket is identified, the UDP socket has
+discovered its external address and the encryption key is known::
+
+    voice = yield client.join_voice(guild_id, channel_id)
+    stats = yield voice.play(PCMSource(open('song.pcm', 'rb')), OpusEncoder())
+
+Audio goes out as one RTP packet per 20 ms Opus frame. Frames are read
+and encoded by an L{EncoderThread}, which keeps C{buffer_frames} encoded
+frames ready, so the reactor only takes a frame from a queue, encrypts it
+and writes it on every tick of the L{AudioPlayer}. The player is paced on
+absolute deadlines: a late tick sends the frames it missed instead of
+drifting.
+
+Packets are encrypted with the first mode offered by the server that an
+installed library supports: C{aead_aes256_gcm_rtpsize} (cryptography) or
+C{xsalsa20_poly1305_lite} and C{xsalsa20_poly1305} (PyNaCl). Encoding PCM
+needs opuslib; already encoded Opus packets can be played without it.
+"""
+import json
+import struct
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
+from twisted.internet import defer, task
+from twisted.internet.protocol import DatagramProtocol
+from twisted.logger import Logger
+
+from chord import __user_agent__
+from chord.errors import VoiceError
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+try:
+    import nacl.secret
+except ImportError:
+    nacl = None
+
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+
+# Voice gateway ops
+IDENTIFY = 0
+SELECT_PROTOCOL = 1
+READY = 2
+HEARTBEAT = 3
+SESSION_DESCRIPTION = 4
+SPEAKING = 5
+HEARTBEAT_ACK = 6
+RESUME = 7
+HELLO = 8
+
+VOICE_GATEWAY_VERSION = 4
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FRAME_DURATION = 0.02
+SAMPLES_PER_FRAME = int(SAMPLE_RATE * FRAME_DURATION)
+# Bytes of 16 bit stereo PCM in a frame
+FRAME_SIZE = SAMPLES_PER_FRAME * CHANNELS * 2
+# An Opus frame of silence, sent after the last frame
+SILENCE = b'\xf8\xff\xfe'
+TRAILING_SILENCE = 5
+
+_rtp_header = struct.Struct('>BBHII')
+RTP_HEADER_SIZE = _rtp_header.size
+_discovery = struct.Struct('>HHI64sH')
+_counter = struct.Struct('>I')
+
+
+def rtp_header(sequence, timestamp, ssrc):
+    return _rtp_header.pack(0x80, 0x78, sequence, timestamp, ssrc)
+
+
+def parse_rtp_header(packet):
+    """
+    Return C{(sequence, timestamp, ssrc)} of an RTP packet.
+    """
+    _, _, sequence, timestamp, ssrc = _rtp_header.unpack_from(packet)
+    return sequence, timestamp, ssrc
+
+
+def discovery_request(ssrc):
+    return _discovery.pack(1, 70, ssrc, b'', 0)
+
+
+def discovery_response(ssrc, address, port):
+    return _discovery.pack(2, 70, ssrc, address.encode('ascii'), port)
+
+
+def parse_discovery(packet):
+    """
+    Return C{(type, ssrc, address, port)} of an IP discovery packet, or
+    C{None} if C{packet} is not one.
+    """
+    if len(packet) != _discovery.size:
+        return None
+    kind, length, ssrc, address, port = _discovery.unpack(packet)
+    if length != 70 or kind not in (1, 2):
+        return None
+    return kind, ssrc, address.split(b'\x00', 1)[0].decode('ascii'), port
+
+
+class AES256GCMEncryptor(object):
+    """
+    C{aead_aes256_gcm_rtpsize}: the RTP header is authenticated, a 32 bit
+    nonce counter follows the ciphertext.
+    """
+    mode = 'aead_aes256_gcm_rtpsize'
+
+    def __init__(self, key):
+        self._aead = AESGCM(key)
+        self._nonce = 0
+
+    def encrypt(self, header, payload):
+        self._nonce = (self._nonce + 1) & 0xffffffff
+        nonce = _counter.pack(self._nonce)
+        return header + self._aead.encrypt(nonce + b'\x00' * 8, payload, header) + nonce
+
+    def decrypt(self, packet):
+        header, nonce = packet[:RTP_HEADER_SIZE], packet[-4:]
+        return self._aead.decrypt(nonce + b'\x00' * 8, packet[RTP_HEADER_SIZE:-4], header)
+
+
+class XSalsa20Poly1305Encryptor(object):
+    """
+    C{xsalsa20_poly1305}: the nonce is the RTP header, padded.
+    """
+    mode = 'xsalsa20_poly1305'
+
+    def __init__(self, key):
+        self._box = nacl.secret.SecretBox(key)
+
+    def encrypt(self, header, payload):
+        return header + self._box.encrypt(payload, header + b'\x00' * 12).ciphertext
+
+    def decrypt(self, packet):
+        header = packet[:RTP_HEADER_SIZE]
+        return self._box.decrypt(packet[RTP_HEADER_SIZE:], header + b'\x00' * 12)
+
+
+class XSalsa20Poly1305LiteEncryptor(XSalsa20Poly1305Encryptor):
+    """
+    C{xsalsa20_poly1305_lite}: a 32 bit nonce counter follows the
+    ciphertext.
+    """
+    mode = 'xsalsa20_poly1305_lite'
+    _nonce = 0
+
+    def encrypt(self, header, payload):
+        self._nonce = (self._nonce + 1) & 0xffffffff
+        nonce = _counter.pack(self._nonce)
+        return header + self._box.encrypt(payload, nonce + b'\x00' * 20).ciphertext + nonce
+
+    def decrypt(self, packet):
+        return self._box.decrypt(packet[RTP_HEADER_SIZE:-4], packet[-4:] + b'\x00' * 20)
+
+
+# In order of preference
+encryptors = [
+    (AES256GCMEncryptor, AESGCM is not None),
+    (XSalsa20Poly1305LiteEncryptor, nacl is not None),
+    (XSalsa20Poly1305Encryptor, nacl is not None)
+]
+
+
+def supported_modes():
+    return [encryptor.mode for encryptor, available in encryptors if available]
+
+
+def get_encryptor(mode):
+    for encryptor, available in encryptors:
+        if encryptor.mode == mode and available:
+            return encryptor
+    raise VoiceError('Unsupported voice encryption mode {0!r}'.format(mode))
+
+
+def select_mode(offered):
+    """
+    The preferred supported mode among those C{offered} by the server.
+    """
+    for mode in supported_modes():
+        if mode in offered:
+            return mode
+    raise VoiceError('No supported voice encryption mode in {0!r} (supported: {1!r})'.format(
+        offered, supported_modes()))
+
+
+class PCMSource(object):
+    """
+    16 bit 48 kHz stereo PCM read from a file object, one frame at a time.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self):
+        """
+        The next frame, or C{b''} at the end.
+        """
+        data = self.stream.read(FRAME_SIZE)
+        if data and len(data) < FRAME_SIZE:
+            data += b'\x00' * (FRAME_SIZE - len(data))
+        return data
+
+    def close(self):
+        self.stream.close()
+
+
+class OpusPacketSource(object):
+    """
+    Already encoded Opus packets, one per frame, from an iterable.
+    """
+    def __init__(self, packets):
+        self._packets = iter(packets)
+
+    def read(self):
+        return next(self._packets, b'')
+
+    def close(self):
+        pass
+
+
+class OpusEncoder(object):
+    def __init__(self, application='audio'):
+        if opuslib is None:
+            raise VoiceError('opuslib is required to encode PCM audio')
+        self._encoder = opuslib.Encoder(SAMPLE_RATE, CHANNELS, application)
+
+    def encode(self, pcm):
+        return self._encoder.encode(pcm, SAMPLES_PER_FRAME)
+
+
+_end = object()
+
+
+class EncoderThread(object):
+    """
+    Reads and encodes the frames of C{source} on a worker thread, keeping
+    up to C{buffer_frames} of them ready for L{next_frame}. Without an
+    C{encoder}, the source must produce encoded frames.
+    """
+    log = Logger()
+
+    def __init__(self, source, encoder=None, buffer_frames=50, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.source = source
+        self.encoder = encoder
+        self.frames = queue.Queue(maxsize=buffer_frames)
+        # Fires once the buffer is full or the source exhausted
+        self.ready = defer.Deferred()
+        self.finished = False
+        self.underruns = 0
+        self._stopped = threading.Event()
+        self._signalled = False
+        self._thread = threading.Thread(target=self._run, name='chord-voice-encoder')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self.ready
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                data = self.source.read()
+                if not data:
+                    break
+                self._put(data if self.encoder is None else self.encoder.encode(data))
+        except Exception:
+            self.log.failure('Voice source failed')
+        finally:
+            self._put(_end)
+            self._signal()
+            self.source.close()
+
+    def _put(self, frame):
+        while not self._stopped.is_set():
+            try:
+                self.frames.put(frame, timeout=0.1)
+            except queue.Full:
+                self._signal()
+                continue
+            if self.frames.full():
+                self._signal()
+            return
+
+    def _signal(self):
+        if not self._signalled:
+            self._signalled = True
+            self.reactor.callFromThread(self._ready)
+
+    def _ready(self):
+        if not self.ready.called:
+            self.ready.callback(self)
+
+    def next_frame(self):
+        """
+        The next encoded frame, L{SILENCE} if the encoder fell behind or
+        C{None} at the end. Never blocks.
+        """
+        if self.finished:
+            return None
+        try:
+            frame = self.frames.get_nowait()
+        except queue.Empty:
+            self.underruns += 1
+            return SILENCE
+        if frame is _end:
+            self.finished = True
+            return None
+        return frame
+
+    def stop(self):
+        self._stopped.set()
+        while True:
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                break
+
+
+class AudioPlayer(object):
+    """
+    Sends the frames of an L{EncoderThread} every L{FRAME_DURATION}.
+    """
+    # Frames sent at once to catch up with a late tick; frames further
+    # behind are skipped
+    max_catch_up = 5
+
+    def __init__(self, connection, frames, clock):
+        self.connection = connection
+        self.frames = frames
+        self.clock = clock
+        self.done = defer.Deferred()
+        self.sent = 0
+        self.late = 0
+        self.skipped = 0
+        self._silence = 0
+        self._call = None
+        self._started = None
+
+    def start(self):
+        if self.done.called:
+            return self.done
+        self.connection.speaking(True)
+        self._started = self.clock.seconds()
+        self._call = task.LoopingCall.withCount(self._tick)
+        self._call.clock = self.clock
+        d = self._call.start(FRAME_DURATION, now=True)
+        d.addErrback(self._failed)
+        return self.done
+
+    def _tick(self, count):
+        if count > 1:
+            self.late += 1
+        if count > self.max_catch_up:
+            self.skipped += count - self.max_catch_up
+            self.connection.skip_frames(count - self.max_catch_up)
+            count = self.max_catch_up
+        for _ in range(count):
+            if self._silence:
+                self._silence -= 1
+                self.connection.send_frame(SILENCE)
+                if not self._silence:
+                    self._finish()
+                    return
+                continue
+            frame = self.frames.next_frame()
+            if frame is None:
+                # Avoid Opus interpolation artifacts after the last frame
+                self._silence = TRAILING_SILENCE
+                continue
+            self.connection.send_frame(frame)
+            self.sent += 1
+
+    def stop(self):
+        """
+        Stop sending, the Deferred returned by L{start} fires with the
+        statistics.
+        """
+        self.frames.stop()
+        self._finish()
+
+    def _finish(self):
+        if self._call is not None and self._call.running:
+            self._call.stop()
+        if not self.done.called:
+            self.connection.speaking(False)
+            self.done.callback(self.stats())
+
+    def _failed(self, failure):
+        self.frames.stop()
+        if not self.done.called:
+            self.done.errback(failure)
+
+    def stats(self):
+        return {
+            'frames': self.sent,
+            'duration': self.clock.seconds() - self._started if self._started is not None else 0,
+            'late': self.late,
+            'skipped': self.skipped,
+            'underruns': self.frames.underruns
+        }
+
+
+class VoiceDatagramProtocol(DatagramProtocol):
+    """
+    The UDP socket of a voice connection, connected to the voice server.
+    """
+    discovery_timeout = 5
+    discovery_attempts = 3
+
+    def __init__(self, host, port, ssrc, clock):
+        self.host = host
+        self.port = port
+        self.ssrc = ssrc
+        self.clock = clock
+        self.received = 0
+        self._discovery = None
+        self._retry = None
+
+    def startProtocol(self):
+        self.transport.connect(self.host, self.port)
+
+    def discover(self):
+        """
+        Return a Deferred firing with our C{(address, port)} as seen by the
+        voice server.
+        """
+        self._discovery = defer.Deferred()
+        self._send_discovery(self.discovery_attempts)
+        return self._discovery
+
+    def _send_discovery(self, attempts):
+        if not attempts:
+            d, self._discovery = self._discovery, None
+            d.errback(VoiceError('No answer to IP discovery from {0}:{1}'.format(self.host, self.port)))
+            return
+        self.transport.write(discovery_request(self.ssrc))
+        self._retry = self.clock.callLater(self.discovery_timeout, self._send_discovery, attempts - 1)
+
+    def datagramReceived(self, data, addr):
+        if self._discovery is not None:
+            discovery = parse_discovery(data)
+            if discovery is not None and discovery[0] == 2:
+                if self._retry is not None and self._retry.active():
+                    self._retry.cancel()
+                d, self._discovery = self._discovery, None
+                d.callback(discovery[2:])
+                return
+        self.received += 1
+
+    def send(self, packet):
+        self.transport.write(packet)
+
+    def close(self):
+        if self._retry is not None and self._retry.active():
+            self._retry.cancel()
+        if self.transport is not None:
+            self.transport.stopListening()
+
+
+class VoiceClientProtocol(WebSocketClientProtocol):
+    log = Logger()
+
+    _ka_task = None
+    _heartbeat_sent = None
+
+    def onOpen(self):
+        connection = self.factory.connection
+        connection.protocol = self
+        self.send_op(IDENTIFY, {
+            'server_id': connection.server_id,
+            'user_id': connection.user_id,
+            'session_id': connection.session_id,
+            'token': connection.token
+        })
+
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode('utf8'))
+        op, data = msg.get('op'), msg.get('d')
+        connection = self.factory.connection
+        if op == HELLO:
+            self._start_heartbeat(data['heartbeat_interval'])
+        elif op == READY:
+            connection._on_ready(data)
+        elif op == SESSION_DESCRIPTION:
+            connection._on_session_description(data)
+        elif op == HEARTBEAT_ACK:
+            if self._heartbeat_sent is not None:
+                connection.latency = self.factory.reactor.seconds() - self._heartbeat_sent
+                self._heartbeat_sent = None
+        elif op == SPEAKING:
+            pass
+        else:
+            self.log.debug('Unknown voice op {op}', op=op)
+
+    def send_op(self, op, data):
+        self.sendMessage(json.dumps({'op': op, 'd': data}, separators=(',', ':')).encode('utf8'))
+
+    def _start_heartbeat(self, interval):
+        self._stop_heartbeat()
+        self._ka_task = task.LoopingCall(self.keepAlive)
+        self._ka_task.clock = self.factory.reactor
+        self._ka_task.start(interval / 1000.0)
+
+    def _stop_heartbeat(self):
+        if self._ka_task is not None and self._ka_task.running:
+            self._ka_task.stop()
+
+    def keepAlive(self):
+        self._heartbeat_sent = self.factory.reactor.seconds()
+        self.send_op(HEARTBEAT, int(self._heartbeat_sent * 1000))
+
+    def onClose(self, wasClean, code, reason):
+        self._stop_heartbeat()
+        self.factory.connection._on_close(code, reason)
+
+
+class VoiceClientFactory(WebSocketClientFactory):
+    protocol = VoiceClientProtocol
+
+    def __init__(self, url, connection, reactor):
+        WebSocketClientFactory.__init__(self, url, useragent=__user_agent__, reactor=reactor)
+        self.reactor = reactor
+        self.connection = connection
+
+    def clientConnectionFailed(self, connector, reason):
+        self.connection._on_close(None, reason.getErrorMessage())
+
+
+class VoiceConnection(object):
+    """
+    A connection to the voice server of a guild, see L{Client.join_voice}.
+    """
+    log = Logger()
+
+    protocol = None
+    udp = None
+    ssrc = None
+    mode = None
+    encryptor = None
+    latency = None
+    player = None
+
+    def __init__(self, endpoint, server_id, user_id, session_id, token, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.endpoint = endpoint
+        self.server_id = server_id
+        self.user_id = user_id
+        self.session_id = session_id
+        self.token = token
+        # Fires with the connection once audio can be sent
+        self.ready = defer.Deferred()
+        self.closed = defer.Deferred()
+        self.sequence = 0
+        self.timestamp = 0
+        self.packets_sent = 0
+
+    @property
+    def url(self):
+        endpoint = self.endpoint
+        if '://' not in endpoint:
+            # Older endpoints carry a port the websocket is not served on
+            if endpoint.endswith(':80'):
+                endpoint = endpoint[:-3]
+            endpoint = 'wss://' + endpoint
+        return '{0}?v={1}'.format(endpoint, VOICE_GATEWAY_VERSION)
+
+    def connect(self):
+        connectWS(VoiceClientFactory(self.url, self, self.reactor))
+        return self.ready
+
+    def _on_ready(self, data):
+        self.ssrc = data['ssrc']
+        try:
+            self.mode = select_mode(data.get('modes', ()))
+        except VoiceError:
+            self._fail()
+            return
+        d = self.reactor.resolve(data['ip'])
+        d.addCallback(self._start_udp, data['port'])
+        d.addCallback(self._select_protocol)
+        d.addErrback(self._fail)
+
+    def _start_udp(self, host, port):
+        self.udp = VoiceDatagramProtocol(host, port, self.ssrc, self.reactor)
+        self.reactor.listenUDP(0, self.udp)
+        return self.udp.discover()
+
+    def _select_protocol(self, address):
+        ip, port = address
+        self.log.debug('Voice UDP external address {ip}:{port}', ip=ip, port=port)
+        self.protocol.send_op(SELECT_PROTOCOL, {
+            'protocol': 'udp',
+            'data': {'address': ip, 'port': port, 'mode': self.mode}
+        })
+
+    def _on_session_description(self, data):
+        try:
+            self.encryptor = get_encryptor(data['mode'])(bytes(bytearray(data['secret_key'])))
+        except VoiceError:
+            self._fail()
+            return
+        if not self.ready.called:
+            self.ready.callback(self)
+
+    def _fail(self, failure=None):
+        if not self.ready.called:
+            self.ready.errback(failure)
+        self.disconnect()
+
+    def _on_close(self, code, reason):
+        if self.player is not None:
+            self.player.stop()
+        if self.udp is not None:
+            self.udp.close()
+            self.udp = None
+        if not self.ready.called:
+            self.ready.errback(VoiceError('Voice connection closed ({0}): {1}'.format(code, reason)))
+        if not self.closed.called:
+            self.closed.callback((code, reason))
+
+    def speaking(self, speaking=True):
+        if self.protocol is None or self.protocol.state != self.protocol.STATE_OPEN:
+            return
+        self.protocol.send_op(SPEAKING, {'speaking': 1 if speaking else 0, 'delay': 0, 'ssrc': self.ssrc})
+
+    def send_frame(self, frame):
+        """
+        Encrypt and send one encoded frame.
+        """
+        header = rtp_header(self.sequence, self.timestamp, self.ssrc)
+        self.udp.send(self.encryptor.encrypt(header, frame))
+        self.sequence = (self.sequence + 1) & 0xffff
+        self.timestamp = (self.timestamp + SAMPLES_PER_FRAME) & 0xffffffff
+        self.packets_sent += 1
+
+    def skip_frames(self, frames):
+        """
+        Advance the RTP timestamp over frames that were not sent.
+        """
+        self.timestamp = (self.timestamp + SAMPLES_PER_FRAME * frames) & 0xffffffff
+
+    def play(self, source, encoder=None, buffer_frames=50):
+        """
+        Play C{source} (see L{PCMSource}, L{OpusPacketSource}), encoded
+        with C{encoder} if given. Returns a Deferred firing with the
+        player statistics once it is done.
+        """
+        if self.player is not None and not self.player.done.called:
+            return defer.fail(VoiceError('Already playing'))
+        frames = EncoderThread(source, encoder, buffer_frames, reactor=self.reactor)
+        self.player = AudioPlayer(self, frames, self.reactor)
+        d = frames.start()
+        d.addCallback(lambda ignored: self.player.start())
+        return d
+
+    def stop(self):
+        if self.player is not None:
+            self.player.stop()
+
+    def disconnect(self):
+        if self.protocol is not None:
+            self.protocol.sendClose()
+        else:
+            self._on_close(None, 'Disconnected')
+        return self.closed
@@ -26,6 +26,11 @@ setup(
     packages=[str('chord'), str('tests')],
     long_description=read('README'),
     install_requires=requires,
+    extras_require={
+        'speedups': ['ujson'],
+        'etf': ['erlpack'],
+        'voice': ['PyNaCl', 'opuslib'],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Topic :: Communications :: Chat",
@@ -0,0 +1,70 @@
+import json
+import subprocess
+import sys
+
+from twisted.trial import unittest
+
+from chord import aio
+
+
+# The asyncio reactor cannot be installed in the test process, which
+# already runs another one
+script = '''
+import asyncio, json
+from chord.aio import AsyncClient, install
+
+async def main():
+    install()
+    from chord.testing import FakeDiscord
+    from chord.util import HTTPClient
+    frames = [{'op': 0, 't': 'READY', 'd': {'session_id': 'abc', 'user': {'id': '1', 'username': 'chord'},
+                                            'guilds': [], 'private_channels': []}}]
+    frames += [{'op': 0, 't': 'MESSAGE_CREATE', 'd': {'id': str(i), 'channel_id': '11', 'content': 'hi'}}
+               for i in range(20)]
+    discord = FakeDiscord(frames).start()
+    discord.api.routes[('GET', '/api/users/5')] = {'id': '5', 'username': 'five'}
+    http = HTTPClient(api_base=discord.api_base)
+    cli = AsyncClient(token=discord.token, http=http, cache=True)
+    received = []
+    done = asyncio.get_running_loop().create_future()
+
+    @cli.event
+    async def on_message_create(data):
+        await asyncio.sleep(0)
+        received.append(data['id'])
+        if len(received) == 20:
+            done.set_result(None)
+
+    ready = asyncio.ensure_future(cli.wait_for('READY'))
+    await cli.connect()
+    await ready
+    await asyncio.wait_for(done, 5)
+    user = await cli.rest.get_user('5')
+    # Close after a reconnect, on the protocol the factory built since
+    resumed = asyncio.ensure_future(cli.wait_for('RESUMED'))
+    cli.client.factory.maxDelay = 0.1
+    discord.gateway.connections[0].dropConnection(abort=True)
+    await resumed
+    result = {'received': received, 'user': user['username'], 'cached_user': cli.state.user.username}
+    await cli.close()
+    await discord.stop().asFuture(asyncio.get_running_loop())
+    print(json.dumps(result))
+
+asyncio.run(main())
+'''
+
+
+class AsyncClientTests(unittest.TestCase):
+    def test_coroutine_handlers_and_rest(self):
+        output = subprocess.check_output([sys.executable, '-c', script], timeout=30)
+        result = json.loads(output.decode('utf8').strip().splitlines()[-1])
+        self.assertEqual(result['received'], [str(i) for i in range(20)])
+        self.assertEqual(result['user'], 'five')
+        self.assertEqual(result['cached_user'], 'chord')
+
+    def test_other_reactor_installed(self):
+        from twisted.internet import reactor  # noqa: F401
+        import asyncio
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertRaises(aio.ReactorAlreadyInstalledError, aio.install, loop)
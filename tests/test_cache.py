@@ -0,0 +1,142 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.cache import ActiveGuildsCache, LRUCache, NoCache, TTLCache
+from chord.client import Client
+from chord.state import ConnectionState
+
+
+class Entity(object):
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+
+
+class PolicyTests(unittest.TestCase):
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        evicted = []
+        cache.on_evict = lambda key, value: evicted.append(key)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(evicted, ['b'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 1, 'misses': 1, 'evictions': 1})
+
+    def test_ttl_expires(self):
+        clock = Clock()
+        cache = TTLCache(10, clock=clock.seconds)
+        cache.set('a', 1)
+        clock.advance(5)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        clock.advance(5)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_no_cache(self):
+        cache = NoCache()
+        self.assertFalse(cache.set('a', 1))
+        self.assertIsNone(cache.get('a'))
+
+    def test_active_guilds_only(self):
+        cache = ActiveGuildsCache(['1'])
+        self.assertTrue(cache.set('a', Entity('1')))
+        self.assertFalse(cache.set('b', Entity('2')))
+        cache.deactivate('1')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.evictions, 1)
+
+
+def guild(members):
+    return {
+        'id': '100',
+        'member_count': members,
+        'members': [{'user': {'id': str(i)}, 'roles': []} for i in range(members)]
+    }
+
+
+class StatePolicyTests(unittest.TestCase):
+    def test_evicted_members_leave_guild(self):
+        state = ConnectionState({'members': LRUCache(3)})
+        state.apply('GUILD_CREATE', guild(5))
+        self.assertEqual(sorted(state.get_guild('100').members), ['2', '3', '4'])
+        self.assertEqual(state.members.evictions, 2)
+
+        # Updates for an evicted member bring it back
+        state.apply('GUILD_MEMBER_UPDATE', {'guild_id': '100', 'user': {'id': '0'}, 'roles': ['9']})
+        self.assertEqual(state.get_member('100', '0').roles, ('9',))
+
+    def test_messages_not_cached_by_default(self):
+        state = ConnectionState()
+        self.assertNotIn('MESSAGE_CREATE', state.events)
+        state.apply('MESSAGE_CREATE', {'id': '1', 'channel_id': '2', 'content': 'hi'})
+        self.assertIsNone(state.get_message('1'))
+
+    def test_message_cache(self):
+        state = ConnectionState({'messages': LRUCache(10)})
+        self.assertIn('MESSAGE_CREATE', state.events)
+        state.apply('MESSAGE_CREATE', {'id': '1', 'channel_id': '2', 'content': 'hi', 'author': {'id': '3'}})
+        state.apply('MESSAGE_UPDATE', {'id': '1', 'content': 'edited'})
+        self.assertEqual(state.get_message('1').content, 'edited')
+        state.apply('MESSAGE_DELETE_BULK', {'ids': ['1'], 'channel_id': '2'})
+        self.assertIsNone(state.get_message('1'))
+
+    def test_members_disabled(self):
+        state = ConnectionState({'members': NoCache()})
+        state.apply('GUILD_CREATE', guild(3))
+        self.assertEqual(state.get_guild('100').members, {})
+        self.assertNotIn('GUILD_MEMBERS_CHUNK', state.events)
+
+
+class ActiveGuildListenerTests(unittest.TestCase):
+    def setUp(self):
+        self.client = Client(reactor=Clock(), cache_policies={'members': ActiveGuildsCache()})
+        self.calls = []
+
+    def on_guild_member_add(self, data):
+        self.calls.append(data['user']['id'])
+
+    def test_guild_listener_activates_guild(self):
+        self.client.handle_event('GUILD_CREATE', {'d': guild(2)})
+        self.assertEqual(self.client.state.get_guild('100').members, {})
+
+        self.client.add_listener(self.on_guild_member_add, guild_id='100')
+        for guild_id, user_id in (('100', '7'), ('200', '8')):
+            self.client.handle_event('GUILD_MEMBER_ADD', {'d': {'guild_id': guild_id, 'user': {'id': user_id}}})
+        self.assertEqual(self.calls, ['7'])
+        self.assertEqual(list(self.client.state.get_guild('100').members), ['7'])
+
+        self.client.remove_listener(self.on_guild_member_add, guild_id='100')
+        self.assertEqual(self.client.state.get_guild('100').members, {})
+        self.assertEqual(self.client.state.members.evictions, 1)
+
+    def test_guild_stays_active_while_listened(self):
+        other = lambda data: None
+        self.client.add_listener(self.on_guild_member_add, guild_id='100')
+        self.client.add_listener(other, 'GUILD_MEMBER_UPDATE', guild_id=100)
+        self.client.remove_listener(self.on_guild_member_add, guild_id='100')
+        self.assertEqual(self.client.state.members.active, set(['100']))
+        self.client.remove_listener(other, 'GUILD_MEMBER_UPDATE', guild_id='100')
+        self.assertEqual(self.client.state.members.active, set())
+
+    def test_pinned_guild_kept_without_listeners(self):
+        members = self.client.state.members
+        self.client.handle_event('GUILD_CREATE', {'d': guild(0)})
+        members.activate('100')
+        self.client.add_listener(self.on_guild_member_add, guild_id='100')
+        self.client.handle_event('GUILD_MEMBER_ADD', {'d': {'guild_id': '100', 'user': {'id': '7'}}})
+        self.client.remove_listener(self.on_guild_member_add, guild_id='100')
+        self.assertEqual(members.active, set(['100']))
+        self.assertEqual(list(self.client.state.get_guild('100').members), ['7'])
+
+    def test_listened_guild_kept_when_deactivated(self):
+        members = self.client.state.members
+        members.activate('100')
+        self.client.add_listener(self.on_guild_member_add, guild_id='100')
+        members.deactivate('100')
+        self.assertEqual(members.active, set(['100']))
+        self.client.remove_listener(self.on_guild_member_add, guild_id='100')
+        self.assertEqual(members.active, set())
@@ -1,28 +1,128 @@
-import sys
+from twisted.internet import defer
+from twisted.trial import unittest
 
-from twisted.internet import reactor
+from chord.client import Client
+from chord.executor import PAUSE, HandlerExecutor
+from chord.reconnect import ReconnectCoordinator
+from chord.testing import FakeDiscord
+from chord.util import HTTPClient
 
-import chord
-chord.util.start_logging()
 
-cli = chord.Client(reactor=reactor)
+def session(messages=10):
+    frames = [{'op': 0, 't': 'READY', 'd': {
+        'session_id': 'abc',
+        'user': {'id': '1', 'username': 'chord', 'discriminator': '0001'},
+        'guilds': [],
+        'private_channels': []
+    }}, {'op': 0, 't': 'GUILD_CREATE', 'd': {
+        'id': '10', 'name': 'guild', 'roles': [], 'channels': [{'id': '11', 'type': 'text'}],
+        'members': [{'user': {'id': str(100 + i), 'username': 'user'}, 'roles': []} for i in range(50)]
+    }}]
+    for i in range(messages):
+        frames.append({'op': 0, 't': 'MESSAGE_CREATE', 'd': {
+            'id': str(1000 + i), 'channel_id': '11', 'content': 'hello',
+            'author': {'id': '100', 'username': 'user'}
+        }})
+    return frames
 
-@cli.event
-def on_ready(data):
-    print('dickbutts')
 
+class FakeDiscordTestCase(unittest.TestCase):
+    timeout = 10
 
-@cli.event
-def on_presence_update(data):
-    print('p update')
+    def setUp(self):
+        self.discord = FakeDiscord(session()).start()
+        self.http = HTTPClient(api_base=self.discord.api_base)
+        self.addCleanup(self.discord.stop)
+        self.addCleanup(self.http.close)
 
 
-if __name__ == "__main__":
-    moot = cli.login_and_connect('maxpowa1@gmail.com', 'notmy')
+class ReplayTests(FakeDiscordTestCase):
+    @defer.inlineCallbacks
+    def replay(self, **kwargs):
+        client = Client(token=self.discord.token, http=self.http, cache=True,
+                        coordinator=ReconnectCoordinator(identify_interval=0), **kwargs)
+        messages = []
+        done = defer.Deferred()
 
-    def done(ignored):
-        if moot.running:
-            moot.stop()
+        @client.event
+        def on_message_create(data):
+            messages.append(data['id'])
+            if len(messages) == 10:
+                done.callback(None)
 
-    cli.deferred.addBoth(done)
-    moot.run()
+        gateway = yield client.fetch_gateway()
+        yield client.connect(gateway)
+        yield done
+
+        yield client.disconnect('done')
+
+        self.assertEqual(messages, [str(1000 + i) for i in range(10)])
+        self.assertEqual(len(client.state.get_guild('10').members), 50)
+        self.assertEqual(self.discord.gateway.identifies, 1)
+
+    def test_uncompressed(self):
+        return self.replay(compression=None)
+
+    def test_payload_compression(self):
+        return self.replay(compression='payload')
+
+    def test_zlib_stream(self):
+        return self.replay(compression='zlib-stream')
+
+    def test_etf(self):
+        return self.replay(compression=None, encoding='etf')
+
+    def test_etf_payload_compression(self):
+        return self.replay(compression='payload', encoding='etf')
+
+    def test_etf_zlib_stream(self):
+        return self.replay(compression='zlib-stream', encoding='etf')
+
+
+class ReconnectTests(FakeDiscordTestCase):
+    @defer.inlineCallbacks
+    def test_request_members_after_resume(self):
+        client = Client(token=self.discord.token, http=self.http, cache=True,
+                        executor=HandlerExecutor(overflow=PAUSE),
+                        coordinator=ReconnectCoordinator(identify_interval=0))
+        ready = client.wait_for('READY')
+        gateway = yield client.fetch_gateway()
+        first = yield client.connect(gateway)
+        yield ready
+        yield self.discord.gateway.replayed
+        client.factory.maxDelay = 0.1
+
+        resumed = client.wait_for('RESUMED')
+        self.discord.gateway.connections[0].dropConnection(abort=True)
+        yield resumed
+        self.assertIsNot(client._protocol, first)
+        self.assertIs(client._protocol, client.factory.current_protocol)
+        self.assertIs(client.executor.transport, client._protocol)
+
+        count = yield client.request_members('10')
+        self.assertEqual(count, 50)
+        self.assertEqual(self.discord.gateway.received[-1]['op'], 8)
+
+        live = client._protocol
+        yield client.disconnect()
+        self.assertTrue(live.closed)
+        self.assertEqual(self.discord.gateway.identifies, 1)
+
+    @defer.inlineCallbacks
+    def test_reconnect_request_resumes(self):
+        client = Client(token=self.discord.token, http=self.http,
+                        coordinator=ReconnectCoordinator(identify_interval=0))
+        ready = client.wait_for('READY')
+        gateway = yield client.fetch_gateway()
+        first = yield client.connect(gateway)
+        yield ready
+        yield self.discord.gateway.replayed
+
+        resumed = client.wait_for('RESUMED')
+        self.discord.gateway.connections[0].request_reconnect()
+        yield resumed
+        self.assertIsNot(client._protocol, first)
+        self.assertEqual(self.discord.gateway.identifies, 1)
+        self.assertEqual(client.reconnect_stats()['reconnects'], {'reconnect': 1})
+
+        yield client.disconnect()
@@ -0,0 +1,136 @@
+import os
+import tempfile
+
+from twisted.internet import defer, reactor
+from twisted.internet.endpoints import UNIXServerEndpoint
+from twisted.trial import unittest
+
+from chord.client import Client
+from chord.cluster import ClusterBus, ClusterCoordinator, ClusterSupervisor, SupervisorFactory
+from chord.testing import FakeDiscord
+from chord.util import HTTPClient
+
+
+API_BASE_ENV = 'CHORD_TEST_API_BASE'
+
+
+def worker_client(bus):
+    """
+    Entry point of the workers spawned by L{SupervisorTests}.
+    """
+    return Client(http=HTTPClient(api_base=os.environ[API_BASE_ENV]))
+
+
+class RecordingClient(object):
+    def __init__(self):
+        self.dispatched = []
+
+    def dispatch(self, event, data, shard_id=None):
+        self.dispatched.append((event, data, shard_id))
+
+
+class ClusterBusTests(unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'chord.sock')
+        self.supervisor = ClusterSupervisor('tests:none', 'token', self.path, shard_count=2, workers=2)
+        self.port = yield UNIXServerEndpoint(reactor, self.path).listen(SupervisorFactory(self.supervisor))
+        self.buses = []
+        for worker_id in range(2):
+            bus = ClusterBus(worker_id)
+            bus.client = RecordingClient()
+            bus.register_query('guild_count', lambda worker_id=worker_id: 10 + worker_id)
+            yield bus.connect(self.path)
+            self.buses.append(bus)
+        while len(self.supervisor.connections) < 2:
+            yield deferLater(0.01)
+
+    def tearDown(self):
+        self.supervisor.coordinator.stop()
+        for bus in self.buses:
+            bus.connection.transport.loseConnection()
+        return self.port.stopListening()
+
+    @defer.inlineCallbacks
+    def test_query_fans_out(self):
+        results = yield self.buses[0].query('guild_count')
+        self.assertEqual(sorted(results), [10, 11])
+
+    @defer.inlineCallbacks
+    def test_event_forwarded_to_other_workers(self):
+        self.buses[0].forward('GUILD_CREATE', {'d': {'id': '1'}}, 0)
+        while not self.buses[1].client.dispatched:
+            yield deferLater(0.01)
+        self.assertEqual(self.buses[1].client.dispatched, [('REMOTE_GUILD_CREATE', {'id': '1'}, 0)])
+        self.assertEqual(self.buses[0].client.dispatched, [])
+
+    @defer.inlineCallbacks
+    def test_identify_granted_across_workers(self):
+        self.supervisor.coordinator.identify_interval = 0.3
+        coordinators = [ClusterCoordinator(bus) for bus in self.buses]
+        first = coordinators[0].identify()
+        second = coordinators[1].identify()
+        yield first
+        yield deferLater(0.1)
+        self.assertNoResult(second)
+        yield second
+        self.assertEqual(self.supervisor.coordinator.identifies, 2)
+        self.assertEqual([coordinator.identifies for coordinator in coordinators], [1, 1])
+
+    @defer.inlineCallbacks
+    def test_cancelled_identify_released(self):
+        self.supervisor.coordinator.identify_interval = 0.3
+        first = ClusterCoordinator(self.buses[0]).identify()
+        yield first
+        cancelled = ClusterCoordinator(self.buses[1]).identify()
+        cancelled.cancel()
+        self.failureResultOf(cancelled, defer.CancelledError)
+        while self.supervisor.coordinator.pending_identifies:
+            yield deferLater(0.01)
+        yield ClusterCoordinator(self.buses[1]).identify()
+        self.assertEqual(self.supervisor.coordinator.identifies, 2)
+
+
+class SupervisorTests(unittest.TestCase):
+    timeout = 30
+
+    def setUp(self):
+        self.discord = FakeDiscord([], shards=2).start()
+        self.addCleanup(self.discord.stop)
+        os.environ[API_BASE_ENV] = self.discord.api_base
+        self.addCleanup(os.environ.pop, API_BASE_ENV)
+        path = os.path.join(tempfile.mkdtemp(), 'chord.sock')
+        self.supervisor = ClusterSupervisor('tests.test_cluster:worker_client', self.discord.token, path,
+                                            shard_count=2, workers=2)
+        self.supervisor.restart_delay = 0.1
+        self.supervisor.coordinator.identify_interval = 0.2
+
+    @defer.inlineCallbacks
+    def wait(self, condition):
+        while not condition():
+            yield deferLater(0.05)
+
+    @defer.inlineCallbacks
+    def test_crashed_worker_restarted_alone(self):
+        supervisor = self.supervisor
+        yield supervisor.start()
+        self.addCleanup(self.wait, lambda: not supervisor.processes)
+        self.addCleanup(supervisor.stop)
+        yield self.wait(lambda: self.discord.gateway.identifies == 2 and len(supervisor.connections) == 2)
+        survivor = supervisor.processes[1]
+        survivor_connection = supervisor.connections[1]
+
+        crashed = supervisor.processes[0]
+        crashed.signalProcess('KILL')
+        yield self.wait(lambda: 0 in supervisor.processes and supervisor.processes[0] is not crashed)
+        yield self.wait(lambda: self.discord.gateway.identifies == 3 and len(supervisor.connections) == 2)
+
+        self.assertIs(supervisor.processes[1], survivor)
+        self.assertIs(supervisor.connections[1], survivor_connection)
+        self.assertEqual(len(self.discord.gateway.connections), 2)
+        self.assertEqual(supervisor.coordinator.identifies, 3)
+
+
+def deferLater(delay):
+    from twisted.internet import task
+    return task.deferLater(reactor, delay, lambda: None)
@@ -0,0 +1,31 @@
+from twisted.trial import unittest
+
+from chord.codec import JSONCodec, available_codecs, get_codec
+
+
+class CodecTests(unittest.TestCase):
+    frame = {'op': 0, 's': 3, 't': 'MESSAGE_CREATE', 'd': {'content': 'héllo', 'id': '1234'}}
+
+    def test_round_trip_bytes(self):
+        for name in available_codecs():
+            codec = get_codec(name)
+            data = codec.dumps(self.frame)
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(codec.loads(data), self.frame)
+
+    def test_default_prefers_accelerated(self):
+        self.assertEqual(get_codec().name, available_codecs()[0])
+
+    def test_instance_passed_through(self):
+        codec = JSONCodec()
+        self.assertIs(get_codec(codec), codec)
+        self.assertRaises(ValueError, get_codec, 'yaml')
+
+    def test_peek_envelope(self):
+        codec = JSONCodec()
+        self.assertEqual(codec.peek(b'{"t":"TYPING_START","s":42,"op":0,"d":{"t":"x","op":5}}'),
+                         (0, 42, 'TYPING_START'))
+        self.assertEqual(codec.peek(b'{"t":null,"s":null,"op":11,"d":null}'), (11, None, None))
+
+    def test_peek_falls_back_when_body_first(self):
+        self.assertIsNone(JSONCodec().peek(b'{"d":{"t":"X","s":1,"op":0},"op":0}'))
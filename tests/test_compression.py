@@ -0,0 +1,62 @@
+import zlib
+
+from twisted.trial import unittest
+
+from chord.compression import MAX_PAYLOAD, PayloadInflater, StreamInflater, get_inflater
+from chord.errors import WSError
+from chord.util import gateway_url
+
+
+def stream_frames(*messages):
+    compressor = zlib.compressobj()
+    return [compressor.compress(m) + compressor.flush(zlib.Z_SYNC_FLUSH) for m in messages]
+
+
+class StreamInflaterTests(unittest.TestCase):
+    def test_shared_context_across_frames(self):
+        inflater = StreamInflater()
+        first, second = stream_frames(b'{"op":10}', b'{"op":11}')
+        self.assertEqual(inflater.feed(first), b'{"op":10}')
+        self.assertEqual(inflater.feed(second), b'{"op":11}')
+
+    def test_partial_frames_buffered_until_suffix(self):
+        inflater = StreamInflater()
+        frame, = stream_frames(b'{"t":"READY"}')
+        self.assertIsNone(inflater.feed(frame[:5]))
+        self.assertEqual(inflater.feed(frame[5:]), b'{"t":"READY"}')
+
+    def test_reset_starts_new_stream(self):
+        inflater = StreamInflater()
+        inflater.feed(stream_frames(b'first')[0])
+        inflater.reset()
+        self.assertEqual(inflater.feed(stream_frames(b'second')[0]), b'second')
+
+    def test_oversized_message(self):
+        inflater = StreamInflater()
+        frame, = stream_frames(b'0' * (MAX_PAYLOAD + 1))
+        self.assertRaises(WSError, inflater.feed, frame)
+        self.assertEqual(inflater.feed(stream_frames(b'{}')[0]), b'{}')
+
+    def test_oversized_buffer(self):
+        inflater = StreamInflater()
+        inflater.feed(b'0' * MAX_PAYLOAD)
+        self.assertRaises(WSError, inflater.feed, b'0')
+        self.assertEqual(inflater._buffer, [])
+
+
+class InflaterTests(unittest.TestCase):
+    def test_payload_inflater(self):
+        self.assertEqual(PayloadInflater().feed(zlib.compress(b'{}')), b'{}')
+
+    def test_oversized_payload(self):
+        self.assertRaises(WSError, PayloadInflater().feed, zlib.compress(b'0' * (MAX_PAYLOAD + 1)))
+        self.assertEqual(len(PayloadInflater().feed(zlib.compress(b'0' * MAX_PAYLOAD))), MAX_PAYLOAD)
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, get_inflater, 'brotli')
+
+    def test_gateway_url(self):
+        self.assertEqual(gateway_url('wss://gateway.discord.gg', compress='zlib-stream'),
+                         'wss://gateway.discord.gg?compress=zlib-stream')
+        self.assertEqual(gateway_url('wss://gateway.discord.gg/?v=6&compress=x', compress='zlib-stream'),
+                         'wss://gateway.discord.gg/?v=6&compress=zlib-stream')
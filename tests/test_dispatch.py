@@ -0,0 +1,117 @@
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.client import Client
+
+
+class DispatchTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.client = Client(reactor=self.clock)
+        self.calls = []
+
+    def test_multiple_listeners(self):
+        @self.client.event
+        def on_message_create(data):
+            self.calls.append(('first', data))
+
+        self.client.add_listener(lambda data: self.calls.append(('second', data)), 'MESSAGE_CREATE')
+        self.client.dispatch('MESSAGE_CREATE', {'id': '1'})
+        self.assertEqual(self.calls, [('first', {'id': '1'}), ('second', {'id': '1'})])
+        self.assertTrue(self.client.wants_event('MESSAGE_CREATE'))
+        self.assertFalse(self.client.wants_event('TYPING_START'))
+
+    def test_wildcard(self):
+        self.client.add_listener(lambda event, data: self.calls.append(event), '*')
+        self.client.dispatch('TYPING_START', {})
+        self.assertEqual(self.calls, ['TYPING_START'])
+        self.assertTrue(self.client.wants_event('ANYTHING'))
+
+    def test_subclass_handlers(self):
+        calls = self.calls
+
+        class Bot(Client):
+            def on_ready(self, data):
+                calls.append(data)
+
+        Bot(reactor=self.clock).dispatch('READY', {'v': 3})
+        self.assertEqual(calls, [{'v': 3}])
+
+    def test_remove_listener(self):
+        def on_ready(data):
+            self.calls.append(data)
+        self.client.event(on_ready)
+        self.client.remove_listener(on_ready)
+        self.client.dispatch('READY', {})
+        self.assertEqual(self.calls, [])
+        self.assertFalse(self.client.wants_event('READY'))
+
+    def test_event_replaces_handler(self):
+        calls = self.calls
+
+        class Bot(Client):
+            def on_ready(self, data):
+                calls.append('method')
+
+        bot = Bot(reactor=self.clock)
+
+        @bot.event
+        def on_ready(data):
+            calls.append('first')
+
+        @bot.event
+        def on_ready(data):
+            calls.append('second')
+
+        bot.dispatch('READY', {})
+        self.assertEqual(calls, ['second'])
+
+    def test_listener_removing_itself(self):
+        def once(data):
+            self.calls.append('once')
+            self.client.remove_listener(once, 'READY')
+
+        self.client.add_listener(once, 'READY')
+        self.client.add_listener(lambda data: self.calls.append('next'), 'READY')
+        self.client.dispatch('READY', {})
+        self.client.dispatch('READY', {})
+        self.assertEqual(self.calls, ['once', 'next', 'next'])
+
+    def test_shard_id_only_when_accepted(self):
+        @self.client.event
+        def on_message_create(data):
+            self.calls.append('plain')
+
+        def sharded(data, shard_id):
+            self.calls.append(shard_id)
+
+        self.client.add_listener(sharded, 'MESSAGE_CREATE')
+        self.client.add_listener(lambda event, data, **kwargs: self.calls.append(kwargs), '*')
+        d = self.client.wait_for('MESSAGE_CREATE', lambda data: data['id'] == '1')
+        self.client.dispatch('MESSAGE_CREATE', {'id': '1'}, shard_id=3)
+        self.assertEqual(self.calls, ['plain', 3, {'shard_id': 3}])
+        self.assertEqual(self.successResultOf(d), {'id': '1'})
+
+    def test_wait_for_predicate(self):
+        d = self.client.wait_for('message_create', lambda data: data['id'] == '2')
+        self.assertTrue(self.client.wants_event('MESSAGE_CREATE'))
+        self.client.dispatch('MESSAGE_CREATE', {'id': '1'})
+        self.assertNoResult(d)
+        self.client.dispatch('MESSAGE_CREATE', {'id': '2'})
+        self.assertEqual(self.successResultOf(d), {'id': '2'})
+        self.assertFalse(self.client.wants_event('MESSAGE_CREATE'))
+
+    def test_wait_for_timeout(self):
+        d = self.client.wait_for('READY', timeout=5)
+        self.clock.advance(5)
+        self.failureResultOf(d, defer.TimeoutError)
+        self.assertEqual(self.client._waiters, {})
+
+    def test_wait_for_raising_predicate(self):
+        d = self.client.wait_for('MESSAGE_CREATE', lambda data: data['missing'], timeout=5)
+        self.client.dispatch('MESSAGE_CREATE', {'id': '1'})
+        self.failureResultOf(d, KeyError)
+        self.clock.advance(6)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self.client._waiters, {})
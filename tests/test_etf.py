@@ -0,0 +1,67 @@
+import json
+import struct
+import zlib
+
+from twisted.trial import unittest
+
+from chord import etf
+from chord.codec import get_codec
+from chord.compression import PayloadInflater
+
+
+class ETFTests(unittest.TestCase):
+    frame = {
+        'op': 0, 's': 3, 't': 'MESSAGE_CREATE',
+        'd': {'content': 'héllo', 'id': '80351110224678912', 'tts': False, 'nonce': None,
+              'embeds': [], 'mentions': [{'id': '1', 'bot': True}], 'score': 1.5, 'count': -70000}
+    }
+
+    def test_round_trip(self):
+        self.assertEqual(etf.decode(etf.encode(self.frame)), self.frame)
+
+    def test_matches_erlang(self):
+        # term_to_binary(#{<<"a">> => 1, <<"b">> => [nil, true]})
+        data = (b'\x83t\x00\x00\x00\x02m\x00\x00\x00\x01aa\x01'
+                b'm\x00\x00\x00\x01bl\x00\x00\x00\x02s\x03nils\x04truej')
+        self.assertEqual(etf.decode(data), {'a': 1, 'b': [None, True]})
+        self.assertEqual(etf.encode([]), b'\x83j')
+        self.assertEqual(etf.encode(-1), b'\x83b\xff\xff\xff\xff')
+
+    def test_snowflakes_decoded_as_strings(self):
+        snowflake = 80351110224678912
+        data = etf.encode({'id': snowflake, 'guild_id': 10, 'roles': [snowflake, 2],
+                           'small': 2 ** 31 - 1, 'negative': -2 ** 40})
+        self.assertEqual(etf.decode(data), {'id': str(snowflake), 'guild_id': '10', 'roles': [str(snowflake), '2'],
+                                            'small': 2 ** 31 - 1, 'negative': -2 ** 40})
+
+    def test_large_integers_kept(self):
+        self.assertEqual(etf.decode(etf.encode({'since': 1700000000000})), {'since': 1700000000000})
+        self.assertEqual(etf.normalise({b'since': 1700000000000, b'id': 5}), {'since': 1700000000000, 'id': '5'})
+
+    def test_same_shape_as_json(self):
+        frame = dict(self.frame, d=dict(self.frame['d'], id=80351110224678912))
+        self.assertEqual(etf.decode(etf.encode(frame)), json.loads(json.dumps(self.frame)))
+
+    def test_tuples_strings_and_compressed_terms(self):
+        body = b'h\x02k\x00\x03abcF' + struct.pack('>d', 0.25)
+        self.assertEqual(etf.decode(b'\x83' + body), ['abc', 0.25])
+        compressed = b'\x83P' + struct.pack('>I', len(body)) + zlib.compress(body)
+        self.assertEqual(etf.decode(compressed), ['abc', 0.25])
+
+    def test_invalid(self):
+        self.assertRaises(etf.ETFError, etf.decode, b'{"op":0}')
+        self.assertRaises(etf.ETFError, etf.decode, b'\x83\x01')
+        self.assertRaises(etf.ETFError, etf.encode, {'value': object()})
+
+    def test_codec(self):
+        codec = get_codec('etf')
+        self.assertTrue(codec.binary)
+        self.assertEqual(codec.encoding, 'etf')
+        self.assertIsNone(codec.peek(codec.dumps(self.frame)))
+        self.assertEqual(codec.loads(codec.dumps(self.frame)), self.frame)
+
+    def test_payload_inflater_passes_etf_through(self):
+        data = etf.encode(self.frame)
+        inflater = PayloadInflater()
+        self.assertEqual(inflater.feed(data), data)
+        self.assertEqual(inflater.feed(zlib.compress(data)), data)
@@ -0,0 +1,106 @@
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.executor import COALESCE, PAUSE, HandlerExecutor
+
+
+class ManualExecutor(HandlerExecutor):
+    """
+    Runs handlers when the test fires the pending Deferreds.
+    """
+    def __init__(self, **kwargs):
+        HandlerExecutor.__init__(self, reactor=Clock(), **kwargs)
+        self.running = []
+
+    def _run(self, func, args, kwargs):
+        d = defer.Deferred()
+        d.addCallback(lambda ignored: func(*args, **kwargs))
+        self.running.append(d)
+        return d
+
+    def finish_one(self):
+        self.running.pop(0).callback(None)
+
+
+class FakeTransport(object):
+    paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class HandlerExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def handler(self, data):
+        self.calls.append(data)
+
+    def test_bounded_concurrency(self):
+        executor = ManualExecutor(threads=2)
+        for i in range(5):
+            executor.submit('MESSAGE_CREATE', self.handler, ({'id': i},), {})
+        self.assertEqual(len(executor.running), 2)
+        self.assertEqual(executor.stats()['events']['MESSAGE_CREATE']['depth'], 3)
+        for _ in range(5):
+            executor.finish_one()
+        self.assertEqual([c['id'] for c in self.calls], [0, 1, 2, 3, 4])
+
+    def test_drop_oldest(self):
+        executor = ManualExecutor(threads=1, max_depth=2)
+        for i in range(5):
+            executor.submit('TYPING_START', self.handler, ({'id': i},), {})
+        while executor.running:
+            executor.finish_one()
+        self.assertEqual([c['id'] for c in self.calls], [0, 3, 4])
+        self.assertEqual(executor.stats()['events']['TYPING_START']['dropped'], 2)
+
+    def test_coalesce(self):
+        executor = ManualExecutor(threads=1, max_depth=2, overflow=COALESCE)
+        executor.submit('PRESENCE_UPDATE', self.handler, ({'user': {'id': 'a'}, 'status': 0},), {})
+        executor.submit('PRESENCE_UPDATE', self.handler, ({'user': {'id': 'a'}, 'status': 1},), {})
+        executor.submit('PRESENCE_UPDATE', self.handler, ({'user': {'id': 'b'}, 'status': 2},), {})
+        executor.submit('PRESENCE_UPDATE', self.handler, ({'user': {'id': 'a'}, 'status': 3},), {})
+        while executor.running:
+            executor.finish_one()
+        self.assertEqual([c['status'] for c in self.calls], [0, 3, 2])
+        self.assertEqual(executor.stats()['events']['PRESENCE_UPDATE']['coalesced'], 1)
+
+    def test_pause_transport(self):
+        executor = ManualExecutor(threads=1, max_depth=2, overflow=PAUSE)
+        transport = FakeTransport()
+        executor.bind(transport)
+        for i in range(4):
+            executor.submit('GUILD_CREATE', self.handler, ({'id': i},), {})
+        self.assertTrue(transport.paused)
+        executor.finish_one()
+        executor.finish_one()
+        self.assertFalse(transport.paused)
+        while executor.running:
+            executor.finish_one()
+        self.assertEqual(len(self.calls), 4)
+
+    def test_pause_rebound_transport(self):
+        executor = ManualExecutor(threads=1, max_depth=2, overflow=PAUSE)
+        executor.bind(FakeTransport())
+        for i in range(4):
+            executor.submit('GUILD_CREATE', self.handler, ({'id': i},), {})
+        reconnected = FakeTransport()
+        executor.bind(reconnected)
+        self.assertTrue(reconnected.paused)
+        executor.finish_one()
+        executor.finish_one()
+        self.assertFalse(reconnected.paused)
+
+    def test_pause_without_transport_drops(self):
+        executor = ManualExecutor(threads=1, max_depth=2, overflow=PAUSE)
+        for i in range(5):
+            executor.submit('GUILD_CREATE', self.handler, ({'id': i},), {})
+        stats = executor.stats()['events']['GUILD_CREATE']
+        self.assertEqual(stats['depth'], 2)
+        self.assertEqual(stats['dropped'], 2)
+        self.assertFalse(executor.paused)
@@ -0,0 +1,111 @@
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+from twisted.web.http_headers import Headers
+
+from chord.util import HTTPClient, RateLimiter, get_http_client, route_key
+
+
+class StallingEndpoint(object):
+    def __init__(self):
+        self.attempts = 0
+
+    def connect(self, factory):
+        self.attempts += 1
+        return defer.Deferred()
+
+
+class HTTPClientTests(unittest.TestCase):
+    def test_shared_per_reactor(self):
+        clock = Clock()
+        self.assertIs(get_http_client(clock), get_http_client(clock))
+        self.assertIsNot(get_http_client(clock), get_http_client(Clock()))
+
+    def test_pool_configuration(self):
+        http = HTTPClient(Clock(), maxPersistentPerHost=2, cachedConnectionTimeout=30)
+        self.assertTrue(http.pool.persistent)
+        self.assertEqual(http.pool.maxPersistentPerHost, 2)
+        self.assertEqual(http.pool.cachedConnectionTimeout, 30)
+
+    def test_new_connection_counts_as_miss(self):
+        http = HTTPClient(Clock())
+        endpoint = StallingEndpoint()
+        http.pool.getConnection(('https', b'discordapp.com', 443), endpoint)
+        http.pool.getConnection(('https', b'discordapp.com', 443), endpoint)
+        self.assertEqual(endpoint.attempts, 2)
+        self.assertEqual(http.pool.stats(), {'hits': 0, 'misses': 2, 'idle': 0})
+
+
+def headers(**kwargs):
+    return Headers(dict((k.replace('_', '-'), [str(v)]) for k, v in kwargs.items()))
+
+
+class RouteKeyTests(unittest.TestCase):
+    def test_major_parameter_kept(self):
+        self.assertEqual(
+            route_key('POST', 'https://discordapp.com/api/channels/1234/messages'),
+            'POST /channels/1234/messages')
+
+    def test_minor_ids_collapsed(self):
+        self.assertEqual(
+            route_key(b'DELETE', b'https://discordapp.com/api/v6/channels/1/messages/99?x=1'),
+            'DELETE /channels/1/messages/{id}')
+        self.assertEqual(
+            route_key('PATCH', 'https://discordapp.com/api/users/555'),
+            'PATCH /users/{id}')
+
+
+class RateLimiterTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = RateLimiter(self.clock)
+        self.fired = []
+
+    def acquire(self, key='GET /a'):
+        d = self.limiter.acquire(key)
+        d.addCallback(lambda ignored: self.fired.append(key))
+        return d
+
+    def test_probe_until_limits_known(self):
+        self.acquire()
+        self.acquire()
+        self.assertEqual(len(self.fired), 1)
+        self.limiter.update('GET /a', 200, headers(X_RateLimit_Limit=5, X_RateLimit_Remaining=4, X_RateLimit_Reset_After=1))
+        self.assertEqual(len(self.fired), 2)
+
+    def test_queue_released_on_reset(self):
+        self.acquire()
+        self.limiter.update('GET /a', 200, headers(X_RateLimit_Limit=1, X_RateLimit_Remaining=0, X_RateLimit_Reset_After=2))
+        self.acquire()
+        self.acquire()
+        self.assertEqual(len(self.fired), 1)
+        self.clock.advance(2)
+        self.assertEqual(len(self.fired), 2)
+        self.limiter.update('GET /a', 200, headers(X_RateLimit_Limit=1, X_RateLimit_Remaining=0, X_RateLimit_Reset_After=2))
+        self.clock.advance(1.9)
+        self.assertEqual(len(self.fired), 2)
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.fired), 3)
+
+    def test_global_limit_blocks_all_buckets(self):
+        self.acquire('GET /a')
+        self.limiter.update('GET /a', 429, headers(Retry_After=3, X_RateLimit_Global='true'))
+        self.acquire('GET /b')
+        self.assertEqual(self.fired, ['GET /a'])
+        self.clock.advance(3)
+        self.assertEqual(self.fired, ['GET /a', 'GET /b'])
+
+    def test_retry_after_zero(self):
+        self.acquire()
+        self.limiter.update('GET /a', 429, headers(Retry_After=0))
+        self.acquire()
+        self.assertEqual(len(self.fired), 2)
+
+    def test_idle_buckets_pruned(self):
+        for key in ('GET /a', 'GET /b', 'GET /c'):
+            self.acquire(key)
+        self.limiter.update('GET /a', 200, headers(X_RateLimit_Limit=5, X_RateLimit_Remaining=4, X_RateLimit_Reset_After=1))
+        self.limiter.update('GET /b', 200, headers(X_RateLimit_Limit=5, X_RateLimit_Remaining=4, X_RateLimit_Reset_After=600))
+        self.clock.advance(self.limiter.prune_interval)
+        self.acquire('GET /d')
+        self.assertEqual(sorted(self.limiter.buckets), ['GET /b', 'GET /c', 'GET /d'])
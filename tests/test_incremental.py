@@ -0,0 +1,133 @@
+import json
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.client import BaseClient
+from chord.incremental import IncrementalParser
+from chord.protocol import DiscordClientFactory, EventHandler
+from chord.state import ConnectionState
+
+
+class RecordingHandler(EventHandler):
+    def __init__(self):
+        self.events = []
+
+    def handle_event(self, event, data):
+        self.events.append((event, data.get('d')))
+
+
+def build_protocol(**kwargs):
+    factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=Clock(), **kwargs)
+    return factory.buildProtocol(None)
+
+
+def encode(frame):
+    return json.dumps(frame, separators=(',', ':')).encode('utf8')
+
+
+def run(parser):
+    steps = sum(1 for _ in parser.parse())
+    return parser.result, steps
+
+
+def guild_create(members):
+    return {
+        't': 'GUILD_CREATE', 's': 2, 'op': 0,
+        'd': {
+            'id': '1', 'name': 'guild', 'roles': [], 'channels': [{'id': '2', 'type': 'text'}],
+            'members': [{'user': {'id': str(100 + i), 'username': 'user'}, 'roles': ['3'], 'nick': None}
+                        for i in range(members)]
+        }
+    }
+
+
+class IncrementalParserTests(unittest.TestCase):
+    def test_matches_json(self):
+        documents = [
+            {'t': 'READY', 'op': 0, 'd': {'guilds': [{'members': [{'a': [1, 2.5, None]}], 'x': {}}], 'e': []}},
+            [1, 'two', {'three': [True, False]}, [], [[]]],
+            {'unicode': 'café ☃', 'escaped': 'a "quoted" \\ string', 'n': -1.5e3},
+            'just a string',
+            42
+        ]
+        for document in documents:
+            for depth in (0, 1, 3, 10):
+                text = json.dumps(document, indent=1)
+                result, _ = run(IncrementalParser(text.encode('utf8'), max_depth=depth, slice_size=1))
+                self.assertEqual(result, document)
+
+    def test_yields_every_slice(self):
+        payload = encode(guild_create(1000))
+        result, steps = run(IncrementalParser(payload, max_depth=3, slice_size=100))
+        self.assertEqual(result, json.loads(payload))
+        self.assertTrue(steps >= 10)
+
+    def test_keys_shared_and_text_released(self):
+        parser = IncrementalParser(encode(guild_create(10)), max_depth=3, slice_size=1)
+        result, _ = run(parser)
+        members = result['d']['members']
+        self.assertEqual(len(set(id(key) for member in members for key in member['user'])), 2)
+        self.assertIsNone(parser.text)
+
+    def test_malformed(self):
+        parser = IncrementalParser(b'{"a": [1, 2}', max_depth=3)
+        self.assertRaises(ValueError, run, parser)
+
+
+class RecordingClient(BaseClient):
+    def __init__(self):
+        self.state = ConnectionState()
+        self.events = []
+
+    def dispatch(self, event, *args, **kwargs):
+        self.events.append((event, len(self.state.members)))
+
+
+class LargeFrameTests(unittest.TestCase):
+    def setUp(self):
+        self.protocol = build_protocol(incremental=True, large_frame_threshold=1000, slice_size=10)
+        self.clock = self.protocol.factory.reactor
+
+    def flush(self):
+        while self.clock.getDelayedCalls():
+            self.clock.advance(0)
+
+    def test_large_frame_parsed_cooperatively(self):
+        handler = RecordingHandler()
+        self.protocol.add_event_handler(handler)
+        frame = guild_create(500)
+
+        self.protocol.onMessage(encode(frame), False)
+        self.protocol.onMessage(b'{"t":"TYPING_START","s":3,"op":0,"d":{}}', False)
+        self.assertEqual(handler.events, [])
+
+        self.flush()
+        self.assertEqual(handler.events, [('GUILD_CREATE', frame['d']), ('TYPING_START', {})])
+        self.assertEqual(self.protocol.sequence, 3)
+
+        stats, = self.protocol.factory.large_frames
+        self.assertEqual(stats['event'], 'GUILD_CREATE')
+        self.assertIn('parse_time', stats)
+        self.assertIn('peak_memory', stats)
+
+    def test_small_frames_unaffected(self):
+        handler = RecordingHandler()
+        self.protocol.add_event_handler(handler)
+        self.protocol.onMessage(encode(guild_create(1)), False)
+        self.assertEqual(len(handler.events), 1)
+        self.assertEqual(len(self.protocol.factory.large_frames), 0)
+
+    def test_cache_ingested_in_slices(self):
+        client = RecordingClient()
+        client.cooperator = self.protocol.factory.cooperator
+        client.slice_size = 50
+        self.protocol.add_event_handler(client)
+
+        self.protocol.onMessage(encode(guild_create(500)), False)
+        self.protocol.onMessage(b'{"t":"GUILD_MEMBER_REMOVE","s":3,"op":0,'
+                                b'"d":{"guild_id":"1","user":{"id":"100"}}}', False)
+        self.flush()
+
+        # Dispatched once everything is cached, the next frame after that
+        self.assertEqual(client.events, [('GUILD_CREATE', 500), ('GUILD_MEMBER_REMOVE', 499)])
@@ -0,0 +1,99 @@
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.metrics import Counter, Histogram, Metrics, MetricsResource, Registry
+from chord.protocol import DiscordClientFactory, EventHandler
+from chord.util import HTTPClient
+
+
+class Handler(EventHandler):
+    def handle_event(self, event, data):
+        pass
+
+
+class RegistryTests(unittest.TestCase):
+    def test_counter(self):
+        counter = Counter('frames_total', 'Frames', ('direction',))
+        counter.labels('in').inc()
+        counter.labels('in').inc(2)
+        counter.labels('out').inc()
+        self.assertEqual(list(counter.samples()), [
+            ('frames_total{direction="in"}', 3),
+            ('frames_total{direction="out"}', 1)
+        ])
+        self.assertRaises(ValueError, counter.labels)
+
+    def test_histogram(self):
+        histogram = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples()), [
+            ('latency_seconds_bucket{le="0.1"}', 1),
+            ('latency_seconds_bucket{le="1.0"}', 2),
+            ('latency_seconds_bucket{le="+Inf"}', 3),
+            ('latency_seconds_sum', 5.55),
+            ('latency_seconds_count', 3)
+        ])
+
+    def test_render(self):
+        registry = Registry()
+        registry.counter('reconnects_total', 'Reconnects', ('reason',)).labels('lo"st').inc()
+        self.assertEqual(registry.render(), '# HELP reconnects_total Reconnects\n'
+                                            '# TYPE reconnects_total counter\n'
+                                            'reconnects_total{reason="lo\\"st"} 1\n')
+
+    def test_resource(self):
+        registry = Registry()
+        registry.counter('up', 'Up').inc()
+
+        class Request(object):
+            def setHeader(self, name, value):
+                self.content_type = value
+
+        request = Request()
+        body = MetricsResource(registry).render_GET(request)
+        self.assertIn(b'up 1\n', body)
+        self.assertTrue(request.content_type.startswith(b'text/plain'))
+
+
+class GatewayMetricsTests(unittest.TestCase):
+    def test_frames_counted(self):
+        metrics = Metrics()
+        factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=Clock(),
+                                       compression=None, metrics=metrics)
+        protocol = factory.buildProtocol(None)
+        protocol.add_event_handler(Handler())
+        payload = b'{"t":"TYPING_START","s":1,"op":0,"d":{}}'
+        protocol.onMessage(payload, False)
+
+        self.assertEqual(metrics.frames_in.value, 1)
+        self.assertEqual(metrics.bytes_in.value, len(payload))
+        self.assertEqual(metrics.decode_seconds.count, 1)
+        self.assertEqual(metrics.dispatch_seconds.labels('TYPING_START').count, 1)
+
+    def test_reconnects_counted(self):
+        metrics = Metrics()
+        factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=Clock(), metrics=metrics)
+        factory.continueTrying = False
+        factory.clientConnectionLost(None, 'lost')
+        self.assertEqual(metrics.reconnects.labels('lost').value, 1)
+
+
+class FakeAgent(object):
+    def __init__(self, code):
+        self.code = code
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        response = type('Response', (object,), {'code': self.code, 'headers': None})()
+        return defer.succeed(response)
+
+
+class RESTMetricsTests(unittest.TestCase):
+    def test_latency_per_route(self):
+        metrics = Metrics()
+        http = HTTPClient(Clock(), metrics=metrics)
+        http.agent = FakeAgent(200)
+        http.ratelimiter.update = lambda *args: None
+        http.request('GET', 'https://discordapp.com/api/channels/123456/messages/789012')
+        self.assertEqual(metrics.rest_seconds.labels('GET /channels/{id}/messages/{id}', '200').count, 1)
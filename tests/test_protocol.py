@@ -0,0 +1,249 @@
+import zlib
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.codec import JSONCodec
+from chord.compression import MAX_PAYLOAD
+from chord.protocol import DiscordClientFactory, DiscordClientProtocol, EventHandler
+
+
+class RecordingHandler(EventHandler):
+    def __init__(self, wanted=()):
+        self.wanted = set(wanted)
+        self.events = []
+
+    def wants_event(self, event):
+        return event in self.wanted
+
+    def handle_event(self, event, data):
+        self.events.append((event, data.get('d')))
+
+
+class CountingCodec(JSONCodec):
+    decoded = 0
+
+    def loads(self, data):
+        self.decoded += 1
+        return JSONCodec.loads(self, data)
+
+
+def build_protocol(**kwargs):
+    factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=Clock(), **kwargs)
+    protocol = factory.buildProtocol(None)
+    protocol.sent = []
+    protocol.sendMessage = lambda payload, *args, **kw: protocol.sent.append(factory.codec.loads(payload))
+    return protocol
+
+
+class LazyDecodeTests(unittest.TestCase):
+    def test_unwanted_dispatch_not_decoded(self):
+        codec = CountingCodec()
+        protocol = build_protocol(codec=codec, lazy=True)
+        handler = RecordingHandler(wanted=['MESSAGE_CREATE'])
+        protocol.add_event_handler(handler)
+
+        protocol.onMessage(b'{"t":"TYPING_START","s":5,"op":0,"d":{}}', False)
+        self.assertEqual(codec.decoded, 0)
+        self.assertEqual(protocol.sequence, 5)
+
+        protocol.onMessage(b'{"t":"MESSAGE_CREATE","s":6,"op":0,"d":{"id":"1"}}', False)
+        self.assertEqual(codec.decoded, 1)
+        self.assertEqual(handler.events, [('MESSAGE_CREATE', {'id': '1'})])
+
+    def test_eager_by_default(self):
+        protocol = build_protocol()
+        handler = RecordingHandler()
+        protocol.add_event_handler(handler)
+        protocol.onMessage(b'{"t":"TYPING_START","s":5,"op":0,"d":{}}', False)
+        self.assertEqual(handler.events, [('TYPING_START', {})])
+
+
+class IdentifyTests(unittest.TestCase):
+    def test_identify_without_shard(self):
+        protocol = build_protocol()
+        protocol.onOpen()
+        self.assertEqual(protocol.sent[0]['op'], DiscordClientProtocol.IDENTIFY)
+        self.assertNotIn('shard', protocol.sent[0]['d'])
+
+    def test_identify_with_shard(self):
+        protocol = build_protocol(shard=(2, 5))
+        protocol.onOpen()
+        self.assertEqual(protocol.sent[0]['d']['shard'], [2, 5])
+
+    def test_factory_handlers_survive_reconnect(self):
+        factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=Clock())
+        handler = RecordingHandler()
+        factory.add_event_handler(handler)
+        factory.buildProtocol(None)
+        protocol = factory.buildProtocol(None)
+        protocol.onMessage(b'{"t":"MESSAGE_CREATE","s":1,"op":0,"d":{}}', False)
+        self.assertEqual(handler.events, [('MESSAGE_CREATE', {})])
+
+
+class ResumeTests(unittest.TestCase):
+    def test_resume_after_reconnect(self):
+        protocol = build_protocol()
+        protocol.onOpen()
+        protocol.onMessage(b'{"t":"READY","s":1,"op":0,"d":{"session_id":"abc","heartbeat_interval":41250}}', False)
+        protocol.onMessage(b'{"t":"MESSAGE_CREATE","s":7,"op":0,"d":{}}', False)
+        protocol.onClose(False, 1006, 'lost')
+
+        reconnected = build_protocol()
+        reconnected.factory = protocol.factory
+        reconnected.onOpen()
+        self.assertEqual(reconnected.sent[0], {
+            'op': DiscordClientProtocol.RESUME,
+            'd': {'token': 'token', 'session_id': 'abc', 'seq': 7}
+        })
+
+    def test_invalid_session_identifies(self):
+        protocol = build_protocol()
+        protocol.factory.session_id = 'abc'
+        protocol.factory.sequence = 9
+        protocol.onOpen()
+        protocol.onMessage(b'{"op":9,"d":false}', False)
+        self.assertEqual(protocol.sent[-1]['op'], DiscordClientProtocol.IDENTIFY)
+        self.assertIsNone(protocol.factory.session_id)
+
+
+def dispatch(event, data, seq=1):
+    return JSONCodec().dumps({'t': event, 's': seq, 'op': 0, 'd': data})
+
+
+class MemberChunkerTests(unittest.TestCase):
+    def setUp(self):
+        self.protocol = build_protocol(large_threshold=50)
+        self.clock = self.protocol.factory.reactor
+        self.protocol.onOpen()
+        self.protocol.sent = []
+
+    def test_large_threshold(self):
+        protocol = build_protocol(large_threshold=50)
+        protocol.onOpen()
+        self.assertEqual(protocol.sent[0]['d']['large_threshold'], 50)
+
+    def test_requests_batched_per_frame(self):
+        self.protocol.chunker.batch_size = 2
+        for guild_id in ['1', '2', '3']:
+            self.protocol.request_members(guild_id)
+        self.assertEqual(self.protocol.sent, [])
+        self.clock.advance(0)
+        self.assertEqual([frame['d']['guild_id'] for frame in self.protocol.sent], [['1', '2'], ['3']])
+        self.assertEqual(self.protocol.sent[0]['op'], DiscordClientProtocol.REQUEST_MEMBERS)
+
+    def test_fires_after_last_chunk(self):
+        self.protocol.onMessage(dispatch('GUILD_CREATE', {'id': '1', 'member_count': 3, 'large': True}), False)
+        self.protocol.chunker.chunk_size = 2
+        results = []
+        self.protocol.request_members('1').addCallback(results.append)
+        self.clock.advance(0)
+
+        self.protocol.onMessage(dispatch('GUILD_MEMBERS_CHUNK', {'guild_id': '1', 'members': [{}, {}]}), False)
+        self.assertEqual(results, [])
+        self.protocol.onMessage(dispatch('GUILD_MEMBERS_CHUNK', {'guild_id': '1', 'members': [{}]}), False)
+        self.assertEqual(results, [3])
+
+    def test_fetch_members_on_large_guild(self):
+        self.protocol.factory.fetch_members = True
+        self.protocol.onMessage(dispatch('GUILD_CREATE', {'id': '1', 'member_count': 300, 'large': True}), False)
+        self.protocol.onMessage(dispatch('GUILD_CREATE', {'id': '2', 'member_count': 3, 'large': False}), False)
+        self.clock.advance(0)
+        self.assertEqual(self.protocol.sent[0]['d']['guild_id'], ['1'])
+
+    def test_timeout(self):
+        d = self.protocol.request_members('1')
+        self.clock.advance(self.protocol.chunker.timeout)
+        self.assertFailure(d, Exception)
+        self.assertEqual(self.protocol.chunker.pending, {})
+        return d
+
+
+class HeartbeatTests(unittest.TestCase):
+    def setUp(self):
+        self.protocol = build_protocol()
+        self.protocol.dropped = []
+        self.protocol.dropConnection = lambda abort=False: self.protocol.dropped.append(abort)
+        self.clock = self.protocol.factory.reactor
+        self.protocol.onOpen()
+        self.protocol.onMessage(b'{"op":10,"d":{"heartbeat_interval":40000}}', False)
+
+    def heartbeats(self):
+        return [frame for frame in self.protocol.sent if frame['op'] == DiscordClientProtocol.HEARTBEAT]
+
+    def test_latency_tracked(self):
+        self.assertEqual(len(self.heartbeats()), 1)
+        self.clock.advance(0.05)
+        self.protocol.onMessage(b'{"op":11}', False)
+        self.clock.advance(40)
+        self.clock.advance(0.15)
+        self.protocol.onMessage(b'{"op":11}', False)
+
+        stats = self.protocol.factory.latency_stats()
+        self.assertAlmostEqual(self.protocol.factory.latency, 0.15)
+        self.assertAlmostEqual(stats['p50'], 0.15)
+        self.assertAlmostEqual(stats['p99'], 0.15)
+        self.assertEqual(stats['samples'], 2)
+
+    def test_missed_ack_drops_zombie(self):
+        self.protocol.onMessage(b'{"op":11}', False)
+        self.clock.advance(40)
+        self.assertEqual(self.protocol.dropped, [])
+        self.clock.advance(40)
+        self.assertEqual(self.protocol.dropped, [True])
+        self.assertEqual(len(self.heartbeats()), 2)
+        self.assertEqual(self.protocol.factory.zombies, 1)
+        self.assertTrue(self.protocol.factory.reconnect_now)
+
+    def test_not_armed_without_acks(self):
+        self.clock.advance(40)
+        self.clock.advance(40)
+        self.assertEqual(self.protocol.dropped, [])
+        self.assertEqual(len(self.heartbeats()), 3)
+
+    def test_paused_reads_not_zombie(self):
+        self.protocol.transport = FakeTransport()
+        self.protocol.onMessage(b'{"op":11}', False)
+        self.protocol.pauseProducing()
+        self.assertTrue(self.protocol.transport.paused)
+        for _ in range(5):
+            self.clock.advance(40)
+        self.assertEqual(self.protocol.dropped, [])
+        self.assertEqual(len(self.heartbeats()), 6)
+
+        self.protocol.resumeProducing()
+        self.assertFalse(self.protocol.transport.paused)
+        self.clock.advance(40)
+        self.assertEqual(self.protocol.dropped, [])
+        self.clock.advance(40)
+        self.assertEqual(self.protocol.dropped, [True])
+
+    def test_oversized_payload_drops_connection(self):
+        self.protocol.onMessage(zlib.compress(b' ' * (MAX_PAYLOAD + 1)), True)
+        self.assertEqual(self.protocol.dropped, [True])
+
+    def test_zombie_reconnects_immediately(self):
+        factory = self.protocol.factory
+        factory.reconnect_now = 'zombie'
+        connector = Connector()
+        factory.clientConnectionLost(connector, 'zombie')
+        self.clock.advance(0)
+        self.assertEqual(connector.connects, 1)
+        self.assertFalse(factory.reconnect_now)
+
+
+class FakeTransport(object):
+    paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class Connector(object):
+    connects = 0
+
+    def connect(self):
+        self.connects += 1
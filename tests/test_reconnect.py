@@ -0,0 +1,140 @@
+import random
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.protocol import DiscordClientFactory, DiscordClientProtocol
+from chord.reconnect import FATAL, IDENTIFY, RESUME, ReconnectCoordinator, close_reason, decorrelated_jitter, \
+    get_coordinator
+
+
+class FakeConnector(object):
+    connects = 0
+
+    def connect(self):
+        self.connects += 1
+
+    def stopConnecting(self):
+        pass
+
+
+def build_protocol(factory):
+    protocol = factory.buildProtocol(None)
+    protocol.sent = []
+    protocol.sendMessage = lambda payload, *args, **kw: protocol.sent.append(factory.codec.loads(payload))
+    return protocol
+
+
+class JitterTests(unittest.TestCase):
+    def test_bounds(self):
+        rand = random.Random(1).uniform
+        delay = 1.0
+        for _ in range(200):
+            following = decorrelated_jitter(delay, 1.0, 60.0, rand)
+            self.assertTrue(1.0 <= following <= min(60.0, delay * 3))
+            delay = following
+
+    def test_retry_delays_positive(self):
+        clock = Clock()
+        factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=clock)
+        connector = FakeConnector()
+        for _ in range(50):
+            factory.clientConnectionLost(connector, 'lost')
+            self.assertGreaterEqual(factory.delay, factory.initialDelay)
+            self.assertLessEqual(factory.delay, factory.maxDelay)
+            clock.advance(factory.delay)
+        self.assertEqual(connector.connects, 50)
+
+
+class CloseCodeTests(unittest.TestCase):
+    def test_mapping(self):
+        self.assertEqual(close_reason(4004), ('authentication_failed', FATAL))
+        for code in range(4010, 4015):
+            self.assertEqual(close_reason(code)[1], FATAL)
+        self.assertEqual(close_reason(4009), ('session_timeout', IDENTIFY))
+        self.assertEqual(close_reason(4008), ('rate_limited', RESUME))
+        self.assertEqual(close_reason(1006), ('lost', RESUME))
+        self.assertEqual(close_reason(None), ('lost', RESUME))
+
+    def test_fatal_code_stops_reconnecting(self):
+        factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=Clock())
+        protocol = build_protocol(factory)
+        protocol.onClose(False, 4004, 'Authentication failed.')
+        connector = FakeConnector()
+        factory.clientConnectionLost(connector, 'closed')
+        factory.reactor.advance(3600)
+        self.assertEqual(connector.connects, 0)
+        self.assertEqual(factory.coordinator.stats()['fatal'], 1)
+
+    def test_session_timeout_identifies(self):
+        factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=Clock())
+        factory.session_id = 'abc'
+        factory.sequence = 9
+        build_protocol(factory).onClose(False, 4009, 'Session timed out.')
+        self.assertIsNone(factory.session_id)
+        factory.clientConnectionLost(FakeConnector(), 'closed')
+        self.assertEqual(factory.coordinator.reconnects, {'session_timeout': 1})
+
+
+class IdentifyLimitTests(unittest.TestCase):
+    def test_identifies_spaced(self):
+        clock = Clock()
+        protocols = []
+        for _ in range(3):
+            factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=clock)
+            protocol = build_protocol(factory)
+            protocol.onOpen()
+            protocols.append(protocol)
+        identified = lambda: [len(protocol.sent) for protocol in protocols]
+        self.assertEqual(identified(), [1, 0, 0])
+        self.assertEqual(get_coordinator(clock).pending_identifies, 2)
+        clock.advance(5)
+        self.assertEqual(identified(), [1, 1, 0])
+        clock.advance(5)
+        self.assertEqual(identified(), [1, 1, 1])
+        self.assertEqual(protocols[2].sent[0]['op'], DiscordClientProtocol.IDENTIFY)
+
+    def test_resume_not_limited(self):
+        clock = Clock()
+        protocols = []
+        for _ in range(3):
+            factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=clock)
+            factory.session_id = 'abc'
+            protocol = build_protocol(factory)
+            protocol.onOpen()
+            protocols.append(protocol)
+        self.assertEqual([protocol.sent[0]['op'] for protocol in protocols], [DiscordClientProtocol.RESUME] * 3)
+
+    def test_max_concurrency(self):
+        clock = Clock()
+        coordinator = ReconnectCoordinator(clock, max_concurrency=2)
+        fired = []
+        for i in range(5):
+            coordinator.identify().addCallback(lambda _, i=i: fired.append(i))
+        self.assertEqual(fired, [0, 1])
+        clock.advance(5)
+        self.assertEqual(fired, [0, 1, 2, 3])
+
+    def test_closed_while_waiting(self):
+        clock = Clock()
+        factory = DiscordClientFactory('wss://gateway.discord.gg', token='token', reactor=clock)
+        first, second = build_protocol(factory), build_protocol(factory)
+        first.onOpen()
+        second.onOpen()
+        second.onClose(False, 1006, 'lost')
+        self.assertEqual(factory.coordinator.pending_identifies, 0)
+        clock.advance(5)
+        self.assertEqual(second.sent, [])
+
+
+class RateTests(unittest.TestCase):
+    def test_reconnect_rate(self):
+        clock = Clock()
+        coordinator = ReconnectCoordinator(clock)
+        for _ in range(30):
+            coordinator.record('lost')
+            clock.advance(1)
+        self.assertEqual(coordinator.reconnect_rate(), 0.5)
+        clock.advance(60)
+        self.assertEqual(coordinator.stats()['rate'], 0)
+        self.assertEqual(coordinator.stats()['reconnects'], {'lost': 30})
@@ -0,0 +1,122 @@
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+from twisted.web.client import ResponseDone
+
+from chord.errors import HTTPError
+from chord.rest import RESTClient, Route
+from chord.snowflake import time_snowflake
+from chord.testing import FakeDiscord
+from chord.util import HTTPClient, SimpleReceiver
+
+
+class RouteTests(unittest.TestCase):
+    def test_template(self):
+        route = Route('DELETE', '/channels/{channel_id}/messages/{message_id}', channel_id=1, message_id=2)
+        self.assertEqual(route.path, '/channels/1/messages/2')
+        self.assertEqual(route.key, 'DELETE /channels/1/messages/{id}')
+        self.assertEqual(route.url('http://localhost/api'), 'http://localhost/api/channels/1/messages/2')
+
+
+class SimpleReceiverTests(unittest.TestCase):
+    def test_chunks_joined(self):
+        d = defer.Deferred()
+        receiver = SimpleReceiver(d)
+        for chunk in (b'{"a":', b' 1', b'}'):
+            receiver.dataReceived(chunk)
+        receiver.connectionLost(Failure(ResponseDone()))
+        self.assertEqual(self.successResultOf(d), b'{"a": 1}')
+
+
+class RESTClientTests(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        self.discord = FakeDiscord([]).start()
+        self.http = HTTPClient(api_base=self.discord.api_base)
+        self.rest = RESTClient(self.discord.token, http=self.http)
+        self.addCleanup(self.discord.stop)
+        self.addCleanup(self.http.close)
+
+    def requests(self):
+        return [(method, path) for method, path, body in self.discord.api.requests]
+
+    @defer.inlineCallbacks
+    def test_concurrent_gets_coalesced(self):
+        self.discord.api.routes[('GET', '/api/users/5')] = {'id': '5', 'username': 'five'}
+        first, second = yield defer.gatherResults([self.rest.get_user('5'), self.rest.get_user('5')])
+        self.assertEqual(first, {'id': '5', 'username': 'five'})
+        self.assertIs(first, second)
+        self.assertEqual(self.requests(), [('GET', '/api/users/5')])
+        self.assertEqual(self.rest.coalesced, 1)
+
+        yield self.rest.get_user('5')
+        self.assertEqual(len(self.requests()), 2)
+
+    @defer.inlineCallbacks
+    def test_coalesced_failure(self):
+        self.discord.api.routes[('GET', '/api/users/5')] = lambda request: request.setResponseCode(404) or {}
+        results = yield defer.DeferredList([self.rest.get_user('5'), self.rest.get_user('5')], consumeErrors=True)
+        for success, result in results:
+            self.assertFalse(success)
+            result.trap(HTTPError)
+        self.assertEqual(len(self.requests()), 1)
+
+    @defer.inlineCallbacks
+    def test_bulk_delete(self):
+        recent = time_snowflake(self.http.reactor.seconds() - 3600)
+        ids = [str(recent + i) for i in range(201)]
+        self.discord.api.routes[('POST', '/api/channels/1/messages/bulk-delete')] = None
+        self.discord.api.routes[('DELETE', '/api/channels/1/messages/' + ids[-1])] = None
+        yield self.rest.delete_messages('1', ids + ids[:10])
+        self.assertEqual(sorted(self.requests()), [
+            ('DELETE', '/api/channels/1/messages/' + ids[-1]),
+            ('POST', '/api/channels/1/messages/bulk-delete'),
+            ('POST', '/api/channels/1/messages/bulk-delete')
+        ])
+        bodies = [self.http.codec.loads(body) for method, path, body in self.discord.api.requests if method == 'POST']
+        self.assertEqual(sorted(len(body['messages']) for body in bodies), [100, 100])
+
+    @defer.inlineCallbacks
+    def test_old_messages_deleted_singly(self):
+        now = self.http.reactor.seconds()
+        old = str(time_snowflake(now - 15 * 24 * 3600))
+        recent = [str(time_snowflake(now - 60) + i) for i in range(2)]
+        for message_id in [old] + recent:
+            self.discord.api.routes[('DELETE', '/api/channels/1/messages/' + message_id)] = None
+        self.discord.api.routes[('POST', '/api/channels/1/messages/bulk-delete')] = None
+        yield self.rest.delete_messages('1', [old] + recent)
+        self.assertEqual(sorted(self.requests()), [
+            ('DELETE', '/api/channels/1/messages/' + old),
+            ('POST', '/api/channels/1/messages/bulk-delete')
+        ])
+        bodies = [self.http.codec.loads(body) for method, path, body in self.discord.api.requests if method == 'POST']
+        self.assertEqual(bodies, [{'messages': recent}])
+
+    @defer.inlineCallbacks
+    def test_query_encoded(self):
+        args = []
+        self.discord.api.routes[('GET', '/api/guilds/1/members')] = lambda request: args.append(request.args) or []
+        yield self.rest.request(Route('GET', '/guilds/{guild_id}/members', guild_id=1),
+                                params={'after': 'a&b=c', 'limit': 10, 'skip': None})
+        self.assertEqual(args, [{b'after': [b'a&b=c'], b'limit': [b'10']}])
+
+    @defer.inlineCallbacks
+    def test_history_paginated(self):
+        def history(request):
+            before = int(request.args.get(b'before', [b'1000'])[0])
+            limit = int(request.args[b'limit'][0])
+            return [{'id': str(i)} for i in range(before - 1, max(before - 1 - limit, 850), -1)]
+        self.discord.api.routes[('GET', '/api/channels/1/messages')] = history
+
+        messages = yield self.rest.get_messages('1', limit=250)
+        self.assertEqual([m['id'] for m in messages], [str(i) for i in range(999, 850, -1)])
+        self.assertEqual(len(self.requests()), 2)
+
+    @defer.inlineCallbacks
+    def test_send_message(self):
+        self.discord.api.routes[('POST', '/api/channels/1/messages')] = {'id': '2', 'content': 'hi'}
+        message = yield self.rest.send_message('1', 'hi')
+        self.assertEqual(message['id'], '2')
+        method, path, body = self.discord.api.requests[-1]
+        self.assertEqual(self.http.codec.loads(body), {'content': 'hi', 'tts': False})
@@ -0,0 +1,74 @@
+import json
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord.sendqueue import HEARTBEAT, IDENTIFY, PRESENCE, VOICE_STATE, SendQueue
+
+
+REQUEST_MEMBERS = 8
+
+
+class SendQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.written = []
+        self.queue = SendQueue(self.written.append, self.clock, limit=5, per=60.0, reserved=2)
+
+    def send(self, op, data):
+        self.queue.send(op, data, json.dumps({'op': op, 'd': data}))
+
+    def ops(self):
+        return [json.loads(payload)['op'] for payload in self.written]
+
+    def test_budget_enforced(self):
+        for i in range(5):
+            self.send(REQUEST_MEMBERS, {'guild_id': [str(i)]})
+        self.assertEqual(len(self.written), 3)
+        self.assertEqual(self.queue.depth(), 2)
+
+        self.clock.advance(60)
+        self.assertEqual(len(self.written), 5)
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_heartbeat_uses_reserved_slots(self):
+        for i in range(4):
+            self.send(REQUEST_MEMBERS, {'guild_id': [str(i)]})
+        self.send(HEARTBEAT, 1)
+        self.send(HEARTBEAT, 2)
+        self.assertEqual(self.ops(), [REQUEST_MEMBERS] * 3 + [HEARTBEAT, HEARTBEAT])
+
+    def test_control_frames_first(self):
+        for i in range(4):
+            self.send(REQUEST_MEMBERS, {'guild_id': [str(i)]})
+        self.send(IDENTIFY, {'token': 'token'})
+        self.clock.advance(60)
+        self.assertEqual(self.ops(), [REQUEST_MEMBERS] * 3 + [IDENTIFY, REQUEST_MEMBERS])
+
+    def test_superseded_updates_coalesced(self):
+        for i in range(3):
+            self.send(REQUEST_MEMBERS, {'guild_id': [str(i)]})
+        self.send(PRESENCE, {'status': 'idle'})
+        self.send(VOICE_STATE, {'guild_id': '1', 'channel_id': '2'})
+        self.send(VOICE_STATE, {'guild_id': '2', 'channel_id': '3'})
+        self.send(PRESENCE, {'status': 'online'})
+        self.send(VOICE_STATE, {'guild_id': '1', 'channel_id': None})
+        self.assertEqual(self.queue.depth(), 3)
+        self.assertEqual(self.queue.coalesced, 2)
+
+        self.clock.advance(60)
+        sent = [json.loads(payload) for payload in self.written[3:]]
+        self.assertEqual(sent, [
+            {'op': PRESENCE, 'd': {'status': 'online'}},
+            {'op': VOICE_STATE, 'd': {'guild_id': '1', 'channel_id': None}},
+            {'op': VOICE_STATE, 'd': {'guild_id': '2', 'channel_id': '3'}}
+        ])
+
+    def test_clear(self):
+        for i in range(5):
+            self.send(REQUEST_MEMBERS, {'guild_id': [str(i)]})
+        self.queue.clear()
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.send(PRESENCE, {'status': 'online'})
+        self.assertEqual(len(self.written), 4)
@@ -0,0 +1,127 @@
+import os
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from chord.client import Client
+from chord.errors import SnapshotError
+from chord.snapshot import Snapshot, write_snapshot
+from chord.state import ConnectionState
+from chord.testing import FakeDiscord
+from chord.util import HTTPClient
+
+
+def populated_state():
+    state = ConnectionState()
+    state.apply('READY', {
+        'session_id': 'abc',
+        'user': {'id': '1', 'username': 'chord'},
+        'guilds': [],
+        'private_channels': [{'id': '50', 'type': 'dm', 'recipients': [{'id': '2', 'username': 'b'}]}]
+    })
+    state.apply('GUILD_CREATE', {
+        'id': '100', 'name': 'guild', 'member_count': 2,
+        'roles': [{'id': '200', 'name': '@everyone', 'permissions': 0}],
+        'channels': [{'id': '300', 'name': 'general', 'type': 'text'}],
+        'members': [
+            {'user': {'id': '1', 'username': 'chord'}, 'roles': ['200'], 'nick': None},
+            {'user': {'id': '2', 'username': 'b'}, 'roles': [], 'nick': 'bee'}
+        ]
+    })
+    return state
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+
+    def test_round_trip(self):
+        write_snapshot(self.path, {'session_id': 'abc', 'sequence': 7, 'user_id': '1'},
+                       populated_state(), batch_size=1)
+        snapshot = Snapshot(self.path)
+        self.assertEqual(snapshot.meta['sequence'], 7)
+
+        state = ConnectionState()
+        snapshot.restore(state)
+        self.assertEqual(state.user.id, '1')
+        guild = state.get_guild('100')
+        self.assertEqual(guild.name, 'guild')
+        self.assertEqual(guild.roles['200'].name, '@everyone')
+        self.assertIs(state.get_channel('300'), guild.channels['300'])
+        self.assertEqual(sorted(guild.members), ['1', '2'])
+        self.assertEqual(state.get_member('100', '2').nick, 'bee')
+        self.assertIs(state.get_member('100', '2').user, state.get_user('2'))
+        self.assertIsNotNone(state.get_channel('50'))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_restore_iter_yields_per_batch(self):
+        write_snapshot(self.path, {}, populated_state(), batch_size=1)
+        state = ConnectionState()
+        steps = list(Snapshot(self.path).restore_iter(state))
+        self.assertTrue(len(steps) > 4)
+        self.assertEqual(sorted(state.get_guild('100').members), ['1', '2'])
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(b'{"session_id": "abc"}')
+        self.assertRaises(SnapshotError, Snapshot, self.path)
+
+    def test_truncated(self):
+        write_snapshot(self.path, {}, populated_state())
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+        with open(self.path, 'wb') as fp:
+            fp.write(data[:-10])
+        snapshot = Snapshot(self.path)
+        self.assertRaises(SnapshotError, snapshot.restore, ConnectionState())
+
+
+class ClientSnapshotTests(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.discord = FakeDiscord([]).start()
+        self.http = HTTPClient(api_base=self.discord.api_base)
+        self.addCleanup(self.discord.stop)
+        self.addCleanup(self.http.close)
+
+    def saved_client(self, **kwargs):
+        client = Client(token=self.discord.token, http=self.http, cache=True)
+        client.state = populated_state()
+        client._gateway = self.discord.gateway_url
+        client.factory = client.build_factory(client._gateway)
+        client.factory.session_id = 'abc'
+        client.factory.sequence = 42
+        client.save_snapshot(self.path, **kwargs)
+        return client
+
+    def test_token_not_saved_by_default(self):
+        self.saved_client()
+        self.assertNotIn('token', Snapshot(self.path).meta)
+        self.saved_client(include_token=True)
+        self.assertEqual(Snapshot(self.path).meta['token'], self.discord.token)
+
+    @defer.inlineCallbacks
+    def test_restore_and_resume(self):
+        self.saved_client()
+        client = Client(token=self.discord.token, http=self.http, cache=True, incremental=True)
+        resumed = defer.Deferred()
+
+        @client.event
+        def on_resumed(data):
+            resumed.callback(data)
+
+        meta = yield client.restore_snapshot(self.path)
+        self.assertEqual(meta['session_id'], 'abc')
+        self.assertEqual(sorted(client.state.get_guild('100').members), ['1', '2'])
+        self.assertEqual(client.state.user.id, '1')
+
+        yield client.connect()
+        yield resumed
+        self.assertEqual(self.discord.gateway.identifies, 0)
+        resume = [msg for msg in self.discord.gateway.received if msg['op'] == 6]
+        self.assertEqual(resume[0]['d']['session_id'], 'abc')
+        self.assertEqual(resume[0]['d']['seq'], 42)
+
+        yield client.disconnect('done')
@@ -0,0 +1,103 @@
+import json
+
+from twisted.trial import unittest
+
+from chord.codec import get_codec
+from chord.incremental import IncrementalParser
+from chord.snowflake import (IntIdCodec, convert_ids, increment, in_range, int_ids, process_id, snowflake_range,
+                             snowflake_time, time_snowflake, worker_id)
+from chord.state import ConnectionState
+
+
+class SnowflakeTests(unittest.TestCase):
+    snowflake = 175928847299117063
+
+    def test_fields(self):
+        self.assertEqual(snowflake_time(self.snowflake), 1462015105.796)
+        self.assertEqual(snowflake_time(str(self.snowflake)), 1462015105.796)
+        self.assertEqual(worker_id(self.snowflake), 1)
+        self.assertEqual(process_id(self.snowflake), 0)
+        self.assertEqual(increment(self.snowflake), 7)
+
+    def test_time_bounds(self):
+        low, high = time_snowflake(1462015105.796), time_snowflake(1462015105.796, high=True)
+        self.assertTrue(low <= self.snowflake <= high)
+        self.assertEqual(snowflake_time(low), snowflake_time(high))
+
+    def test_range(self):
+        after, before = snowflake_range(1462015105.796, 1462015105.796)
+        self.assertTrue(in_range(self.snowflake, after, before))
+        after, before = snowflake_range(start=1462015105.797)
+        self.assertIsNone(before)
+        self.assertFalse(in_range(self.snowflake, after, before))
+        self.assertTrue(in_range(self.snowflake))
+
+
+class IntIdTests(unittest.TestCase):
+    frame = {'op': 0, 's': 1, 't': 'GUILD_MEMBER_ADD', 'd': {
+        'guild_id': '10', 'roles': ['20', '21'], 'nick': '42',
+        'user': {'id': '30', 'username': '1234'},
+        'activities': [{'id': 'ec0b28a579ecb4bd'}]
+    }}
+    expected = {'op': 0, 's': 1, 't': 'GUILD_MEMBER_ADD', 'd': {
+        'guild_id': 10, 'roles': [20, 21], 'nick': '42',
+        'user': {'id': 30, 'username': '1234'},
+        'activities': [{'id': 'ec0b28a579ecb4bd'}]
+    }}
+
+    def test_hook(self):
+        data = json.dumps(self.frame)
+        self.assertEqual(json.loads(data, object_hook=int_ids), self.expected)
+        self.assertEqual(convert_ids(json.loads(data)), self.expected)
+
+    def test_codec(self):
+        for name in ('json', 'etf'):
+            codec = IntIdCodec(get_codec(name))
+            self.assertEqual(codec.loads(codec.dumps(self.frame)), self.expected)
+            self.assertEqual(codec.encoding, name)
+
+    def test_incremental_parser(self):
+        parser = IncrementalParser(json.dumps(self.frame), max_depth=2, slice_size=1, object_hook=int_ids)
+        list(parser.parse())
+        self.assertEqual(parser.result, self.expected)
+
+    def test_state(self):
+        state = ConnectionState(int_ids=True)
+        state.apply('GUILD_CREATE', convert_ids({
+            'id': '10', 'name': 'guild', 'roles': [{'id': '20'}], 'channels': [{'id': '11', 'type': 'text'}],
+            'members': [{'user': {'id': '30', 'username': 'a'}, 'roles': ['20']}]
+        }))
+        self.assertEqual(list(state.guilds), [10])
+        self.assertIs(state.get_guild('10'), state.get_guild(10))
+        self.assertEqual(state.get_member('10', '30').roles, (20,))
+        self.assertIsNotNone(state.get_channel(11))
+        self.assertIsNotNone(state.get_user('30'))
+
+    def test_repeated_ids_shared(self):
+        role_id = str(SnowflakeTests.snowflake)
+        state = ConnectionState(int_ids=True)
+        state.apply('GUILD_CREATE', json.loads(json.dumps({
+            'id': '175928847299117000', 'name': 'guild', 'roles': [{'id': role_id}], 'channels': [],
+            'members': [{'user': {'id': str(1000 + i), 'username': 'a'}, 'roles': [role_id]} for i in range(20)]
+        }), object_hook=int_ids))
+        guild = state.get_guild('175928847299117000')
+        role = guild.roles[int(role_id)]
+        self.assertEqual(set(id(member.roles[0]) for member in guild.members.values()), set([id(role.id)]))
+        self.assertEqual(set(id(member.guild_id) for member in guild.members.values()), set([id(guild.id)]))
+
+    def test_shared_ids_dropped_on_delete(self):
+        state = ConnectionState(int_ids=True)
+        other = ConnectionState(int_ids=True)
+        guild = convert_ids({
+            'id': '10', 'name': 'guild', 'roles': [{'id': '20'}, {'id': '21'}],
+            'channels': [{'id': '11', 'type': 'text', 'permission_overwrites': [{'id': '30', 'type': 'member'}]}],
+            'members': [{'user': {'id': '30', 'username': 'a'}, 'roles': ['20']}]
+        })
+        state.apply('GUILD_CREATE', guild)
+        self.assertEqual(sorted(state._ids), [10, 20, 21])
+        self.assertEqual(other._ids, {})
+
+        state.apply('GUILD_ROLE_DELETE', {'guild_id': 10, 'role_id': 21})
+        self.assertEqual(sorted(state._ids), [10, 20])
+        state.apply('GUILD_DELETE', {'id': 10})
+        self.assertEqual(state._ids, {})
@@ -0,0 +1,65 @@
+from twisted.trial import unittest
+
+from chord.state import ConnectionState
+
+
+def guild_payload():
+    return {
+        'id': '100',
+        'name': 'guild',
+        'region': 'us-east',
+        'member_count': 2,
+        'roles': [{'id': '200', 'name': '@everyone', 'permissions': 0}],
+        'channels': [{'id': '300', 'name': 'general', 'type': 'text'}],
+        'members': [
+            {'user': {'id': '1', 'username': 'a'}, 'roles': ['200'], 'nick': None},
+            {'user': {'id': '2', 'username': 'b'}, 'roles': [], 'nick': 'bee'}
+        ]
+    }
+
+
+class ConnectionStateTests(unittest.TestCase):
+    def setUp(self):
+        self.state = ConnectionState()
+        self.state.apply('GUILD_CREATE', guild_payload())
+
+    def test_guild_create(self):
+        guild = self.state.get_guild('100')
+        self.assertEqual(guild.name, 'guild')
+        self.assertEqual(sorted(guild.members), ['1', '2'])
+        self.assertIs(self.state.get_channel('300'), guild.channels['300'])
+        self.assertEqual(self.state.get_member('100', '1').roles, ('200',))
+        self.assertIs(self.state.get_member('100', '1').user, self.state.get_user('1'))
+
+    def test_slotted_models(self):
+        member = self.state.get_member('100', '2')
+        self.assertFalse(hasattr(member, '__dict__'))
+        self.assertRaises(AttributeError, setattr, member, 'extra', 1)
+
+    def test_incremental_updates(self):
+        self.state.apply('GUILD_MEMBER_UPDATE', {'guild_id': '100', 'user': {'id': '2', 'username': 'b2'}, 'roles': ['200']})
+        self.assertEqual(self.state.get_member('100', '2').roles, ('200',))
+        self.assertEqual(self.state.get_user('2').username, 'b2')
+        self.assertEqual(self.state.get_member('100', '2').nick, 'bee')
+
+        self.state.apply('GUILD_ROLE_UPDATE', {'guild_id': '100', 'role': {'id': '200', 'name': 'everyone'}})
+        self.assertEqual(self.state.get_guild('100').roles['200'].name, 'everyone')
+
+        self.state.apply('GUILD_MEMBER_REMOVE', {'guild_id': '100', 'user': {'id': '1'}})
+        self.assertIsNone(self.state.get_member('100', '1'))
+        self.assertEqual(self.state.get_guild('100').member_count, 1)
+
+        self.state.apply('CHANNEL_DELETE', {'id': '300', 'guild_id': '100'})
+        self.assertEqual(self.state.get_guild('100').channels, {})
+
+    def test_guild_delete(self):
+        self.state.apply('GUILD_DELETE', {'id': '100', 'unavailable': True})
+        self.assertTrue(self.state.get_guild('100').unavailable)
+        self.state.apply('GUILD_DELETE', {'id': '100'})
+        self.assertIsNone(self.state.get_guild('100'))
+        self.assertIsNone(self.state.get_channel('300'))
+
+    def test_events_for_uncached_entities_ignored(self):
+        self.state.apply('GUILD_MEMBER_ADD', {'guild_id': '999', 'user': {'id': '5'}})
+        self.state.apply('CHANNEL_UPDATE', {'id': '999'})
+        self.assertIsNone(self.state.get_user('5'))
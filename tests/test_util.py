@@ -1,45 +1,36 @@
-import sys
-
-from twisted.python import log
-from twisted.internet import defer, ssl, reactor
-
-log.startLogging(sys.stdout)
-
-from chord.protocol import DiscordClientFactory
-from chord.util import get_token, get_gateway
-from chord.errors import GatewayError, HTTPError, LoginError
-
-
-if __name__ == "__main__":
-    def error(failure):
-        #failure.trap(GatewayError, HTTPError, LoginError)
-        print(str(failure.value))
-
-    def create_client(gateway, token):
-        factory = DiscordClientFactory(gateway, reactor=reactor)
-        factory.token = token
-        if factory.isSecure:
-            reactor.connectSSL(factory.host, factory.port, factory, ssl.ClientContextFactory())
-        else:
-            reactor.connectTCP(factory.host, factory.port, factory)
-        return factory
-
-    def got_gateway(gateway, token):
-        print(repr([gateway, token]))
-        return create_client(gateway, token)
-
-    def got_token(token):
-        d = get_gateway(token, reactor=reactor)
-        d.addCallback(got_gateway, token)
-        return d
-
-    d = get_token('maxpowa1@gmail.com', 'notmy', reactor=reactor)
-    d.addCallback(got_token)
-    d.addErrback(error)
-
-    def all_done(ignored):
-        print('Tests did something...')
-        reactor.stop()
-
-    d.addCallback(all_done)
-    reactor.run()
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from chord.errors import LoginError
+from chord.testing import FakeDiscord
+from chord.util import HTTPClient, check_token, get_gateway, get_gateway_bot, get_user_for_token
+
+
+class RESTTests(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        self.discord = FakeDiscord([]).start()
+        self.http = HTTPClient(api_base=self.discord.api_base)
+        self.addCleanup(self.discord.stop)
+        self.addCleanup(self.http.close)
+
+    @defer.inlineCallbacks
+    def test_gateway(self):
+        url = yield get_gateway(self.discord.token, http=self.http)
+        self.assertEqual(url, self.discord.gateway_url)
+        url, shards = yield get_gateway_bot(self.discord.token, http=self.http)
+        self.assertEqual((url, shards), (self.discord.gateway_url, 1))
+
+    @defer.inlineCallbacks
+    def test_check_token(self):
+        token = yield check_token(self.discord.token, http=self.http)
+        self.assertEqual(token, self.discord.token)
+        yield self.assertFailure(check_token('wrong', http=self.http), LoginError)
+
+    @defer.inlineCallbacks
+    def test_user_for_token(self):
+        user = yield get_user_for_token(self.discord.token, http=self.http)
+        self.assertEqual(user['username'], 'chord')
+        method, path, body = self.discord.api.requests[-1]
+        self.assertEqual((method, path), ('GET', '/api/users/@me'))
@@ -0,0 +1,213 @@
+from twisted.internet import defer, reactor
+from twisted.internet.protocol import Factory
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from chord import voice
+from chord.client import Client
+from chord.reconnect import ReconnectCoordinator
+from chord.errors import VoiceError
+from chord.testing import FakeDiscord
+from chord.util import HTTPClient
+
+
+class RecordingConnection(object):
+    def __init__(self):
+        self.frames = []
+        self.skipped = 0
+        self.speaking_states = []
+
+    def send_frame(self, frame):
+        self.frames.append(frame)
+
+    def skip_frames(self, frames):
+        self.skipped += frames
+
+    def speaking(self, speaking=True):
+        self.speaking_states.append(speaking)
+
+
+class QueuedFrames(object):
+    underruns = 0
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def next_frame(self):
+        return self.frames.pop(0) if self.frames else None
+
+    def stop(self):
+        pass
+
+
+class PacketTests(unittest.TestCase):
+    def test_rtp_header(self):
+        header = voice.rtp_header(65535, 960, 1234)
+        self.assertEqual(len(header), voice.RTP_HEADER_SIZE)
+        self.assertEqual(header[:2], b'\x80\x78')
+        self.assertEqual(voice.parse_rtp_header(header), (65535, 960, 1234))
+
+    def test_discovery(self):
+        request = voice.discovery_request(1234)
+        self.assertEqual(len(request), 74)
+        self.assertEqual(voice.parse_discovery(request), (1, 1234, '', 0))
+        response = voice.discovery_response(1234, '203.0.113.5', 50000)
+        self.assertEqual(voice.parse_discovery(response), (2, 1234, '203.0.113.5', 50000))
+        self.assertIsNone(voice.parse_discovery(b'\x80\x78' + b'\x00' * 72))
+
+    def test_encryption_round_trip(self):
+        for mode in voice.supported_modes():
+            encryptor = voice.get_encryptor(mode)(b'k' * 32)
+            header = voice.rtp_header(1, 960, 1234)
+            packet = encryptor.encrypt(header, b'opus frame')
+            self.assertTrue(packet.startswith(header))
+            self.assertNotIn(b'opus frame', packet)
+            self.assertEqual(encryptor.decrypt(packet), b'opus frame')
+
+    def test_select_mode(self):
+        mode = voice.supported_modes()[0]
+        self.assertEqual(voice.select_mode(['xsalsa20_poly1305_suffix', mode]), mode)
+        self.assertRaises(VoiceError, voice.select_mode, ['plain'])
+
+
+class AudioPlayerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.connection = RecordingConnection()
+
+    def test_paced(self):
+        player = voice.AudioPlayer(self.connection, QueuedFrames([b'a', b'b', b'c']), self.clock)
+        done = player.start()
+        self.assertEqual(self.connection.frames, [b'a'])
+        self.clock.advance(voice.FRAME_DURATION)
+        self.assertEqual(self.connection.frames, [b'a', b'b'])
+        self.clock.pump([voice.FRAME_DURATION] * 10)
+        self.assertEqual(self.connection.frames, [b'a', b'b', b'c'] + [voice.SILENCE] * voice.TRAILING_SILENCE)
+        self.assertEqual(self.connection.speaking_states, [True, False])
+        stats = self.successResultOf(done)
+        self.assertEqual(stats['frames'], 3)
+        self.assertEqual(stats['late'], 0)
+
+    def test_late_tick_catches_up(self):
+        player = voice.AudioPlayer(self.connection, QueuedFrames([b'x'] * 20), self.clock)
+        player.start()
+        self.clock.advance(voice.FRAME_DURATION * 3)
+        self.assertEqual(len(self.connection.frames), 4)
+        self.clock.advance(voice.FRAME_DURATION * 8)
+        self.assertEqual(len(self.connection.frames), 4 + player.max_catch_up)
+        self.assertEqual(self.connection.skipped, 8 - player.max_catch_up)
+        self.assertEqual(player.stats()['late'], 2)
+
+    def test_stop(self):
+        player = voice.AudioPlayer(self.connection, QueuedFrames([b'x'] * 20), self.clock)
+        done = player.start()
+        player.stop()
+        self.assertEqual(self.successResultOf(done)['frames'], 1)
+        self.clock.advance(1)
+        self.assertEqual(len(self.connection.frames), 1)
+
+
+class EncoderThreadTests(unittest.TestCase):
+    timeout = 5
+
+    @defer.inlineCallbacks
+    def test_prebuffered(self):
+        class Upper(object):
+            def encode(self, data):
+                return data.upper()
+
+        frames = voice.EncoderThread(voice.OpusPacketSource([b'a', b'b', b'c']), Upper(), buffer_frames=2)
+        yield frames.start()
+        self.assertEqual([frames.next_frame() for _ in range(2)], [b'A', b'B'])
+        # The worker refills the buffer as frames are taken
+        for _ in range(100):
+            if frames.frames.qsize() == 2:
+                break
+            yield voice.task.deferLater(frames.reactor, 0.01, lambda: None)
+        self.assertEqual(frames.next_frame(), b'C')
+        self.assertIsNone(frames.next_frame())
+        self.assertIsNone(frames.next_frame())
+
+
+class VoiceConnectionTests(unittest.TestCase):
+    timeout = 10
+
+    def setUp(self):
+        ready = {'op': 0, 't': 'READY', 'd': {
+            'session_id': 'abc', 'user': {'id': '1', 'username': 'chord'}, 'guilds': [], 'private_channels': []
+        }}
+        self.discord = FakeDiscord([ready], voice=True).start()
+        self.http = HTTPClient(api_base=self.discord.api_base)
+        self.addCleanup(self.discord.stop)
+        self.addCleanup(self.http.close)
+
+    @defer.inlineCallbacks
+    def test_join_and_play(self):
+        client = Client(token=self.discord.token, http=self.http, compression=None, cache=True,
+                        coordinator=ReconnectCoordinator(identify_interval=0))
+        ready = client.wait_for('READY')
+        gateway = yield client.fetch_gateway()
+        yield client.connect(gateway)
+        yield ready
+
+        connection = yield client.join_voice('10', '11')
+        self.assertIs(client.voice_connections['10'], connection)
+        self.assertEqual(connection.ssrc, self.discord.voice.ssrc)
+        identify = self.discord.voice.gateway.received[0]['d']
+        self.assertEqual((identify['server_id'], identify['session_id'], identify['token']),
+                         ('10', 'voice-session', 'voice-token'))
+
+        packets = [b'frame %d' % i for i in range(25)]
+        stats = yield connection.play(voice.OpusPacketSource(packets))
+        self.assertEqual(stats['frames'], 25)
+        self.assertEqual(stats['underruns'], 0)
+
+        sink = self.discord.voice.sink
+        for _ in range(50):
+            if len(sink.packets) == 25 + voice.TRAILING_SILENCE:
+                break
+            yield voice.task.deferLater(client.reactor, 0.01, lambda: None)
+        frames = sink.frames()
+        self.assertEqual([frame[3] for frame in frames], packets + [voice.SILENCE] * voice.TRAILING_SILENCE)
+        self.assertEqual([frame[0] for frame in frames], list(range(len(frames))))
+        self.assertEqual([frame[1] for frame in frames], [i * voice.SAMPLES_PER_FRAME for i in range(len(frames))])
+        self.assertEqual(set(frame[2] for frame in frames), set([connection.ssrc]))
+        jitter = sink.jitter()
+        self.assertTrue(abs(jitter['mean_interval'] - voice.FRAME_DURATION) < 0.005, jitter)
+
+        speaking = [msg['d']['speaking'] for msg in self.discord.voice.gateway.received if msg['op'] == voice.SPEAKING]
+        self.assertEqual(speaking, [1, 0])
+
+        yield client.leave_voice('10')
+        self.assertEqual(client.voice_connections, {})
+
+        yield client.disconnect('done')
+
+    @defer.inlineCallbacks
+    def test_join_without_cache_matches_bot_user(self):
+        client = Client(token=self.discord.token, http=self.http, compression=None,
+                        coordinator=ReconnectCoordinator(identify_interval=0))
+        ready = client.wait_for('READY')
+        gateway = yield client.fetch_gateway()
+        yield client.connect(gateway)
+        yield ready
+        self.assertEqual(client.user_id, '1')
+
+        d = client.join_voice('10', '11')
+        client.dispatch('VOICE_STATE_UPDATE', {'guild_id': '10', 'user_id': '2', 'session_id': 'other-session'})
+        yield d
+        identify = self.discord.voice.gateway.received[0]['d']
+        self.assertEqual((identify['user_id'], identify['session_id']), ('1', 'voice-session'))
+
+        yield client.leave_voice('10')
+        yield client.disconnect('done')
+
+    @defer.inlineCallbacks
+    def test_connection_failed(self):
+        port = reactor.listenTCP(0, Factory(), interface='127.0.0.1')
+        endpoint = 'ws://127.0.0.1:{0}'.format(port.getHost().port)
+        yield port.stopListening()
+        connection = voice.VoiceConnection(endpoint, '10', '1', 'abc', 'voice-token')
+        yield self.assertFailure(connection.connect(), VoiceError)
+        code, reason = yield connection.closed
+        self.assertIsNone(code)